@@ -1,5 +1,5 @@
-import copy
 from datetime import datetime
+import asyncio
 import json
 import os
 import logging
@@ -16,7 +16,8 @@ from quart import (
     send_from_directory,
     render_template,
     session,
-    current_app
+    current_app,
+    websocket
 )
 
 from openai import AsyncAzureOpenAI
@@ -25,22 +26,44 @@ from azure.identity.aio import (
     get_bearer_token_provider
 )
 from backend.auth.auth_utils import get_authenticated_user_details
+from backend.auth.graph_groups import GraphGroupResolver
 from backend.security.ms_defender_utils import get_msdefender_user_json
-from backend.history.cosmosdbservice import CosmosConversationClient, CosmosPrivacyNoticeClient, CosmosSettingsClient, CosmosTokenClient
+from backend.history.conversation_cache import ConversationCache, InProcessCacheBackend, RedisCacheBackend
+from backend.history.cosmosdbservice import CosmosConversationClient, CosmosJobClient, CosmosPrivacyNoticeClient, CosmosSettingsClient, CosmosTokenClient
+from backend.history.cosmos_registry import CosmosClientRegistry
+from backend.history.indexing_policy import CONVERSATION_LIST_FIELDS
+from backend.history.shared_snapshots import snapshot_summary, snapshot_validators
+from backend.history.snapshot_cache import SharedSnapshotCache, encode_snapshot
+from backend.history.jobs import HistoryJobRunner, JobLimitExceeded, delete_all_conversations_handler, public_job
+from backend.openai_client_pool import AzureOpenAIClientPool
+from backend.resumable_streams import ResumableStreams, StreamGone
+from backend.ws_multiplexer import WebSocketMultiplexer
+from backend.stream_coalescing import coalesce_stream_deltas
+from backend.stream_lifecycle import StreamLifecycle, StreamMetrics
 from backend.settings import (
     app_settings,
-    MINIMUM_SUPPORTED_AZURE_OPENAI_PREVIEW_API_VERSION
+    MINIMUM_SUPPORTED_AZURE_OPENAI_PREVIEW_API_VERSION,
+    STREAM_OPTIONS_MINIMUM_PREVIEW_API_VERSION
 )
 from backend.utils import (
+    COMPACT_STREAM_MIMETYPE,
+    format_as_compact_ndjson,
     format_as_ndjson,
     format_stream_response,
     format_non_streaming_response,
     convert_to_pf_format,
+    decode_cursor,
+    encode_cursor,
     format_pf_non_streaming_response,
+    redact_secrets,
 )
 from backend.usersettings import UserSettingsManager
 from backend.tokens.token_limits import TokenLimits
-from backend.tokens.token_privileges import TokenPrivileges
+from backend.tokens.tokenizer import close_tokenizers, get_tokenizer
+from backend.tokens.privilege_cache import PrivilegeCache
+from backend.tokens.quota_context import QuotaContext
+from backend.tokens.stream_usage import StreamUsage
+from backend.tokens.usage_ledger import TokenUsageLedger
 import logging
 from quart import request, session, jsonify
 
@@ -192,6 +215,22 @@ def init_openai_client():
 
         # Authentication
         aoai_api_key = session.get("AZURE_OPENAI_KEY")
+
+        # Deployment
+        deployment = session.get("AZURE_OPENAI_MODEL")
+        if not deployment:
+            raise ValueError("AZURE_OPENAI_MODEL is required")
+
+        # Reuse the worker's pooled client (and its connections and cached token) when serving
+        openai_client_pool = getattr(current_app, "openai_client_pool", None)
+        if openai_client_pool:
+            return openai_client_pool.get_client(
+                endpoint=endpoint,
+                deployment=deployment,
+                api_version=app_settings.azure_openai.preview_api_version,
+                api_key=aoai_api_key
+            )
+
         ad_token_provider = None
         if not aoai_api_key:
             logging.debug("No AZURE_OPENAI_KEY found, using Azure Entra ID auth")
@@ -199,11 +238,6 @@ def init_openai_client():
                 DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default"
             )
 
-        # Deployment
-        deployment = session.get("AZURE_OPENAI_MODEL")
-        if not deployment:
-            raise ValueError("AZURE_OPENAI_MODEL is required")
-
         # Default Headers
         default_headers = {"x-ms-useragent": USER_AGENT}
 
@@ -233,9 +267,18 @@ def prepare_cosmosdb_client_parameters():
 
     return cosmosdb_endpoint, credentials
 
+def get_cosmosdb_client_parameters():
+    # Prefer the worker's shared registry; fall back to a per-call client outside of serving
+    client_registry = getattr(current_app, "cosmos_client_registry", None)
+    if client_registry:
+        return client_registry.cosmosdb_endpoint, client_registry.credential, client_registry
+
+    cosmosdb_endpoint, credentials = prepare_cosmosdb_client_parameters()
+    return cosmosdb_endpoint, credentials, None
+
 def init_cosmos_conversation_client():
     try:
-        cosmosdb_endpoint, credentials = prepare_cosmosdb_client_parameters()
+        cosmosdb_endpoint, credentials, client_registry = get_cosmosdb_client_parameters()
         return CosmosConversationClient(
             cosmosdb_endpoint=cosmosdb_endpoint,
             credential=credentials,
@@ -243,7 +286,9 @@ def init_cosmos_conversation_client():
             convos_container_name=f"{app_settings.chat_history.conversations_container}",
             deleted_convos_container_name=f"{app_settings.chat_history.container_deleted_convos}",
             shared_convos_container_name=f"{app_settings.chat_history.container_shared_convos}",
-            enable_message_feedback=app_settings.chat_history.enable_feedback
+            enable_message_feedback=app_settings.chat_history.enable_feedback,
+            client_registry=client_registry,
+            cache=get_conversation_cache()
         )
     except Exception as e:
         logging.exception("Exception in CosmosConversationClient initialization", e)
@@ -252,28 +297,45 @@ def init_cosmos_conversation_client():
 
 def init_cosmos_token_client():
     try:
-        cosmosdb_endpoint, credentials = prepare_cosmosdb_client_parameters()
+        cosmosdb_endpoint, credentials, client_registry = get_cosmosdb_client_parameters()
         return CosmosTokenClient(
             cosmosdb_endpoint=cosmosdb_endpoint,
             credential=credentials,
             database_name=f"{app_settings.chat_history.database_tokens}",
             token_container_name=f"{app_settings.chat_history.container_token_usage}",
-            user_privilege_container_name=f"{app_settings.chat_history.container_token_user_privileges}"
+            user_privilege_container_name=f"{app_settings.chat_history.container_token_user_privileges}",
+            client_registry=client_registry
         )
     except Exception as e:
         logging.exception("Exception in CosmosTokenClient initialization", e)
         return None
 
 
+def init_cosmos_job_client():
+    try:
+        cosmosdb_endpoint, credentials, client_registry = get_cosmosdb_client_parameters()
+        return CosmosJobClient(
+            cosmosdb_endpoint=cosmosdb_endpoint,
+            credential=credentials,
+            database_name=f"{app_settings.chat_history.database}",
+            jobs_container_name=f"{app_settings.chat_history.container_jobs}",
+            client_registry=client_registry
+        )
+    except Exception as e:
+        logging.exception("Exception in CosmosJobClient initialization", e)
+        return None
+
+
 def init_cosmos_privacy_notice_client():
     try:
-        cosmosdb_endpoint, credentials= prepare_cosmosdb_client_parameters()
+        cosmosdb_endpoint, credentials, client_registry = get_cosmosdb_client_parameters()
 
         return CosmosPrivacyNoticeClient(
             cosmosdb_endpoint=cosmosdb_endpoint,
             credential=credentials,
             database_name=f"{app_settings.chat_history.database_privacy_notice}",
-            responses_container_name=f"{app_settings.chat_history.container_responses}"
+            responses_container_name=f"{app_settings.chat_history.container_responses}",
+            client_registry=client_registry
         )
     except Exception as e:
         logging.exception("Exception in CosmosPrivacyNoticeClient initialization", e)
@@ -281,17 +343,331 @@ def init_cosmos_privacy_notice_client():
     
 def init_cosmos_settings_client():
     try:
-        cosmosdb_endpoint, credentials= prepare_cosmosdb_client_parameters()
+        cosmosdb_endpoint, credentials, client_registry = get_cosmosdb_client_parameters()
         return CosmosSettingsClient(
             cosmosdb_endpoint=cosmosdb_endpoint,
             credential=credentials,
             database_name=f"{app_settings.chat_history.database_settings}",
-            settings_container_name=f"{app_settings.chat_history.container_settings}"
+            settings_container_name=f"{app_settings.chat_history.container_settings}",
+            client_registry=client_registry
         )
     except Exception as e:
         logging.exception("Exception in CosmosSettingsClient initialization", e)
         return None
-    
+
+
+@bp.before_app_serving
+async def init_cosmos_client_registry():
+    current_app.cosmos_client_registry = None
+    if not app_settings.chat_history:
+        return
+
+    try:
+        cosmosdb_endpoint, credentials = prepare_cosmosdb_client_parameters()
+        current_app.cosmos_client_registry = CosmosClientRegistry(cosmosdb_endpoint, credentials)
+    except Exception as e:
+        logging.exception("Exception in CosmosClientRegistry initialization", e)
+
+
+@bp.before_app_serving
+async def init_resumable_streams():
+    current_app.resumable_streams = ResumableStreams(
+        max_events=app_settings.base_settings.sse_buffer_max_events,
+        ttl_seconds=app_settings.base_settings.sse_stream_ttl,
+        max_streams=app_settings.base_settings.sse_max_streams
+    )
+
+
+@bp.after_app_serving
+async def close_resumable_streams():
+    # Cancels generations still running; registered ahead of the OpenAI pool and the usage
+    # ledger so their upstream reads stop and their usage is settled before those close
+    resumable_streams = get_resumable_streams()
+    if resumable_streams:
+        await resumable_streams.close()
+        current_app.resumable_streams = None
+
+
+@bp.before_app_serving
+async def init_openai_client_pool():
+    current_app.openai_client_pool = AzureOpenAIClientPool(
+        max_connections=app_settings.azure_openai.max_connections,
+        max_keepalive_connections=app_settings.azure_openai.max_keepalive_connections,
+        keepalive_expiry=app_settings.azure_openai.keepalive_expiry,
+        default_headers={"x-ms-useragent": USER_AGENT}
+    )
+
+
+@bp.after_app_serving
+async def close_openai_client_pool():
+    openai_client_pool = getattr(current_app, "openai_client_pool", None)
+    if openai_client_pool:
+        logging.debug(f"Closing AzureOpenAIClientPool: {openai_client_pool.stats()}")
+        await openai_client_pool.close()
+        current_app.openai_client_pool = None
+
+
+@bp.before_app_serving
+async def init_token_usage_ledger():
+    current_app.token_usage_ledger = None
+    cosmos_token_client = init_cosmos_token_client()
+    if not cosmos_token_client:
+        return
+
+    current_app.token_usage_ledger = TokenUsageLedger(
+        cosmos_token_client,
+        flush_interval_seconds=app_settings.base_settings.token_usage_flush_interval
+    )
+    current_app.token_usage_ledger.start()
+
+
+@bp.after_app_serving
+async def close_token_usage_ledger():
+    token_usage_ledger = getattr(current_app, "token_usage_ledger", None)
+    if token_usage_ledger:
+        await token_usage_ledger.close()
+        await token_usage_ledger.cosmos_token_client.close()
+        current_app.token_usage_ledger = None
+
+
+@bp.before_app_serving
+async def init_history_job_runner():
+    current_app.history_job_runner = None
+    if not app_settings.chat_history or not app_settings.chat_history.container_jobs:
+        return
+
+    cosmos_job_client = init_cosmos_job_client()
+    if not cosmos_job_client:
+        return
+
+    current_app.history_job_runner = HistoryJobRunner(
+        cosmos_job_client,
+        # Builds the conversation client per job: the conversation cache is set up after this hook
+        handlers={"delete_all": delete_all_conversations_handler(init_cosmos_conversation_client)},
+        max_concurrency=app_settings.base_settings.history_jobs_max_concurrency,
+        max_active_per_user=app_settings.base_settings.history_jobs_max_per_user,
+        lease_seconds=app_settings.base_settings.history_jobs_lease
+    )
+    current_app.history_job_runner.start()
+
+
+@bp.after_app_serving
+async def close_history_job_runner():
+    history_job_runner = getattr(current_app, "history_job_runner", None)
+    if history_job_runner:
+        await history_job_runner.close()
+        current_app.history_job_runner = None
+
+
+@bp.after_app_serving
+async def close_tokenizer_pools():
+    close_tokenizers()
+
+
+@bp.before_app_serving
+async def init_privilege_cache():
+    current_app.privilege_cache = None
+    if not app_settings.chat_history:
+        return
+
+    current_app.privilege_cache = PrivilegeCache(
+        max_entries=app_settings.base_settings.privilege_cache_max_entries,
+        ttl_seconds=app_settings.base_settings.privilege_cache_ttl
+    )
+
+
+@bp.before_app_serving
+async def init_conversation_cache():
+    current_app.conversation_cache = None
+    if not app_settings.chat_history or not app_settings.base_settings.conversation_cache_enabled:
+        return
+
+    # A Redis-protocol store is shared by every worker. The in-process one only sees this
+    # worker's writes, so it is opt-in and only safe with a single worker
+    if app_settings.base_settings.conversation_cache_redis_url:
+        backend = RedisCacheBackend(app_settings.base_settings.conversation_cache_redis_url)
+    elif app_settings.base_settings.conversation_cache_in_process:
+        backend = InProcessCacheBackend(max_entries=app_settings.base_settings.conversation_cache_max_entries)
+    else:
+        return
+    current_app.conversation_cache = ConversationCache(backend, ttl_seconds=app_settings.base_settings.conversation_cache_ttl)
+
+
+@bp.after_app_serving
+async def close_conversation_cache():
+    conversation_cache = get_conversation_cache()
+    if conversation_cache:
+        await conversation_cache.close()
+        current_app.conversation_cache = None
+
+
+@bp.before_app_serving
+async def init_shared_snapshot_cache():
+    current_app.shared_snapshot_cache = None
+    if not app_settings.chat_history or not app_settings.base_settings.shared_snapshot_cache_enabled:
+        return
+
+    current_app.shared_snapshot_cache = SharedSnapshotCache(
+        max_bytes=app_settings.base_settings.shared_snapshot_cache_max_bytes,
+        ttl_seconds=app_settings.base_settings.shared_snapshot_cache_ttl
+    )
+
+
+@bp.before_app_serving
+async def init_websocket_connections():
+    current_app.websocket_connections = set()
+
+
+@bp.before_app_serving
+async def init_stream_metrics():
+    current_app.stream_metrics = StreamMetrics()
+
+
+@bp.before_app_serving
+async def compile_datasource_payload():
+    if app_settings.datasource:
+        app_settings.datasource.payload_template()
+
+
+@bp.before_app_serving
+async def init_graph_group_resolver():
+    current_app.graph_group_resolver = None
+    if not getattr(app_settings.datasource, "permitted_groups_column", None):
+        return
+
+    current_app.graph_group_resolver = GraphGroupResolver(
+        graph_endpoint=app_settings.base_settings.graph_endpoint,
+        ttl_seconds=app_settings.base_settings.graph_groups_cache_ttl,
+        max_groups=app_settings.base_settings.graph_groups_max,
+        timeout_seconds=app_settings.base_settings.graph_timeout
+    )
+
+
+@bp.after_app_serving
+async def close_graph_group_resolver():
+    graph_group_resolver = getattr(current_app, "graph_group_resolver", None)
+    if graph_group_resolver:
+        await graph_group_resolver.close()
+        current_app.graph_group_resolver = None
+
+
+# Quart runs after_app_serving hooks in registration order; registered after all the
+# others so that anything still flushing to Cosmos at shutdown runs first
+@bp.after_app_serving
+async def close_cosmos_client_registry():
+    client_registry = getattr(current_app, "cosmos_client_registry", None)
+    if client_registry:
+        logging.debug(f"Closing CosmosClientRegistry: {client_registry.stats()}")
+        await client_registry.close()
+        current_app.cosmos_client_registry = None
+
+
+def get_graph_group_resolver():
+    return getattr(current_app, "graph_group_resolver", None)
+
+
+def get_history_job_runner():
+    return getattr(current_app, "history_job_runner", None)
+
+
+def get_token_usage_ledger():
+    return getattr(current_app, "token_usage_ledger", None)
+
+
+def get_privilege_cache():
+    return getattr(current_app, "privilege_cache", None)
+
+
+def get_conversation_cache():
+    return getattr(current_app, "conversation_cache", None)
+
+
+def get_shared_snapshot_cache():
+    return getattr(current_app, "shared_snapshot_cache", None)
+
+
+def get_resumable_streams():
+    return getattr(current_app, "resumable_streams", None)
+
+
+def get_stream_metrics():
+    return getattr(current_app, "stream_metrics", None)
+
+
+def websocket_stats():
+    connections = getattr(current_app, "websocket_connections", None)
+    if connections is None:
+        return None
+    stats = {"connections": len(connections)}
+    for multiplexer in connections:
+        for key, value in multiplexer.stats().items():
+            stats[key] = stats.get(key, 0) + value
+    return stats
+
+
+def init_token_limits(cosmos_token_client):
+    return TokenLimits(
+        cosmos_token_client,
+        usage_ledger=get_token_usage_ledger(),
+        privilege_cache=get_privilege_cache()
+    )
+
+
+def is_admin_request():
+    authenticated_user = get_authenticated_user_details(request_headers=request.headers)
+    privilege_admins = (app_settings.base_settings.privilege_admins or "").split(",")
+    return authenticated_user["user_principal_id"] in [admin.strip() for admin in privilege_admins if admin.strip()]
+
+
+@bp.route("/metrics", methods=["GET"])
+async def pool_metrics():
+    # Pool sizes, counters and job stats are operator data: admins only
+    if not is_admin_request():
+        return jsonify({"error": "Forbidden"}), 403
+
+    client_registry = getattr(current_app, "cosmos_client_registry", None)
+    openai_client_pool = getattr(current_app, "openai_client_pool", None)
+    token_usage_ledger = get_token_usage_ledger()
+    privilege_cache = get_privilege_cache()
+    graph_group_resolver = get_graph_group_resolver()
+    history_job_runner = get_history_job_runner()
+    conversation_cache = get_conversation_cache()
+    shared_snapshot_cache = get_shared_snapshot_cache()
+    resumable_streams = get_resumable_streams()
+    stream_metrics = get_stream_metrics()
+    return jsonify({
+        "cosmos": client_registry.stats() if client_registry else None,
+        "azure_openai": openai_client_pool.stats() if openai_client_pool else None,
+        "token_usage_ledger": token_usage_ledger.stats() if token_usage_ledger else None,
+        "privilege_cache": privilege_cache.stats() if privilege_cache else None,
+        "tokenizer": get_tokenizer().stats(),
+        "graph_groups": graph_group_resolver.stats() if graph_group_resolver else None,
+        "history_jobs": history_job_runner.stats() if history_job_runner else None,
+        "conversation_cache": conversation_cache.stats() if conversation_cache else None,
+        "shared_snapshot_cache": shared_snapshot_cache.stats() if shared_snapshot_cache else None,
+        "resumable_streams": resumable_streams.stats() if resumable_streams else None,
+        "websockets": websocket_stats(),
+        "streams": stream_metrics.stats() if stream_metrics else None,
+    }), 200
+
+
+@bp.route("/admin/privileges/invalidate", methods=["POST"])
+async def invalidate_privileges():
+    if not is_admin_request():
+        return jsonify({"error": "Forbidden"}), 403
+
+    # Without a user_id every cached privilege is dropped. The cache is per worker and
+    # this only reaches the worker serving the request; the others pick the change up
+    # when their entries expire (PRIVILEGE_CACHE_TTL)
+    request_json = await request.get_json(silent=True) or {}
+    privilege_cache = get_privilege_cache()
+    invalidated = privilege_cache.invalidate(request_json.get("user_id")) if privilege_cache else 0
+    return jsonify({
+        "invalidated": invalidated,
+        "scope": "worker",
+        "other_workers_refresh_within_seconds": app_settings.base_settings.privilege_cache_ttl,
+    }), 200
+
 @bp.route("/get_user_id", methods=["GET"])
 def get_user_id():
     try: 
@@ -315,7 +691,7 @@ async def check_privacy_response():
         print(f"An error occurred: {e}")  # Log the error
         return jsonify({"error": "An internal server error occurred"})
     finally:
-        await cosmos_privacy_notice_client.cosmosdb_client.close()
+        await cosmos_privacy_notice_client.close()
 
 @bp.route("/privacy_notice", methods=["GET"])
 async def privacy_notice():
@@ -342,25 +718,29 @@ async def record_privacy_response():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
     finally:
-        await cosmos_privacy_notice_client.cosmosdb_client.close()
+        await cosmos_privacy_notice_client.close()
 
 
-async def check_user_token_limits(request_headers):
+async def load_quota_context(request_headers):
     cosmos_token_client = init_cosmos_token_client()
     try:
-        user_daily_cost_limit = await get_user_token_daily_limit(request_headers)
+        token_limits = init_token_limits(cosmos_token_client)
+        return await QuotaContext.load(token_limits, request_headers)
+    finally:
+        await cosmos_token_client.close()
 
-        token_limits = TokenLimits(cosmos_token_client)
-        today = datetime.utcnow().date().isoformat()
-        user_id = get_authenticated_user_details(request_headers)['user_principal_id']
-        current_cost = await token_limits.check_token_costs(user_id, today, today)
 
-        if current_cost >= user_daily_cost_limit:
-            logging.error(f"check_user_token_limits - error: Token limit exceeded")
-            return jsonify({"error": "Token limit exceeded! Try again tomorrow or email CookGPT@cookmedical.com to request an increase in tokens."}), 403
-        return None
-    finally:
-        await cosmos_token_client.cosmosdb_client.close()
+TOKEN_LIMIT_EXCEEDED_MESSAGE = "Token limit exceeded! Try again tomorrow or email CookGPT@cookmedical.com to request an increase in tokens."
+
+
+async def check_user_token_limits(request_headers, quota_context: QuotaContext = None):
+    if not quota_context:
+        quota_context = await load_quota_context(request_headers)
+
+    if quota_context.limit_exceeded():
+        logging.error(f"check_user_token_limits - error: Token limit exceeded")
+        return jsonify({"error": TOKEN_LIMIT_EXCEEDED_MESSAGE}), 403
+    return None
 
 
 
@@ -390,7 +770,7 @@ async def check_user_token_limits(request_headers):
 #             "temperature": app_settings.azure_openai.temperature
 #         }
 #     finally:
-#         await cosmos_settings_client.cosmosdb_client.close()
+#         await cosmos_settings_client.close()
 
 
 
@@ -450,54 +830,40 @@ async def prepare_model_args(request_body, request_headers):
         "user": user_json,
     }
 
+    if model_args["stream"] and stream_usage_supported():
+        # Ask for a final usage chunk so the stream can be billed in one write at the end
+        model_args["stream_options"] = {"include_usage": True}
+
     if app_settings.datasource:
+        filter_string = None
+        if getattr(app_settings.datasource, "permitted_groups_column", None):
+            filter_string = await app_settings.datasource.resolve_filter_string(request_headers, get_graph_group_resolver())
         model_args["extra_body"] = {
             "data_sources": [
-                app_settings.datasource.construct_payload_configuration(
-                    request=request
+                app_settings.datasource.build_payload(
+                    filter_string=filter_string,
+                    role_information=user_system_message
                 )
             ]
         }
-        model_args["extra_body"]["data_sources"][0]["parameters"]["role_information"] = user_system_message    
-    
 
-    model_args_clean = copy.deepcopy(model_args)
-    if model_args_clean.get("extra_body"):
-        secret_params = [
-            "key",
-            "connection_string",
-            "embedding_key",
-            "encoded_api_key",
-            "api_key",
-        ]
-        for secret_param in secret_params:
-            if model_args_clean["extra_body"]["data_sources"][0]["parameters"].get(
-                secret_param
-            ):
-                model_args_clean["extra_body"]["data_sources"][0]["parameters"][
-                    secret_param
-                ] = "*****"
-        authentication = model_args_clean["extra_body"]["data_sources"][0][
-            "parameters"
-        ].get("authentication", {})
-        for field in authentication:
-            if field in secret_params:
-                model_args_clean["extra_body"]["data_sources"][0]["parameters"][
-                    "authentication"
-                ][field] = "*****"
-        embeddingDependency = model_args_clean["extra_body"]["data_sources"][0][
-            "parameters"
-        ].get("embedding_dependency", {})
-        if "authentication" in embeddingDependency:
-            for field in embeddingDependency["authentication"]:
-                if field in secret_params:
-                    model_args_clean["extra_body"]["data_sources"][0]["parameters"][
-                        "embedding_dependency"
-                    ]["authentication"][field] = "*****"
+    # Redacting is only worth doing when someone will actually read the result
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"REQUEST BODY: {json.dumps(redact_secrets(model_args), indent=4)}")
 
     return model_args
 
 
+def stream_usage_supported():
+    # stream_options is rejected by preview API versions before 2024-07-01 and is not
+    # accepted together with data_sources; StreamUsage counts locally in those cases
+    return (
+        app_settings.azure_openai.stream_include_usage
+        and app_settings.azure_openai.preview_api_version >= STREAM_OPTIONS_MINIMUM_PREVIEW_API_VERSION
+        and not app_settings.datasource
+    )
+
+
 async def promptflow_request(request):
     try:
         headers = {
@@ -529,7 +895,26 @@ async def promptflow_request(request):
         logging.error(f"An error occurred while making promptflow_request: {e}")
 
 
-async def send_chat_request(request_body, request_headers):
+async def get_stored_message_token_counts(request_body, request_headers):
+    conversation_id = request_body.get("history_metadata", {}).get("conversation_id")
+    if not conversation_id or not app_settings.chat_history:
+        return {}
+
+    cosmos_conversation_client = init_cosmos_conversation_client()
+    if not cosmos_conversation_client:
+        return {}
+    try:
+        user_id = get_authenticated_user_details(request_headers)["user_principal_id"]
+        return await cosmos_conversation_client.get_message_token_counts(user_id, conversation_id)
+    except Exception:
+        # Counting the history locally is always a valid fallback
+        logging.exception("Exception while reading stored message token counts")
+        return {}
+    finally:
+        await cosmos_conversation_client.close()
+
+
+async def send_chat_request(request_body, request_headers, stream_usage: StreamUsage = None, quota_context: QuotaContext = None):
     filtered_messages = []
     messages = request_body.get("messages", [])
     for message in messages:
@@ -539,16 +924,21 @@ async def send_chat_request(request_body, request_headers):
     request_body['messages'] = filtered_messages
     model_args = await prepare_model_args(request_body, request_headers)
 
+    if not quota_context:
+        quota_context = await load_quota_context(request_headers)
     cosmos_token_client = init_cosmos_token_client()
 
     try:
         
-        token_limits = TokenLimits(cosmos_token_client)
-        total_user_prompt_tokens = 0
-        user_prompt_tokens = 0
-        for message in model_args["messages"]: 
-            user_prompt_tokens = token_limits.calculate_tokens(message["content"])
-            total_user_prompt_tokens += user_prompt_tokens
+        token_limits = init_token_limits(cosmos_token_client)
+        # History messages are re-sent every turn; their counts come from the stored message
+        # documents (or the tokenizer cache) so only the new message and system prompt are encoded
+        stored_token_counts = await get_stored_message_token_counts(request_body, request_headers)
+        prompt_token_counts = await token_limits.calculate_tokens_many(
+            [message["content"] for message in model_args["messages"]],
+            stored_counts=stored_token_counts
+        )
+        total_user_prompt_tokens = sum(prompt_token_counts)
 
         users_prompt_cost = token_limits.calculate_token_cost(
             tokens = {
@@ -558,23 +948,21 @@ async def send_chat_request(request_body, request_headers):
             model_used=model_args["model"]
         )
     
-        user_id = get_authenticated_user_details(request_headers)["user_principal_id"]
-        todays_token_usage_cost = await token_limits.get_todays_cost(user_id)
-        users_daily_token_cost_limit = await get_user_token_daily_limit(request_headers)
-
-        amount_left = users_daily_token_cost_limit - (todays_token_usage_cost + users_prompt_cost)
+        amount_left = quota_context.amount_left(users_prompt_cost)
 
         if amount_left < 0:
             logging.error(f"send_chat_request - User's prompt cost exceeds the daily allotted cost")
             raise Exception("User's prompt cost exceeds the daily allotted cost")
 
-        for message in model_args["messages"]:
-            entry = await token_limits.update_usage_from_message(
+        if stream_usage:
+            # Streamed prompts are billed together with the completion once the stream ends
+            stream_usage.estimated_prompt_tokens = total_user_prompt_tokens
+        else:
+            entry = await token_limits.update_usage_from_openai_response(
                 request_headers=request_headers,
-                message=message["content"],
-                model_used=model_args["model"],
-                message_type="input"
-            ) 
+                usage_data={'prompt_tokens': total_user_prompt_tokens, 'completion_tokens': 0},
+                model_used=model_args["model"]
+            )
         azure_openai_client = init_openai_client()
         raw_response = await azure_openai_client.chat.completions.with_raw_response.create(**model_args)
         response = raw_response.parse()
@@ -585,38 +973,21 @@ async def send_chat_request(request_body, request_headers):
         logging.exception("Exception in send_chat_request")
         raise e
     finally:
-        await cosmos_token_client.cosmosdb_client.close()
+        await cosmos_token_client.close()
 
     return response, apim_request_id
 
-async def get_user_token_daily_limit(request_headers):
-    cosmos_token_client = init_cosmos_token_client()
-    user_privilege = TokenPrivileges(cosmos_token_client)
-    try:
-        user_privilege_type = await user_privilege.check_user_token_privileges(request_headers)
-        if user_privilege_type == "super":
-            daily_limit_cost = app_settings.base_settings.daily_token_cost_limit_super
-        else: 
-            daily_limit_cost = app_settings.base_settings.daily_token_cost_limit_regular
-        return daily_limit_cost
-    finally:
-        await cosmos_token_client.cosmosdb_client.close()
-
 async def get_token_usage_percentage(request_headers):
-    cosmos_token_client = init_cosmos_token_client()
-    try:
-        token_limits = TokenLimits(cosmos_token_client)
-        percentage_used = await token_limits.calculate_daily_usage_percentage(request_headers)
-        
-        if isinstance(percentage_used, dict) and "error" in percentage_used:
-            logging.error(f"get_token_usage_percentage - error: {percentage_used['error']}")
-            return jsonify(percentage_used), 400
-        
-        return jsonify({"percentage_used": percentage_used}), 200
-    finally:
-        await cosmos_token_client.cosmosdb_client.close()
+    quota_context = await load_quota_context(request_headers)
+    percentage_used = quota_context.usage_percentage_remaining()
+
+    if isinstance(percentage_used, dict) and "error" in percentage_used:
+        logging.error(f"get_token_usage_percentage - error: {percentage_used['error']}")
+        return jsonify(percentage_used), 400
+
+    return jsonify({"percentage_used": percentage_used}), 200
 
-async def complete_chat_request(request_body, request_headers):
+async def complete_chat_request(request_body, request_headers, quota_context: QuotaContext = None):
     if app_settings.base_settings.use_promptflow:
         response = await promptflow_request(request_body)
         history_metadata = request_body.get("history_metadata", {})
@@ -627,7 +998,7 @@ async def complete_chat_request(request_body, request_headers):
             app_settings.promptflow.citations_field_name
         )
     else:
-        response, apim_request_id = await send_chat_request(request_body, request_headers)
+        response, apim_request_id = await send_chat_request(request_body, request_headers, quota_context=quota_context)
         history_metadata = request_body.get("history_metadata", {})
         formatted_response = format_non_streaming_response(response, history_metadata, apim_request_id)
         usage = response.usage if hasattr(response, 'usage') else {}
@@ -641,7 +1012,7 @@ async def complete_chat_request(request_body, request_headers):
         message_content = message.content
 
         cosmos_token_client = init_cosmos_token_client()
-        token_limits = TokenLimits(cosmos_token_client)
+        token_limits = init_token_limits(cosmos_token_client)
         selected_model = session.get("AZURE_OPENAI_SELECTED_MODEL", app_settings.azure_openai.model_v3)
         if message_content:
             entry = await token_limits.update_usage_from_message(
@@ -659,7 +1030,8 @@ async def complete_chat_request(request_body, request_headers):
             model_used=selected_model
         )
 
-        await cosmos_token_client.cosmosdb_client.close()
+        await token_limits.flush_usage(request_headers)
+        await cosmos_token_client.close()
         
 
         # # Add token usage data to the response
@@ -673,61 +1045,125 @@ async def complete_chat_request(request_body, request_headers):
         return formatted_response
 
 
-async def stream_chat_request(request_body, request_headers):
-    response, apim_request_id = await send_chat_request(request_body, request_headers)
-    history_metadata = request_body.get("history_metadata", {})
+async def stream_chat_request(request_body, request_headers, quota_context: QuotaContext = None):
     cosmos_token_client = init_cosmos_token_client()
-    token_limits = TokenLimits(cosmos_token_client)
+    token_limits = init_token_limits(cosmos_token_client)
     selected_model = session.get("AZURE_OPENAI_SELECTED_MODEL", app_settings.azure_openai.model_v3)
-    completion_tokens = 0
-    total_completion_tokens = 0
+    stream_usage = StreamUsage(token_limits, request_headers, selected_model)
+    lifecycle = StreamLifecycle(stream_usage, close_callbacks=[cosmos_token_client.close], metrics=get_stream_metrics())
+    try:
+        response, apim_request_id = await send_chat_request(request_body, request_headers, stream_usage=stream_usage, quota_context=quota_context)
+    except BaseException:
+        await lifecycle.close("failed", settle=False)
+        raise
+    lifecycle.open(response)
+    history_metadata = request_body.get("history_metadata", {})
+
     async def generate():
-        nonlocal total_completion_tokens
-        async for completionChunk in response:
-            response_obj = format_stream_response(completionChunk, history_metadata, apim_request_id)
-            if response_obj and ("choices" in response_obj) and (len(response_obj["choices"])>0):
-                messages = response_obj["choices"][0]["messages"]
-                message = messages[0]
-                content = message["content"]
-                role = message["role"]
-                if content and role == "assistant" and not content.startswith('{"citations": ['):
-                    entry = await token_limits.update_usage_from_message(
-                        request_headers=request_headers,
-                        message=content,
-                        model_used=selected_model,
-                        message_type="output"
-                    )
-                    completion_tokens = token_limits.calculate_tokens(content)
-                    total_completion_tokens += completion_tokens
-            yield response_obj
-        completion_cost = token_limits.calculate_token_cost(
-            tokens = {
-                'input': 0,
-                'output': total_completion_tokens
-            },
-            model_used=selected_model
-        )
+        # The lifecycle closes the upstream as soon as this generator stops, also when
+        # the client went away mid-stream, and settles usage exactly once
+        async with lifecycle:
+            async for completionChunk in response:
+                lifecycle.chunks += 1
+                stream_usage.observe_chunk(completionChunk)
+                response_obj = format_stream_response(completionChunk, history_metadata, apim_request_id)
+                if response_obj and ("choices" in response_obj) and (len(response_obj["choices"])>0):
+                    messages = response_obj["choices"][0]["messages"]
+                    message = messages[0]
+                    content = message["content"]
+                    role = message["role"]
+                    if content and role == "assistant" and not content.startswith('{"citations": ['):
+                        stream_usage.add_completion_text(content)
+                yield response_obj
+
+    # The caller binds the lifecycle to the task that reads the stream (close_with)
+    return generate(), lifecycle
+
+
+STREAM_FORMATS = {
+    "application/json-lines": "ndjson",
+    COMPACT_STREAM_MIMETYPE: "compact",
+    "text/event-stream": "sse",
+}
+
+
+def negotiated_stream_format():
+    # Opt-in with ?stream_format=compact|sse or by accepting that type ahead of the default one
+    if request.args.get("stream_format") in STREAM_FORMATS.values():
+        return request.args["stream_format"]
+    return STREAM_FORMATS[request.accept_mimetypes.best_match(list(STREAM_FORMATS), "application/json-lines")]
+
+
+async def sse_response(stream, last_event_id=0):
+    response = await make_response(await stream.sse(last_event_id, app_settings.base_settings.sse_heartbeat_seconds))
+    response.timeout = None
+    response.mimetype = "text/event-stream"
+    response.headers["Cache-Control"] = "no-cache"
+    # Keeps nginx-style proxies from buffering the events
+    response.headers["X-Accel-Buffering"] = "no"
+    response.headers["X-Stream-Id"] = stream.stream_id
+    return response
+
+
+@bp.route("/conversation/stream/<stream_id>", methods=["GET"])
+async def resume_stream(stream_id):
+    ## Reconnects to an SSE stream started by /conversation or /history/generate, replaying
+    ## the events after Last-Event-ID (header, or last_event_id for clients that can't set it)
+    authenticated_user = get_authenticated_user_details(request_headers=request.headers)
+    stream = get_resumable_streams().get(stream_id, authenticated_user["user_principal_id"])
+    if not stream:
+        return jsonify({"error": f"Stream {stream_id} was not found or has expired"}), 404
+
     try:
-        return generate()
-    finally:
-        await cosmos_token_client.cosmosdb_client.close()
+        last_event_id = int(request.headers.get("Last-Event-ID") or request.args.get("last_event_id") or 0)
+        return await sse_response(stream, last_event_id)
+    except ValueError:
+        return jsonify({"error": "Last-Event-ID is not an event of this stream"}), 400
+    except StreamGone:
+        return jsonify({"error": "The events after Last-Event-ID are no longer available"}), 410
+
+
+def coalesced_stream(result):
+    if app_settings.base_settings.stream_coalesce_window_ms <= 0:
+        return result
+    return coalesce_stream_deltas(
+        result,
+        window_seconds=app_settings.base_settings.stream_coalesce_window_ms / 1000,
+        max_bytes=app_settings.base_settings.stream_coalesce_max_bytes
+    )
 
 
 async def conversation_internal(request_body, request_headers):
     try:
-        token_limits_error_msg = await check_user_token_limits(request_headers)
+        # Privilege and today's usage are read once here and reused for every quota check below
+        quota_context = await load_quota_context(request_headers)
+        token_limits_error_msg = await check_user_token_limits(request_headers, quota_context)
         if token_limits_error_msg: 
             return token_limits_error_msg
 
         if app_settings.azure_openai.stream and not app_settings.base_settings.use_promptflow:
 
-            result = await stream_chat_request(request_body, request_headers)
-            response = await make_response(format_as_ndjson(result))
+            events, lifecycle = await stream_chat_request(request_body, request_headers, quota_context)
+            result = coalesced_stream(events)
+            stream_format = negotiated_stream_format()
+            if stream_format == "sse":
+                user_id = get_authenticated_user_details(request_headers=request_headers)["user_principal_id"]
+                stream = get_resumable_streams().start(user_id, result)
+                lifecycle.close_with(stream.task)
+                return await sse_response(stream)
+            # This task sends the response body, and ends without having started it when
+            # the client goes away before the first chunk
+            lifecycle.close_with(asyncio.current_task())
+            if stream_format == "compact":
+                response = await make_response(format_as_compact_ndjson(result))
+                response.mimetype = COMPACT_STREAM_MIMETYPE
+            else:
+                response = await make_response(format_as_ndjson(result))
+                response.mimetype = "application/json-lines"
             response.timeout = None
-            response.mimetype = "application/json-lines"
             return response
         else:
-            result = await complete_chat_request(request_body, request_headers)
+            result = await complete_chat_request(request_body, request_headers, quota_context)
             response = jsonify(result)
             return response
 
@@ -751,6 +1187,51 @@ async def conversation():
     return await conversation_internal(request_json, request.headers)
 
 
+async def chat_over_websocket(request_body, request_headers):
+    ## conversation_internal for the websocket: an event iterator, or (payload, status)
+    quota_context = await load_quota_context(request_headers)
+    if quota_context.limit_exceeded():
+        return {"error": TOKEN_LIMIT_EXCEEDED_MESSAGE}, 403
+
+    if app_settings.azure_openai.stream and not app_settings.base_settings.use_promptflow:
+        events, lifecycle = await stream_chat_request(request_body, request_headers, quota_context)
+        # Run by the multiplexer in the task that then reads the events
+        lifecycle.close_with(asyncio.current_task())
+        return coalesced_stream(events)
+    return await complete_chat_request(request_body, request_headers, quota_context), 200
+
+
+@bp.websocket("/ws")
+async def chat_websocket():
+    ## One connection, authenticated once, carrying the chat and history operations of
+    ## /conversation, /history/generate, /history/update and /history/message_feedback;
+    ## see WebSocketMultiplexer for the message format
+    authenticated_user = get_authenticated_user_details(request_headers=websocket.headers)
+    user_id = authenticated_user["user_principal_id"]
+    request_headers = websocket.headers
+
+    async def generate(body):
+        return await chat_over_websocket(await create_history_turn(user_id, body), request_headers)
+
+    multiplexer = WebSocketMultiplexer(
+        websocket.send,
+        {
+            "conversation": lambda body: chat_over_websocket(body, request_headers),
+            "generate": generate,
+            "update": lambda body: save_history_update(user_id, body),
+            "feedback": lambda body: save_message_feedback(user_id, body),
+        },
+        max_in_flight=app_settings.base_settings.ws_max_in_flight
+    )
+    current_app.websocket_connections.add(multiplexer)
+    try:
+        while True:
+            await multiplexer.dispatch(await websocket.receive())
+    finally:
+        current_app.websocket_connections.discard(multiplexer)
+        await multiplexer.close()
+
+
 @bp.route("/frontend_settings", methods=["GET"])
 def get_frontend_settings():
     try:
@@ -785,7 +1266,7 @@ def get_frontend_settings():
 #         return jsonify({'error': str(e)}), 500
 
 #     finally:
-#         await cosmos_settings_client.cosmosdb_client.close()
+#         await cosmos_settings_client.close()
     
 
 
@@ -799,16 +1280,27 @@ async def add_conversation():
     authenticated_user = get_authenticated_user_details(request_headers=request.headers)
     user_id = authenticated_user["user_principal_id"]
 
-    ## check request for conversation_id
     request_json = await request.get_json()
+    try:
+        request_body = await create_history_turn(user_id, request_json)
+        return await conversation_internal(request_body, request.headers)
+
+    except Exception as e:
+        logging.exception("Exception in /history/generate")
+        return jsonify({"error": str(e)}), 500
+
+
+async def create_history_turn(user_id, request_json):
+    ## Stores the user's message (in a new conversation when there is no conversation_id)
+    ## and returns the chat request body carrying the history_metadata
     conversation_id = request_json.get("conversation_id", None)
 
-    try:
-        # make sure cosmos is configured
-        cosmos_conversation_client= init_cosmos_conversation_client()
-        if not cosmos_conversation_client:
-            raise Exception("CosmosDB is not configured or not working")
+    # make sure cosmos is configured
+    cosmos_conversation_client= init_cosmos_conversation_client()
+    if not cosmos_conversation_client:
+        raise Exception("CosmosDB is not configured or not working")
 
+    try:
         # check for the conversation_id, if the conversation is not set, we will create a new one
         history_metadata = {}
         if not conversation_id:
@@ -838,18 +1330,11 @@ async def add_conversation():
                 )
         else:
             raise Exception("No user message found")
+    finally:
+        await cosmos_conversation_client.close()
 
-        await cosmos_conversation_client.cosmosdb_client.close()
-
-        # Submit request to Chat Completions for response
-        request_body = await request.get_json()
-        history_metadata["conversation_id"] = conversation_id
-        request_body["history_metadata"] = history_metadata
-        return await conversation_internal(request_body, request.headers)
-
-    except Exception as e:
-        logging.exception("Exception in /history/generate")
-        return jsonify({"error": str(e)}), 500
+    history_metadata["conversation_id"] = conversation_id
+    return {**request_json, "history_metadata": history_metadata}
 
 
 @bp.route("/history/update", methods=["POST"])
@@ -857,8 +1342,13 @@ async def update_conversation():
     authenticated_user = get_authenticated_user_details(request_headers=request.headers)
     user_id = authenticated_user["user_principal_id"]
 
-    ## check request for conversation_id
     request_json = await request.get_json()
+    result, status = await save_history_update(user_id, request_json)
+    return jsonify(result), status
+
+
+async def save_history_update(user_id, request_json):
+    ## check request for conversation_id
     conversation_id = request_json.get("conversation_id", None)
 
     try:
@@ -884,69 +1374,71 @@ async def update_conversation():
                     input_message=messages[-2],
                 )
             # write the assistant message
-            await cosmos_conversation_client.create_message(
+            createdMessageValue = await cosmos_conversation_client.create_message(
                 uuid=messages[-1]["id"],
                 conversation_id=conversation_id,
                 user_id=user_id,
                 input_message=messages[-1],
             )
+            if createdMessageValue == "Conversation not found":
+                raise Exception(
+                    "Conversation not found for the given conversation ID: "
+                    + conversation_id
+                    + "."
+                )
         else:
             raise Exception("No bot messages found")
 
         # Submit request to Chat Completions for response
-        await cosmos_conversation_client.cosmosdb_client.close()
-        response = {"success": True}
-        return jsonify(response), 200
+        await cosmos_conversation_client.close()
+        return {"success": True}, 200
 
     except Exception as e:
         logging.exception("Exception in /history/update")
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e)}, 500
 
 
 @bp.route("/history/message_feedback", methods=["POST"])
 async def update_message():
     authenticated_user = get_authenticated_user_details(request_headers=request.headers)
     user_id = authenticated_user["user_principal_id"]
-    cosmos_conversation_client= init_cosmos_conversation_client()
 
-    ## check request for message_id
     request_json = await request.get_json()
+    result, status = await save_message_feedback(user_id, request_json)
+    return jsonify(result), status
+
+
+async def save_message_feedback(user_id, request_json):
+    ## check request for message_id
     message_id = request_json.get("message_id", None)
     message_feedback = request_json.get("message_feedback", None)
-    try:
-        if not message_id:
-            return jsonify({"error": "message_id is required"}), 400
+    if not message_id:
+        return {"error": "message_id is required"}, 400
 
-        if not message_feedback:
-            return jsonify({"error": "message_feedback is required"}), 400
+    if not message_feedback:
+        return {"error": "message_feedback is required"}, 400
 
+    cosmos_conversation_client= init_cosmos_conversation_client()
+    try:
         ## update the message in cosmos
         updated_message = await cosmos_conversation_client.update_message_feedback(
             user_id, message_id, message_feedback
         )
         if updated_message:
-            return (
-                jsonify(
-                    {
-                        "message": f"Successfully updated message with feedback {message_feedback}",
-                        "message_id": message_id,
-                    }
-                ),
-                200,
-            )
+            return {
+                "message": f"Successfully updated message with feedback {message_feedback}",
+                "message_id": message_id,
+            }, 200
         else:
-            return (
-                jsonify(
-                    {
-                        "error": f"Unable to update message {message_id}. It either does not exist or the user does not have access to it."
-                    }
-                ),
-                404,
-            )
+            return {
+                "error": f"Unable to update message {message_id}. It either does not exist or the user does not have access to it."
+            }, 404
 
     except Exception as e:
         logging.exception("Exception in /history/message_feedback")
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e)}, 500
+    finally:
+        await cosmos_conversation_client.close()
 
 
 @bp.route("/history/delete", methods=["DELETE"])
@@ -968,13 +1460,12 @@ async def delete_conversation():
         if not cosmos_conversation_client:
             raise Exception("CosmosDB is not configured or not working")
         
-        soft_deleted_messages = await cosmos_conversation_client.soft_delete_messages(
-            conversation_id, user_id
-        )
-
+        ## messages and the conversation are moved to the deleted container together
         soft_deleted_conversation = await cosmos_conversation_client.soft_delete_conversation(
             user_id, conversation_id
         )
+        if soft_deleted_conversation["status"] == "failed":
+            raise Exception(soft_deleted_conversation["error"])
 
         # ## delete the conversation messages from cosmos first
         # deleted_messages = await cosmos_conversation_client.delete_messages(
@@ -986,7 +1477,7 @@ async def delete_conversation():
         #     user_id, conversation_id
         # )
 
-        await cosmos_conversation_client.cosmosdb_client.close()
+        await cosmos_conversation_client.close()
 
         return (
             jsonify(
@@ -1013,17 +1504,55 @@ async def list_conversations():
     if not cosmos_conversation_client:
         raise Exception("CosmosDB is not configured or not working")
 
-    ## get the conversations from cosmos
-    conversations = await cosmos_conversation_client.get_conversations(
-        user_id, offset=offset, limit=25
-    )
-    await cosmos_conversation_client.cosmosdb_client.close()
+    ## the list only returns what the history panel shows (see CONVERSATION_LIST_FIELDS);
+    ## offset paging is kept for older clients; everything else pages with the opaque cursor
+    ## returned in the X-History-Cursor header (absent on the last page)
+    cursor = request.args.get("cursor")
+    next_cursor = None
+    if cursor is None and "offset" in request.args:
+        conversations = await cosmos_conversation_client.get_conversations(
+            user_id, offset=offset, limit=25, fields=CONVERSATION_LIST_FIELDS
+        )
+    else:
+        try:
+            continuation_token = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            await cosmos_conversation_client.close()
+            return jsonify({"error": str(e)}), 400
+        conversations, continuation_token = await cosmos_conversation_client.get_conversations_page(
+            user_id, limit=25, continuation_token=continuation_token, fields=CONVERSATION_LIST_FIELDS
+        )
+        next_cursor = encode_cursor(continuation_token) if continuation_token else None
+    await cosmos_conversation_client.close()
     if not isinstance(conversations, list):
         return jsonify({"error": f"No conversations for {user_id} were found"}), 404
 
     ## return the conversation ids
 
-    return jsonify(conversations), 200
+    response = jsonify(conversations)
+    if next_cursor:
+        response.headers["X-History-Cursor"] = next_cursor
+    return response, 200
+
+
+def format_history_message(msg):
+    return {
+        "id": msg["id"],
+        "role": msg["role"],
+        "content": msg["content"],
+        "createdAt": msg["createdAt"],
+        "feedback": msg.get("feedback"),
+    }
+
+
+def parse_history_window(request_json):
+    ## optional "last N messages" window for /history/read; None means the whole conversation
+    last = request_json.get("last")
+    if last is None:
+        return None
+    if isinstance(last, bool) or not isinstance(last, int) or last < 1:
+        raise ValueError("last must be a positive integer")
+    return last
 
 
 @bp.route("/history/read", methods=["POST"])
@@ -1038,6 +1567,12 @@ async def get_conversation():
     if not conversation_id:
         return jsonify({"error": "conversation_id is required"}), 400
 
+    try:
+        last_n = parse_history_window(request_json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    before_id = request_json.get("before")
+
     ## make sure cosmos is configured
     cosmos_conversation_client= init_cosmos_conversation_client()
     if not cosmos_conversation_client:
@@ -1049,6 +1584,7 @@ async def get_conversation():
     )
     ## return the conversation id and the messages in the bot frontend format
     if not conversation:
+        await cosmos_conversation_client.close()
         return (
             jsonify(
                 {
@@ -1058,27 +1594,76 @@ async def get_conversation():
             404,
         )
 
+    ## "before" is the id of the oldest message the client already has
+    before = None
+    if before_id:
+        before_message = await cosmos_conversation_client.get_message(user_id, before_id)
+        if not before_message or before_message.get("conversationId") != conversation_id:
+            await cosmos_conversation_client.close()
+            return jsonify({"error": f"Message {before_id} is not part of conversation {conversation_id}"}), 400
+        before = before_message["createdAt"]
+
+    if request_json.get("stream"):
+        response = await make_response(format_as_ndjson(
+            stream_conversation_messages(
+                cosmos_conversation_client, user_id, conversation_id, last_n, before,
+                # Bound here: the body is iterated after the handler returned, outside the app context
+                add_background_task=current_app.add_background_task,
+            )
+        ))
+        response.timeout = None
+        response.mimetype = "application/json-lines"
+        return response
+
     # get the messages for the conversation from cosmos
-    conversation_messages = await cosmos_conversation_client.get_messages(
-        user_id, conversation_id
-    )
+    if last_n is None and before is None:
+        conversation_messages = await cosmos_conversation_client.get_messages(
+            user_id, conversation_id
+        )
+    else:
+        conversation_messages = [
+            msg async for msg in cosmos_conversation_client.iter_messages(user_id, conversation_id, last_n, before)
+        ]
+        conversation_messages.reverse()
 
     ## format the messages in the bot frontend format
-    messages = [
-        {
-            "id": msg["id"],
-            "role": msg["role"],
-            "content": msg["content"],
-            "createdAt": msg["createdAt"],
-            "feedback": msg.get("feedback"),
-        }
-        for msg in conversation_messages
-    ]
+    messages = [format_history_message(msg) for msg in conversation_messages]
 
-    await cosmos_conversation_client.cosmosdb_client.close()
+    if cosmos_conversation_client.owns_cosmosdb_client:
+        await cosmos_conversation_client.backfill_message_token_counts(user_id, conversation_messages)
+        await cosmos_conversation_client.close()
+    else:
+        # Shared clients outlive the request, so older messages are backfilled after responding
+        current_app.add_background_task(cosmos_conversation_client.backfill_message_token_counts, user_id, conversation_messages)
     return jsonify({"conversation_id": conversation_id, "messages": messages}), 200
 
 
+async def stream_conversation_messages(cosmos_conversation_client, user_id, conversation_id, last_n=None, before=None, add_background_task=None):
+    ## NDJSON body for /history/read with "stream": true: one line per message as Cosmos pages
+    ## arrive (newest first when windowed, see iter_messages), then a final line with
+    ## "end": true and "before", the id to pass back for the next older window (null when
+    ## there is nothing older). Only messages still missing token counts are kept for the backfill.
+    backfill = []
+    count = 0
+    oldest_id = None
+    try:
+        async for msg in cosmos_conversation_client.iter_messages(user_id, conversation_id, last_n, before):
+            count += 1
+            oldest_id = msg["id"]
+            if cosmos_conversation_client.needs_token_backfill(msg):
+                backfill.append(msg)
+            yield format_history_message(msg)
+        more = last_n is not None and count == last_n
+        yield {"conversation_id": conversation_id, "end": True, "count": count, "before": oldest_id if more else None}
+
+        if backfill and cosmos_conversation_client.owns_cosmosdb_client:
+            await cosmos_conversation_client.backfill_message_token_counts(user_id, backfill)
+        elif backfill:
+            add_background_task(cosmos_conversation_client.backfill_message_token_counts, user_id, backfill)
+    finally:
+        await cosmos_conversation_client.close()
+
+
 @bp.route("/history/rename", methods=["POST"])
 async def rename_conversation():
     authenticated_user = get_authenticated_user_details(request_headers=request.headers)
@@ -1091,16 +1676,21 @@ async def rename_conversation():
     if not conversation_id:
         return jsonify({"error": "conversation_id is required"}), 400
 
+    title = request_json.get("title", None)
+    if not title:
+        return jsonify({"error": "title is required"}), 400
+
     ## make sure cosmos is configured
     cosmos_conversation_client= init_cosmos_conversation_client()
     if not cosmos_conversation_client:
         raise Exception("CosmosDB is not configured or not working")
 
-    ## get the conversation from cosmos
-    conversation = await cosmos_conversation_client.get_conversation(
-        user_id, conversation_id
+    ## update only the title in cosmos, never a (possibly cached) copy of the whole document
+    updated_conversation = await cosmos_conversation_client.rename_conversation(
+        user_id, conversation_id, title
     )
-    if not conversation:
+    await cosmos_conversation_client.close()
+    if not updated_conversation:
         return (
             jsonify(
                 {
@@ -1110,16 +1700,6 @@ async def rename_conversation():
             404,
         )
 
-    ## update the title
-    title = request_json.get("title", None)
-    if not title:
-        return jsonify({"error": "title is required"}), 400
-    conversation["title"] = title
-    updated_conversation = await cosmos_conversation_client.upsert_conversation(
-        conversation
-    )
-
-    await cosmos_conversation_client.cosmosdb_client.close()
     return jsonify(updated_conversation), 200
 
 
@@ -1136,35 +1716,38 @@ async def delete_all_conversations():
         if not cosmos_conversation_client:
             raise Exception("CosmosDB is not configured or not working")
 
-        conversations = await cosmos_conversation_client.get_conversations(
-            user_id, offset=0, limit=None
-        )
-        if not conversations:
+        ## with a jobs container the delete runs in the background and the client polls /history/jobs/<id>
+        history_job_runner = get_history_job_runner()
+        if history_job_runner:
+            await cosmos_conversation_client.close()
+            try:
+                job = await history_job_runner.submit(user_id, "delete_all")
+            except JobLimitExceeded as e:
+                return jsonify({"error": str(e)}), 429
+            return jsonify(public_job(job)), 202
+
+        ## every conversation and message of the user is moved in partition batches, concurrently
+        results = await cosmos_conversation_client.soft_delete_all_conversations(user_id)
+        await cosmos_conversation_client.close()
+        if not results:
             return jsonify({"error": f"No conversations for {user_id} were found"}), 404
 
-        # delete each conversation
-        for conversation in conversations:
-            soft_deleted_messages = await cosmos_conversation_client.soft_delete_messages(
-                conversation["id"], user_id
-            )
-
-            soft_deleted_conversation = await cosmos_conversation_client.soft_delete_conversation(
-                user_id, conversation["id"]
+        failed = [conversation_id for conversation_id, result in results.items() if result["status"] == "failed"]
+        if failed:
+            return (
+                jsonify(
+                    {
+                        "error": f"Failed to delete {len(failed)} of {len(results)} conversations for user {user_id}",
+                        "results": results,
+                    }
+                ),
+                500,
             )
-            # ## delete the conversation messages from cosmos first
-            # deleted_messages = await cosmos_conversation_client.delete_messages(
-            #     conversation["id"], user_id
-            # )
-
-            # ## Now delete the conversation
-            # deleted_conversation = await cosmos_conversation_client.delete_conversation(
-            #     user_id, conversation["id"]
-            # )
-        await cosmos_conversation_client.cosmosdb_client.close()
         return (
             jsonify(
                 {
-                    "message": f"Successfully deleted conversation and messages for user {user_id}"
+                    "message": f"Successfully deleted conversation and messages for user {user_id}",
+                    "results": results,
                 }
             ),
             200,
@@ -1175,6 +1758,26 @@ async def delete_all_conversations():
         return jsonify({"error": str(e)}), 500
 
 
+@bp.route("/history/jobs/<job_id>", methods=["GET"])
+async def get_history_job(job_id):
+    authenticated_user = get_authenticated_user_details(request_headers=request.headers)
+    user_id = authenticated_user["user_principal_id"]
+
+    history_job_runner = get_history_job_runner()
+    if not history_job_runner:
+        return jsonify({"error": "History jobs are not configured"}), 404
+
+    try:
+        ## jobs are partitioned by user, so another user's job id is simply not found
+        job = await history_job_runner.get_job(user_id, job_id)
+        if not job:
+            return jsonify({"error": f"Job {job_id} was not found"}), 404
+        return jsonify(public_job(job)), 200
+    except Exception as e:
+        logging.exception("Exception in /history/jobs")
+        return jsonify({"error": str(e)}), 500
+
+
 @bp.route("/history/clear", methods=["POST"])
 async def clear_messages():
     ## get the user id from the request headers
@@ -1201,6 +1804,8 @@ async def clear_messages():
         soft_deleted_messages = await cosmos_conversation_client.soft_delete_messages(
             conversation_id, user_id
         )
+        if soft_deleted_messages["status"] == "failed":
+            raise Exception(soft_deleted_messages["error"])
 
         return (
             jsonify(
@@ -1229,7 +1834,7 @@ async def ensure_cosmos():
                 return jsonify({"error": err}), 422
             return jsonify({"error": "CosmosDB is not configured or not working"}), 500
 
-        await cosmos_conversation_client.cosmosdb_client.close()
+        await cosmos_conversation_client.close()
         return jsonify({"message": "CosmosDB is configured and working"}), 200
     except Exception as e:
         logging.exception("Exception in /history/ensure")
@@ -1301,6 +1906,10 @@ async def share_conversation(conversation_id):
         shared_conversation_id = await cosmos_conversation_client.share_conversation(user_id, conversation_id)
         
         if shared_conversation_id:
+            # Other workers pick the new snapshot up once their cached copy expires
+            shared_snapshot_cache = get_shared_snapshot_cache()
+            if shared_snapshot_cache:
+                shared_snapshot_cache.invalidate(shared_conversation_id)
             is_local = os.getenv('IS_LOCAL', 'False') == 'True'
             base_url = "http://127.0.0.1:50505" if is_local else f"https://{os.getenv('AZURE_WEBAPP_NAME')}.cookmedical.com"
             shareable_link = f"{base_url}/#/share/{shared_conversation_id}"
@@ -1312,26 +1921,111 @@ async def share_conversation(conversation_id):
         logging.exception("Exception in /api/share/<conversation_id>")
         return jsonify({"error": "An internal server error occurred"}), 500
     finally:
-        await cosmos_conversation_client.cosmosdb_client.close()
+        await cosmos_conversation_client.close()
 
 @bp.route("/api/get_shared_conversation/<shared_conversation_id>", methods=["GET"])
 async def get_shared_conversation(shared_conversation_id):
-    logging.info(f"Received request for shared conversation with ID: {shared_conversation_id}")
+    ## ?stream=true sends the snapshot as NDJSON: a summary line, one line per message
+    ## as its page is read, then {"end": true}
+    if request.args.get("stream", "").lower() == "true":
+        return await stream_shared_conversation_response(shared_conversation_id)
+
     try:
-        cosmos_conversation_client = init_cosmos_conversation_client()
-        conversation = await cosmos_conversation_client.get_shared_conversation(shared_conversation_id)
-        if not conversation:
+        shared_snapshot_cache = get_shared_snapshot_cache()
+        load = lambda: load_shared_snapshot(shared_conversation_id)
+        snapshot = await shared_snapshot_cache.get_or_load(shared_conversation_id, load) if shared_snapshot_cache else await load()
+    except Exception as e:
+        logging.exception(f"Exception in /api/get_shared_conversation/{shared_conversation_id}")
+        return jsonify({"error": "An internal server error occurred"}), 500
+
+    if not snapshot:
+        logging.error(f"Shared conversation with ID: {shared_conversation_id} not found")
+        return jsonify({"error": "Shared conversation not found"}), 404
+    return await shared_snapshot_response(snapshot)
+
+
+async def load_shared_snapshot(shared_conversation_id):
+    cosmos_conversation_client = init_cosmos_conversation_client()
+    try:
+        header = await cosmos_conversation_client.get_shared_header(shared_conversation_id)
+        if not header:
+            return None
+        messages = [message async for message in cosmos_conversation_client.iter_shared_messages(header)]
+    finally:
+        await cosmos_conversation_client.close()
+
+    etag, last_modified = snapshot_validators(header)
+    body = current_app.json.dumps({**snapshot_summary(header), "messages": messages}).encode()
+    return encode_snapshot(etag, last_modified, body)
+
+
+def shared_snapshot_not_modified(snapshot):
+    # If-None-Match takes precedence over If-Modified-Since when both are sent
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(snapshot.etag)
+    if request.if_modified_since and snapshot.last_modified:
+        return snapshot.last_modified <= request.if_modified_since
+    return False
+
+
+async def shared_snapshot_response(snapshot):
+    if shared_snapshot_not_modified(snapshot):
+        response = await make_response("", 304)
+    elif snapshot.gzip_body and request.accept_encodings["gzip"]:
+        response = await make_response(snapshot.gzip_body)
+        response.content_encoding = "gzip"
+        response.mimetype = "application/json"
+    else:
+        response = await make_response(snapshot.body)
+        response.mimetype = "application/json"
+
+    # Weak, since the gzip and identity encodings of a snapshot share the one ETag
+    response.set_etag(snapshot.etag, weak=True)
+    if snapshot.last_modified:
+        response.last_modified = snapshot.last_modified
+    # A re-share replaces the snapshot behind the same link, so clients revalidate
+    # once max-age has passed, which is a 304 whenever nothing changed
+    response.cache_control.private = True
+    response.cache_control.max_age = app_settings.base_settings.shared_conversation_max_age
+    response.cache_control.must_revalidate = True
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+async def stream_shared_conversation_response(shared_conversation_id):
+    cosmos_conversation_client = init_cosmos_conversation_client()
+    streaming = False
+    try:
+        header = await cosmos_conversation_client.get_shared_header(shared_conversation_id)
+        if not header:
             logging.error(f"Shared conversation with ID: {shared_conversation_id} not found")
             return jsonify({"error": "Shared conversation not found"}), 404
 
-        logging.info(f"Successfully retrieved shared conversation with ID: {shared_conversation_id}")
-        return jsonify(conversation)
+        response = await make_response(format_as_ndjson(
+            stream_shared_conversation(cosmos_conversation_client, header)
+        ))
+        response.timeout = None
+        response.mimetype = "application/json-lines"
+        streaming = True
+        return response
     except Exception as e:
         logging.exception(f"Exception in /api/get_shared_conversation/{shared_conversation_id}")
         return jsonify({"error": "An internal server error occurred"}), 500
     finally:
-        await cosmos_conversation_client.cosmosdb_client.close()
+        if not streaming:
+            await cosmos_conversation_client.close()
+
 
+async def stream_shared_conversation(cosmos_conversation_client, header):
+    try:
+        yield snapshot_summary(header)
+        count = 0
+        async for message in cosmos_conversation_client.iter_shared_messages(header):
+            count += 1
+            yield message
+        yield {"end": True, "count": count}
+    finally:
+        await cosmos_conversation_client.close()
 
 
 app = create_app()
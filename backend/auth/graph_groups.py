@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import Counter, OrderedDict
+
+import httpx
+
+GRAPH_ENDPOINT = "https://graph.microsoft.com/v1.0"
+
+
+class GraphGroupResolver:
+    '''
+    Resolves a signed-in user's transitive group membership through Microsoft Graph
+    and builds the Azure AI Search security filter for it.
+
+    Requests go through one shared httpx.AsyncClient. Pages are followed iteratively
+    up to max_groups, and the whole lookup is bounded by timeout_seconds so a slow
+    Graph response can't hold a chat request. Built filter strings are cached per
+    user, keyed by a hash of the access token (never the token itself), for
+    ttl_seconds; concurrent lookups for the same token share one Graph call.
+    Failed lookups are not cached and resolve to a filter that matches no groups.
+    '''
+
+    def __init__(
+        self,
+        graph_endpoint: str = GRAPH_ENDPOINT,
+        ttl_seconds: float = 300.0,
+        max_groups: int = 2000,
+        timeout_seconds: float = 5.0,
+        max_entries: int = 10000,
+        http_client: httpx.AsyncClient = None,
+        clock=time.monotonic
+    ):
+        self.graph_endpoint = graph_endpoint.rstrip("/")
+        self.ttl_seconds = ttl_seconds
+        self.max_groups = max_groups
+        self.timeout_seconds = timeout_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self.owns_http_client = http_client is None
+        self.http_client = http_client or httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout_seconds),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+        )
+        self._filters = OrderedDict()
+        self._loading = {}
+        self.counters = Counter()
+
+    @staticmethod
+    def _token_key(user_token):
+        return hashlib.sha256(user_token.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def build_filter_string(permitted_groups_column, group_ids):
+        return f"{permitted_groups_column}/any(g:search.in(g, '{', '.join(group_ids)}'))"
+
+    async def get_filter_string(self, user_token, permitted_groups_column):
+        key = (self._token_key(user_token), permitted_groups_column)
+        entry = self._filters.get(key)
+        if entry:
+            expires_at, filter_string = entry
+            if expires_at > self.clock():
+                self._filters.move_to_end(key)
+                self.counters['hits'] += 1
+                return filter_string
+            del self._filters[key]
+
+        task = self._loading.get(key)
+        if task is None:
+            self.counters['misses'] += 1
+            task = asyncio.ensure_future(self._load_filter_string(key, user_token, permitted_groups_column))
+            self._loading[key] = task
+            task.add_done_callback(lambda t: self._loading.pop(key, None))
+        else:
+            self.counters['coalesced'] += 1
+        return await asyncio.shield(task)
+
+    async def _load_filter_string(self, key, user_token, permitted_groups_column):
+        try:
+            group_ids = await asyncio.wait_for(self.fetch_group_ids(user_token), timeout=self.timeout_seconds)
+        except Exception as e:
+            self.counters['failures'] += 1
+            logging.error(f"Exception resolving user groups from Microsoft Graph: {e!r}")
+            return self.build_filter_string(permitted_groups_column, [])
+
+        if not group_ids:
+            logging.debug("No user groups found")
+        filter_string = self.build_filter_string(permitted_groups_column, group_ids)
+        self._filters[key] = (self.clock() + self.ttl_seconds, filter_string)
+        while len(self._filters) > self.max_entries:
+            self._filters.popitem(last=False)
+        return filter_string
+
+    async def fetch_group_ids(self, user_token):
+        headers = {"Authorization": "bearer " + user_token}
+        endpoint = f"{self.graph_endpoint}/me/transitiveMemberOf?$select=id&$top=999"
+        group_ids = []
+        while endpoint:
+            response = await self.http_client.get(endpoint, headers=headers)
+            self.counters['graph_requests'] += 1
+            if response.status_code != 200:
+                raise RuntimeError(f"Error fetching user groups: {response.status_code} {response.text}")
+
+            page = response.json()
+            group_ids.extend(group["id"] for group in page.get("value", []))
+            if len(group_ids) >= self.max_groups:
+                logging.warning(f"User is a member of at least {self.max_groups} groups; the search filter is capped")
+                return group_ids[:self.max_groups]
+            endpoint = page.get("@odata.nextLink")
+
+        return group_ids
+
+    def stats(self) -> dict:
+        return {
+            'cached_filters': len(self._filters),
+            'loading': len(self._loading),
+            **self.counters,
+        }
+
+    async def close(self):
+        if self.owns_http_client:
+            await self.http_client.aclose()
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import logging
+import random
+
+from azure.cosmos import exceptions
+
+# Cosmos DB caps a transactional batch at 100 operations and a 2 MB request body
+MAX_BATCH_OPERATIONS = 100
+MAX_BATCH_BYTES = 1800 * 1024
+
+
+class BulkSoftDeleter:
+    '''
+    Moves conversations and their messages from the live container to the deleted
+    container in transactional batches.
+
+    Both containers are partitioned by userId, so a user's documents are split into
+    chunks that fit in one batch; each chunk is upserted into the deleted container
+    and then deleted from the live one, so a failure part way through never loses a
+    document (at worst it is in both containers until the delete is retried). Only
+    the ids are loaded up front; the full documents of a chunk are read right before
+    it is moved, so memory stays bounded however large the user's history is. Chunks
+    run with bounded concurrency, throttled batches (429) are retried with jittered
+    exponential backoff, and a conversation document is only moved after all of its
+    messages, so a conversation that failed to delete is still listed and can be
+    deleted again.
+    '''
+
+    def __init__(
+        self,
+        convos_container_client,
+        deleted_convos_container_client,
+        max_concurrency: int = 8,
+        max_batch_operations: int = MAX_BATCH_OPERATIONS,
+        max_batch_bytes: int = MAX_BATCH_BYTES,
+        max_retries: int = 5,
+        backoff_seconds: float = 0.1,
+        sleep=asyncio.sleep
+    ):
+        self.convos_container_client = convos_container_client
+        self.deleted_convos_container_client = deleted_convos_container_client
+        self.max_concurrency = max_concurrency
+        self.max_batch_operations = max_batch_operations
+        self.max_batch_bytes = max_batch_bytes
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.sleep = sleep
+
+    async def load_documents(self, user_id, conversation_id=None) -> dict:
+        '''
+        Group the ids of the user's conversation and message documents by conversation id,
+        for one conversation or (without conversation_id) all of them, in a single
+        partition query. Only id, type and conversationId are loaded; the rest of each
+        document is read when its chunk is moved.
+        '''
+        parameters = [{'name': '@userId', 'value': user_id}]
+        query = "SELECT c.id, c.type, c.conversationId FROM c WHERE c.userId = @userId"
+        if conversation_id:
+            parameters.append({'name': '@conversationId', 'value': conversation_id})
+            query += " AND c.conversationId = @conversationId"
+
+        documents = {}
+        async for item in self.convos_container_client.query_items(query=query, parameters=parameters, partition_key=user_id):
+            if item.get('type') == 'message':
+                documents.setdefault(item['conversationId'], {'conversation': None, 'messages': []})['messages'].append(item)
+            elif item.get('type') == 'conversation':
+                documents.setdefault(item['id'], {'conversation': None, 'messages': []})['conversation'] = item
+
+        if conversation_id:
+            # Conversation documents don't carry a conversationId, so the parent is a point read
+            try:
+                conversation = await self.convos_container_client.read_item(item=conversation_id, partition_key=user_id)
+                if conversation.get('type') == 'conversation':
+                    documents.setdefault(conversation_id, {'conversation': None, 'messages': []})['conversation'] = {
+                        'id': conversation['id'], 'type': conversation['type']
+                    }
+            except exceptions.CosmosResourceNotFoundError:
+                pass
+        return documents
+
+    async def soft_delete(self, user_id, documents: dict, include_conversations: bool = True, on_progress=None) -> dict:
+        '''
+        Soft-delete the documents returned by load_documents. Returns a result per
+        conversation id: status ('deleted', 'not_found' or 'failed'), the number of
+        messages moved, whether the conversation document was moved and any error.
+        on_progress(done, total) is called as each conversation finishes.
+        '''
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        conversation_ids = list(documents)
+        done = 0
+
+        async def soft_delete_conversation(conversation_id):
+            nonlocal done
+            result = await self._soft_delete_conversation(
+                semaphore,
+                user_id,
+                conversation_id,
+                documents[conversation_id]['conversation'] if include_conversations else None,
+                documents[conversation_id]['messages']
+            )
+            done += 1
+            if on_progress:
+                on_progress(done, len(conversation_ids))
+            return result
+
+        if on_progress:
+            on_progress(0, len(conversation_ids))
+        results = await asyncio.gather(*(soft_delete_conversation(conversation_id) for conversation_id in conversation_ids))
+        return dict(zip(conversation_ids, results))
+
+    @staticmethod
+    def summarize(results: dict, max_failed_ids: int = 100) -> dict:
+        failed = [conversation_id for conversation_id, result in results.items() if result['status'] == 'failed']
+        return {
+            'conversations': len(results),
+            'deleted': sum(1 for result in results.values() if result['status'] == 'deleted'),
+            'messages_deleted': sum(result['messages_deleted'] for result in results.values()),
+            'failed': len(failed),
+            'failed_conversation_ids': failed[:max_failed_ids],
+        }
+
+    async def _soft_delete_conversation(self, semaphore, user_id, conversation_id, conversation, messages):
+        result = {'status': 'deleted', 'messages_deleted': 0, 'conversation_deleted': False}
+        if conversation is None and not messages:
+            result['status'] = 'not_found'
+            return result
+
+        try:
+            outcomes = await asyncio.gather(
+                *(
+                    self._move(semaphore, user_id, messages[start:start + self.max_batch_operations])
+                    for start in range(0, len(messages), self.max_batch_operations)
+                ),
+                return_exceptions=True
+            )
+            errors = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+            result['messages_deleted'] = sum(outcome for outcome in outcomes if not isinstance(outcome, BaseException))
+            if errors:
+                raise errors[0]
+
+            if conversation is not None:
+                await self._move(semaphore, user_id, [conversation])
+                result['conversation_deleted'] = True
+        except Exception as e:
+            logging.exception(f"BulkSoftDeleter: failed to soft-delete conversation {conversation_id}")
+            result['status'] = 'failed'
+            result['error'] = str(e)
+        return result
+
+    def _chunk(self, docs):
+        chunks = []
+        chunk, chunk_bytes = [], 0
+        for doc in docs:
+            doc_bytes = len(json.dumps(doc))
+            if chunk and (len(chunk) >= self.max_batch_operations or chunk_bytes + doc_bytes > self.max_batch_bytes):
+                chunks.append(chunk)
+                chunk, chunk_bytes = [], 0
+            chunk.append(doc)
+            chunk_bytes += doc_bytes
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    async def _read_documents(self, user_id, ids) -> list:
+        # Documents deleted in the meantime (e.g. by a concurrent request) are simply missing
+        query = "SELECT * FROM c WHERE c.userId = @userId AND ARRAY_CONTAINS(@ids, c.id)"
+        parameters = [{'name': '@userId', 'value': user_id}, {'name': '@ids', 'value': ids}]
+        return [doc async for doc in self.convos_container_client.query_items(query=query, parameters=parameters, partition_key=user_id)]
+
+    async def _move(self, semaphore, user_id, stubs) -> int:
+        moved = 0
+        async with semaphore:
+            docs = await self._read_documents(user_id, [stub['id'] for stub in stubs])
+            # The full documents may not fit in one request body
+            for chunk in self._chunk(docs):
+                await self._execute_batch(
+                    self.deleted_convos_container_client,
+                    [('upsert', (doc,)) for doc in chunk],
+                    user_id
+                )
+                await self._execute_batch(
+                    self.convos_container_client,
+                    [('delete', (doc['id'],)) for doc in chunk],
+                    user_id,
+                    skip_not_found=True
+                )
+                moved += sum(1 for doc in chunk if doc.get('type') == 'message')
+        return moved
+
+    async def _execute_batch(self, container_client, batch_operations, user_id, skip_not_found=False):
+        attempt = 0
+        while batch_operations:
+            try:
+                return await container_client.execute_item_batch(batch_operations=batch_operations, partition_key=user_id)
+            except exceptions.CosmosBatchOperationError as e:
+                if skip_not_found and e.status_code == 404:
+                    # Already gone (e.g. deleted by a concurrent request); the rest of the batch still has to go
+                    batch_operations = batch_operations[:e.error_index] + batch_operations[e.error_index + 1:]
+                    continue
+                if e.status_code != 429 or attempt >= self.max_retries:
+                    raise
+                retry_after_ms = (e.headers or {}).get('x-ms-retry-after-ms')
+            except exceptions.CosmosHttpResponseError as e:
+                if e.status_code != 429 or attempt >= self.max_retries:
+                    raise
+                retry_after_ms = (e.headers or {}).get('x-ms-retry-after-ms')
+
+            attempt += 1
+            backoff = self.backoff_seconds * (2 ** (attempt - 1)) * (1 + random.random())
+            if retry_after_ms:
+                backoff = max(backoff, float(retry_after_ms) / 1000)
+            logging.debug(f"BulkSoftDeleter: batch throttled, retry {attempt}/{self.max_retries} in {backoff:.2f}s")
+            await self.sleep(backoff)
+        return []
@@ -0,0 +1,297 @@
+import asyncio
+import json
+import logging
+import time
+from collections import Counter, OrderedDict
+
+
+class InProcessCacheBackend:
+    '''
+    Per-worker LRU store: entries expire after their TTL and the least recently used
+    ones are evicted past max_entries. Counters (incr) are kept in their own LRU of
+    the same size so they never evict entries.
+    '''
+
+    def __init__(self, max_entries: int = 1000, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._counters = OrderedDict()
+        self.evictions = 0
+
+    def _get(self, store, key):
+        entry = store.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= self.clock():
+            del store[key]
+            return None
+        store.move_to_end(key)
+        return value
+
+    def _set(self, store, key, value, ttl_seconds) -> int:
+        store[key] = (self.clock() + ttl_seconds, value)
+        store.move_to_end(key)
+        evicted = 0
+        while len(store) > self.max_entries:
+            store.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    async def get(self, key):
+        value = self._get(self._entries, key)
+        return value if value is not None else self._get(self._counters, key)
+
+    async def get_many(self, *keys):
+        return [await self.get(key) for key in keys]
+
+    async def set(self, key, value, ttl_seconds):
+        self.evictions += self._set(self._entries, key, value, ttl_seconds)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self._entries.pop(key, None)
+            self._counters.pop(key, None)
+
+    async def incr(self, key, ttl_seconds) -> int:
+        value = int(self._get(self._counters, key) or 0) + 1
+        self._set(self._counters, key, str(value), ttl_seconds)
+        return value
+
+    async def set_if(self, key, value, ttl_seconds, guard_key, expected) -> bool:
+        # Nothing awaits in between, so the check and the write are atomic within the worker
+        if await self.get(guard_key) != expected:
+            return False
+        await self.set(key, value, ttl_seconds)
+        return True
+
+    async def close(self):
+        self._entries.clear()
+        self._counters.clear()
+
+    def stats(self) -> dict:
+        return {'backend': 'memory', 'entries': len(self._entries), 'evictions': self.evictions}
+
+
+class RedisCacheBackend:
+    '''
+    Store shared by every worker in a Redis-protocol server. Entries expire with PX;
+    bounding memory is left to the server's maxmemory policy (allkeys-lru).
+    '''
+
+    def __init__(self, url: str, client=None):
+        if client is None:
+            # Only deployments that configure a Redis URL need the package
+            from redis import asyncio as redis
+            client = redis.from_url(url)
+        self.url = url
+        self.client = client
+
+    async def get(self, key):
+        value = await self.client.get(key)
+        return value.decode() if isinstance(value, bytes) else value
+
+    async def get_many(self, *keys):
+        return [value.decode() if isinstance(value, bytes) else value for value in await self.client.mget(*keys)]
+
+    async def set(self, key, value, ttl_seconds):
+        await self.client.set(key, value, px=max(1, int(ttl_seconds * 1000)))
+
+    async def delete(self, *keys):
+        if keys:
+            await self.client.delete(*keys)
+
+    async def incr(self, key, ttl_seconds) -> int:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.incr(key)
+            pipe.pexpire(key, max(1, int(ttl_seconds * 1000)))
+            value, _ = await pipe.execute()
+        return value
+
+    async def set_if(self, key, value, ttl_seconds, guard_key, expected) -> bool:
+        from redis.exceptions import WatchError
+
+        # WATCH makes the transaction fail if guard_key changes before EXEC
+        async with self.client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(guard_key)
+                current = await pipe.get(guard_key)
+                if (current.decode() if isinstance(current, bytes) else current) != expected:
+                    return False
+                pipe.multi()
+                pipe.set(key, value, px=max(1, int(ttl_seconds * 1000)))
+                await pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    async def close(self):
+        await self.client.aclose()
+
+    def stats(self) -> dict:
+        return {'backend': 'redis'}
+
+
+class ConversationCache:
+    '''
+    Read-through cache of a conversation document and its messages, keyed by
+    (userId, conversationId), in front of CosmosConversationClient.
+
+    Entries are stored as JSON so callers never share mutable documents with the
+    cache. Writes made through the client update the entry (new messages are appended,
+    conversation documents replaced) or drop it; anything written around the client
+    is picked up once the TTL runs out. Every write moves a per-conversation generation
+    on first, and entries are only stored if the generation is still the one read
+    before loading (or updating), so a load that started before a write can't put back
+    what the write changed. The backend is in-process by default or a
+    shared Redis-protocol store, so writes on one worker are seen by the others.
+    Backend failures are logged and treated as misses: the cache never fails a request.
+    '''
+
+    def __init__(self, backend, ttl_seconds: float = 60.0, key_prefix: str = 'conversation'):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.key_prefix = key_prefix
+        self.counters = Counter()
+
+    def _key(self, user_id, conversation_id):
+        return f"{self.key_prefix}:{user_id}:{conversation_id}"
+
+    async def get(self, user_id, conversation_id):
+        try:
+            value = await self.backend.get(self._key(user_id, conversation_id))
+        except Exception:
+            logging.exception("ConversationCache: read failed")
+            self.counters['errors'] += 1
+            return None
+        return json.loads(value) if value else None
+
+    def _generation_key(self, user_id, conversation_id):
+        return f"{self._key(user_id, conversation_id)}:generation"
+
+    async def _read(self, user_id, conversation_id):
+        ## (entry, generation) in one round trip, or None when the cache can't be read
+        try:
+            value, generation = await self.backend.get_many(
+                self._key(user_id, conversation_id), self._generation_key(user_id, conversation_id)
+            )
+        except Exception:
+            logging.exception("ConversationCache: read failed")
+            self.counters['errors'] += 1
+            return None
+        return (json.loads(value) if value else None), generation
+
+    async def _next_generation(self, user_id, conversation_id):
+        try:
+            return str(await self.backend.incr(self._generation_key(user_id, conversation_id), self.ttl_seconds))
+        except Exception:
+            logging.exception("ConversationCache: write failed")
+            self.counters['errors'] += 1
+            return None
+
+    async def _set_if_generation(self, user_id, conversation_id, entry, generation) -> bool:
+        try:
+            return await self.backend.set_if(
+                self._key(user_id, conversation_id),
+                json.dumps(entry),
+                self.ttl_seconds,
+                self._generation_key(user_id, conversation_id),
+                generation
+            )
+        except Exception:
+            logging.exception("ConversationCache: write failed")
+            self.counters['errors'] += 1
+            return False
+
+    async def _get_or_load(self, user_id, conversation_id, field, loader):
+        read = await self._read(user_id, conversation_id)
+        entry, generation = read or (None, None)
+        if entry and entry.get(field) is not None:
+            self.counters['hits'] += 1
+            return entry[field]
+        self.counters['misses'] += 1
+        value = await loader()
+        if read is None or value is None:
+            return value
+        # Only stored if nothing was written since the read above
+        if not await self._set_if_generation(user_id, conversation_id, {**(entry or {}), field: value}, generation):
+            self.counters['stale_loads'] += 1
+        return value
+
+    async def _update(self, user_id, conversation_id, update):
+        ## update(entry) returns the new entry, or None to drop it
+        generation = await self._next_generation(user_id, conversation_id)
+        entry = update(await self.get(user_id, conversation_id)) if generation else None
+        if entry is not None and await self._set_if_generation(user_id, conversation_id, entry, generation):
+            return
+        # Dropped, or another write got in between: the next read loads it again
+        if entry is not None:
+            self.counters['write_conflicts'] += 1
+        await self._delete(user_id, conversation_id)
+
+    async def _delete(self, user_id, *conversation_ids) -> bool:
+        try:
+            await self.backend.delete(*(self._key(user_id, conversation_id) for conversation_id in conversation_ids))
+            return True
+        except Exception:
+            logging.exception("ConversationCache: invalidation failed")
+            self.counters['errors'] += 1
+            return False
+
+    async def get_conversation(self, user_id, conversation_id, loader):
+        return await self._get_or_load(user_id, conversation_id, 'conversation', loader)
+
+    async def get_messages(self, user_id, conversation_id, loader):
+        return await self._get_or_load(user_id, conversation_id, 'messages', loader)
+
+    async def peek_messages(self, user_id, conversation_id):
+        entry = await self.get(user_id, conversation_id)
+        messages = entry.get('messages') if entry else None
+        self.counters['hits' if messages is not None else 'misses'] += 1
+        return messages
+
+    async def put_conversation(self, conversation, messages=None):
+        ## messages=None keeps whatever messages are already cached
+        def update(entry):
+            return {'conversation': conversation, 'messages': messages if messages is not None else (entry or {}).get('messages')}
+
+        await self._update(conversation['userId'], conversation['id'], update)
+
+    async def put_message(self, message, touch_conversation=True):
+        ## touch_conversation mirrors create_message bumping the conversation's updatedAt
+        def update(entry):
+            # Without an entry there is nothing to add to, but a load in flight must not
+            # store what it read before this message existed; dropping it moves the generation on
+            if not entry:
+                return None
+            messages = entry.get('messages')
+            if messages is not None:
+                index = next((i for i, m in enumerate(messages) if m['id'] == message['id']), None)
+                if index is None:
+                    messages.append(message)
+                else:
+                    messages[index] = message
+            if touch_conversation and entry.get('conversation') is not None:
+                entry['conversation']['updatedAt'] = message['createdAt']
+            return entry
+
+        await self._update(message['userId'], message['conversationId'], update)
+
+    async def invalidate(self, user_id, *conversation_ids):
+        if not conversation_ids:
+            return
+        await asyncio.gather(*(self._next_generation(user_id, conversation_id) for conversation_id in conversation_ids))
+        if await self._delete(user_id, *conversation_ids):
+            self.counters['invalidations'] += len(conversation_ids)
+
+    async def close(self):
+        await self.backend.close()
+
+    def stats(self) -> dict:
+        return {
+            **self.backend.stats(),
+            'hits': self.counters['hits'],
+            'misses': self.counters['misses'],
+            **{k: v for k, v in self.counters.items() if k not in ('hits', 'misses')},
+        }
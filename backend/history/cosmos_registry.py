@@ -0,0 +1,88 @@
+import logging
+from azure.cosmos.aio import CosmosClient
+
+
+def partition_key_path(container_properties: dict) -> str:
+    return container_properties.get('partitionKey', {}).get('paths', ['/id'])[0]
+
+
+class CosmosClientRegistry:
+    '''
+    Worker-lifetime pool of Cosmos clients.
+
+    One CosmosClient (and therefore one aiohttp session and connection pool)
+    is created per account endpoint and shared by every request served by the
+    worker. Database and container proxies are cached as well so that the
+    container properties they fetch lazily are only read once, and so is the
+    partition key path of the containers that need it.
+    '''
+
+    def __init__(self, cosmosdb_endpoint: str, credential: any):
+        self.cosmosdb_endpoint = cosmosdb_endpoint
+        self.credential = credential
+        self._cosmosdb_client = None
+        self._database_clients = {}
+        self._container_clients = {}
+        self._partition_key_paths = {}
+        self.clients_created = 0
+        self.proxies_served = 0
+
+    @property
+    def cosmosdb_client(self) -> CosmosClient:
+        if self._cosmosdb_client is None:
+            self._cosmosdb_client = CosmosClient(self.cosmosdb_endpoint, credential=self.credential)
+            self.clients_created += 1
+            logging.debug(f"CosmosClientRegistry: created shared CosmosClient for {self.cosmosdb_endpoint}")
+        return self._cosmosdb_client
+
+    def get_database_client(self, database_name: str):
+        self.proxies_served += 1
+        return self._database_client(database_name)
+
+    def _database_client(self, database_name: str):
+        database_client = self._database_clients.get(database_name)
+        if database_client is None:
+            database_client = self.cosmosdb_client.get_database_client(database_name)
+            self._database_clients[database_name] = database_client
+        return database_client
+
+    def get_container_client(self, database_name: str, container_name: str):
+        key = (database_name, container_name)
+        container_client = self._container_clients.get(key)
+        if container_client is None:
+            container_client = self._database_client(database_name).get_container_client(container_name)
+            self._container_clients[key] = container_client
+        self.proxies_served += 1
+        return container_client
+
+    async def get_partition_key_path(self, database_name: str, container_name: str) -> str:
+        # A container's partition key can't change, so one read() per worker is enough
+        key = (database_name, container_name)
+        path = self._partition_key_paths.get(key)
+        if path is None:
+            container_client = self._container_clients.get(key) or self.get_container_client(database_name, container_name)
+            path = partition_key_path(await container_client.read())
+            self._partition_key_paths[key] = path
+        return path
+
+    def stats(self) -> dict:
+        return {
+            "clients_created": self.clients_created,
+            "databases_cached": len(self._database_clients),
+            "containers_cached": len(self._container_clients),
+            "partition_key_paths_cached": len(self._partition_key_paths),
+            "proxies_served": self.proxies_served,
+        }
+
+    async def close(self):
+        self._database_clients.clear()
+        self._container_clients.clear()
+        self._partition_key_paths.clear()
+        if self._cosmosdb_client is not None:
+            await self._cosmosdb_client.close()
+            self._cosmosdb_client = None
+
+        # Only credentials we were handed as objects need closing; keys are plain strings
+        close_credential = getattr(self.credential, "close", None)
+        if close_credential:
+            await close_credential()
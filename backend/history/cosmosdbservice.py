@@ -1,3 +1,4 @@
+import asyncio
 import uuid
 from datetime import datetime
 from azure.cosmos.aio import CosmosClient
@@ -10,23 +11,45 @@ from datetime import datetime
 from flask import Flask, request
 from azure.identity import DefaultAzureCredential  
 import logging
+from backend.history.bulk_delete import BulkSoftDeleter
+from backend.history.conversation_cache import ConversationCache
+from backend.history.cosmos_registry import CosmosClientRegistry, partition_key_path
+from backend.history.shared_snapshots import build_snapshot, is_paged, page_stub, snapshot_summary
+from backend.tokens.tokenizer import TOKEN_ENCODING, content_hash, get_tokenizer
 
 class CosmosConversationClient():
     
-    def __init__(self, cosmosdb_endpoint: str, credential: any, database_name: str, convos_container_name: str, deleted_convos_container_name: str, shared_convos_container_name: str, enable_message_feedback: bool = False):
+    def __init__(self, cosmosdb_endpoint: str, credential: any, database_name: str, convos_container_name: str, deleted_convos_container_name: str, shared_convos_container_name: str, enable_message_feedback: bool = False, client_registry: CosmosClientRegistry = None, cache: ConversationCache = None):
         self.cosmosdb_endpoint = cosmosdb_endpoint
         self.credential = credential
         self.database_name = database_name
+        self.cache = cache
         self.convos_container_name = convos_container_name
         self.deleted_convos_container_name = deleted_convos_container_name
         self.shared_convos_container_name = shared_convos_container_name
 
-        self.cosmosdb_client = CosmosClient(self.cosmosdb_endpoint, credential=credential)
-        self.database_client = self.cosmosdb_client.get_database_client(database_name)
-        self.convos_container_client = self.database_client.get_container_client(convos_container_name)
-        self.deleted_convos_container_client = self.database_client.get_container_client(deleted_convos_container_name)
-        self.shared_convos_container_client = self.database_client.get_container_client(shared_convos_container_name)
+        if client_registry:
+            self.cosmosdb_client = client_registry.cosmosdb_client
+            self.database_client = client_registry.get_database_client(database_name)
+            self.convos_container_client = client_registry.get_container_client(database_name, convos_container_name)
+            self.deleted_convos_container_client = client_registry.get_container_client(database_name, deleted_convos_container_name)
+            self.shared_convos_container_client = client_registry.get_container_client(database_name, shared_convos_container_name)
+        else:
+            self.cosmosdb_client = CosmosClient(self.cosmosdb_endpoint, credential=credential)
+            self.database_client = self.cosmosdb_client.get_database_client(database_name)
+            self.convos_container_client = self.database_client.get_container_client(convos_container_name)
+            self.deleted_convos_container_client = self.database_client.get_container_client(deleted_convos_container_name)
+            self.shared_convos_container_client = self.database_client.get_container_client(shared_convos_container_name)
+        self.client_registry = client_registry
+        self.owns_cosmosdb_client = client_registry is None
+        self._shared_partition_key = None
         self.enable_message_feedback = enable_message_feedback
+        self.bulk_deleter = BulkSoftDeleter(self.convos_container_client, self.deleted_convos_container_client)
+
+    async def close(self):
+        # Shared clients belong to the registry and are closed when the worker stops serving
+        if self.owns_cosmosdb_client:
+            await self.cosmosdb_client.close()
 
     async def ensure(self):
         if not self.cosmosdb_client or not self.database_client or not self.convos_container_client or not self.deleted_convos_container_client:
@@ -58,6 +81,8 @@ class CosmosConversationClient():
         ## TODO: add some error handling based on the output of the upsert_item call
         resp = await self.convos_container_client.upsert_item(conversation)  
         if resp:
+            if self.cache:
+                await self.cache.put_conversation(resp, messages=[])
             return resp
         else:
             return False
@@ -65,10 +90,30 @@ class CosmosConversationClient():
     async def upsert_conversation(self, conversation):
         resp = await self.convos_container_client.upsert_item(conversation)
         if resp:
+            if self.cache:
+                await self.cache.put_conversation(resp)
             return resp
         else:
             return False
 
+    async def rename_conversation(self, user_id, conversation_id, title):
+        ## patches only the title, so fields another worker wrote in the meantime (updatedAt,
+        ## the shared id) are kept; the document the server returns refreshes the cache
+        try:
+            resp = await self.convos_container_client.patch_item(
+                item=conversation_id,
+                partition_key=user_id,
+                patch_operations=[{'op': 'set', 'path': '/title', 'value': title}],
+                filter_predicate="from c where c.type = 'conversation'"
+            )
+        except exceptions.CosmosHttpResponseError as e:
+            if e.status_code in (404, 412):
+                return None
+            raise
+        if self.cache:
+            await self.cache.put_conversation(resp)
+        return resp
+
     # async def delete_conversation(self, user_id, conversation_id):
     #     conversation = await self.convos_container_client.read_item(item=conversation_id, partition_key=user_id)        
     #     if conversation:
@@ -78,14 +123,19 @@ class CosmosConversationClient():
     #         return True
 
     async def soft_delete_conversation(self, user_id, conversation_id):
-        conversation = await self.convos_container_client.read_item(item=conversation_id, partition_key=user_id)
-
-        if conversation: 
-            resp = await self.deleted_convos_container_client.upsert_item(conversation)
-            await self.convos_container_client.delete_item(item=conversation_id, partition_key=user_id)
-            return resp
-        else: 
-            return True
+        ## moves the conversation and all of its messages to the deleted container
+        documents = await self.bulk_deleter.load_documents(user_id, conversation_id)
+        results = await self.bulk_deleter.soft_delete(user_id, documents)
+        if self.cache:
+            await self.cache.invalidate(user_id, conversation_id)
+        return results.get(conversation_id, {'status': 'not_found', 'messages_deleted': 0, 'conversation_deleted': False})
+
+    async def soft_delete_all_conversations(self, user_id, on_progress=None):
+        documents = await self.bulk_deleter.load_documents(user_id)
+        results = await self.bulk_deleter.soft_delete(user_id, documents, on_progress=on_progress)
+        if self.cache:
+            await self.cache.invalidate(user_id, *results)
+        return results
         
     # async def delete_messages(self, conversation_id, user_id):
     #     ## get a list of all the messages in the conversation
@@ -98,24 +148,25 @@ class CosmosConversationClient():
     #         return response_list
 
     async def soft_delete_messages(self, conversation_id, user_id):
-        ## get a list of all the messages in the conversation
-        messages = await self.get_messages(user_id, conversation_id)
-        response_list = []
-        if messages:
-            for message in messages:
-                resp = await self.deleted_convos_container_client.upsert_item(message)
-                await self.convos_container_client.delete_item(item=message['id'], partition_key=user_id)
-                response_list.append(resp)
-            return response_list
-
-    async def get_conversations(self, user_id, limit, sort_order = 'DESC', offset = 0):
+        ## moves the conversation's messages to the deleted container, keeping the conversation itself
+        documents = await self.bulk_deleter.load_documents(user_id, conversation_id)
+        results = await self.bulk_deleter.soft_delete(user_id, documents, include_conversations=False)
+        if self.cache:
+            await self.cache.invalidate(user_id, conversation_id)
+        return results.get(conversation_id, {'status': 'not_found', 'messages_deleted': 0, 'conversation_deleted': False})
+
+    def _select_list(self, fields):
+        ## project only what the caller needs instead of SELECT *
+        return ", ".join(f"c.{field}" for field in fields) if fields else "*"
+
+    async def get_conversations(self, user_id, limit, sort_order = 'DESC', offset = 0, fields = None):
         parameters = [
             {
                 'name': '@userId',
                 'value': user_id
             }
         ]
-        query = f"SELECT * FROM c where c.userId = @userId and c.type='conversation' order by c.updatedAt {sort_order}"
+        query = f"SELECT {self._select_list(fields)} FROM c where c.userId = @userId and c.type='conversation' order by c.updatedAt {sort_order}"
         if limit is not None:
             query += f" offset {offset} limit {limit}" 
             
@@ -124,23 +175,44 @@ class CosmosConversationClient():
             conversations.append(item)
         return conversations
 
-    async def get_conversation(self, user_id, conversation_id):
+    async def get_conversations_page(self, user_id, limit, continuation_token=None, sort_order='DESC', fields=None):
+        ## keyset paging on the SDK's continuation token: a page costs the same however deep it is,
+        ## where OFFSET has the engine read and discard every skipped conversation
         parameters = [
-            {
-                'name': '@conversationId',
-                'value': conversation_id
-            },
             {
                 'name': '@userId',
                 'value': user_id
             }
         ]
-        query = f"SELECT * FROM c where c.id = @conversationId and c.type='conversation' and c.userId = @userId"
-        conversations=[]
-        async for item in self.convos_container_client.query_items(query=query, parameters=parameters):
-            conversations.append(item)
-        return conversations[0] if conversations else None
- 
+        query = f"SELECT {self._select_list(fields)} FROM c where c.userId = @userId and c.type='conversation' order by c.updatedAt {sort_order}"
+        pages = self.convos_container_client.query_items(
+            query=query,
+            parameters=parameters,
+            partition_key=user_id,
+            max_item_count=limit
+        ).by_page(continuation_token)
+
+        conversations = []
+        async for page in pages:
+            async for item in page:
+                conversations.append(item)
+            if conversations:
+                break
+        return conversations, pages.continuation_token
+
+    async def get_conversation(self, user_id, conversation_id):
+        if self.cache:
+            return await self.cache.get_conversation(user_id, conversation_id, lambda: self._read_conversation(user_id, conversation_id))
+        return await self._read_conversation(user_id, conversation_id)
+
+    async def _read_conversation(self, user_id, conversation_id):
+        ## id and partition key are both known, so this is a point read rather than a query
+        try:
+            conversation = await self.convos_container_client.read_item(item=conversation_id, partition_key=user_id)
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+        return conversation if conversation.get('type') == 'conversation' else None
+
     async def create_message(self, uuid, conversation_id, user_id, input_message: dict):
         message = {
             'id': uuid,
@@ -152,30 +224,110 @@ class CosmosConversationClient():
             'role': input_message['role'],
             'content': input_message['content']
         }
+        if isinstance(message['content'], str):
+            message.update(await self.message_token_fields(message['content']))
 
         if self.enable_message_feedback:
             message['feedback'] = ''
         
-        resp = await self.convos_container_client.upsert_item(message)  
-        if resp:
-            ## update the parent conversations's updatedAt field with the current message's createdAt datetime value
-            conversation = await self.get_conversation(user_id, conversation_id)
-            conversation['updatedAt'] = message['createdAt']
-            await self.upsert_conversation(conversation)
-            return resp
-        else:
-            return False
+        ## the message and the parent conversation share the userId partition, so writing the message and
+        ## bumping the conversation's updatedAt go out as one transactional batch: one round trip, all or nothing
+        batch_operations = [
+            ('upsert', (message,)),
+            (
+                'patch',
+                (conversation_id, [{'op': 'set', 'path': '/updatedAt', 'value': message['createdAt']}]),
+                {'filter_predicate': "from c where c.type = 'conversation'"}
+            ),
+        ]
+        try:
+            results = await self.convos_container_client.execute_item_batch(batch_operations=batch_operations, partition_key=user_id)
+        except exceptions.CosmosBatchOperationError as e:
+            ## 404: no such conversation, 412: the id belongs to something that isn't a conversation
+            if e.error_index == 1 and e.status_code in (404, 412):
+                return "Conversation not found"
+            raise
+
+        message = results[0].get('resourceBody') or message
+        if self.cache:
+            await self.cache.put_message(message)
+        return message
     
     async def update_message_feedback(self, user_id, message_id, feedback):
         message = await self.convos_container_client.read_item(item=message_id, partition_key=user_id)
         if message:
             message['feedback'] = feedback
             resp = await self.convos_container_client.upsert_item(message)
+            if self.cache and resp:
+                await self.cache.put_message(resp, touch_conversation=False)
             return resp
         else:
             return False
 
+    @staticmethod
+    async def message_token_fields(content):
+        # The hash ties the stored count to the text, so a count is only reused for the same message
+        return {
+            'tokenCount': await get_tokenizer(TOKEN_ENCODING).count_async(content),
+            'tokenEncoding': TOKEN_ENCODING,
+            'contentHash': content_hash(content)
+        }
+
+    async def get_message_token_counts(self, user_id, conversation_id, encoding_name=TOKEN_ENCODING):
+        cached_messages = await self.cache.peek_messages(user_id, conversation_id) if self.cache else None
+        if cached_messages is not None:
+            return {
+                message['contentHash']: message['tokenCount'] for message in cached_messages
+                if message.get('tokenEncoding') == encoding_name and message.get('contentHash')
+            }
+
+        parameters = [
+            {
+                'name': '@conversationId',
+                'value': conversation_id
+            },
+            {
+                'name': '@userId',
+                'value': user_id
+            }
+        ]
+        query = f"SELECT c.contentHash, c.tokenCount, c.tokenEncoding FROM c WHERE c.conversationId = @conversationId AND c.type='message' AND c.userId = @userId"
+        token_counts = {}
+        async for item in self.convos_container_client.query_items(query=query, parameters=parameters):
+            if item.get('tokenEncoding') == encoding_name and item.get('contentHash'):
+                token_counts[item['contentHash']] = item['tokenCount']
+        return token_counts
+
+    @staticmethod
+    def needs_token_backfill(message) -> bool:
+        return message.get('tokenEncoding') != TOKEN_ENCODING and isinstance(message.get('content'), str)
+
+    async def backfill_message_token_counts(self, user_id, messages):
+        ## messages written before token counts were stored get them on their next read
+        missing = [message for message in messages if self.needs_token_backfill(message)]
+        backfilled = 0
+        for message in missing:
+            token_fields = await self.message_token_fields(message['content'])
+            try:
+                await self.convos_container_client.patch_item(
+                    item=message['id'],
+                    partition_key=user_id,
+                    patch_operations=[{'op': 'set', 'path': f'/{field}', 'value': value} for field, value in token_fields.items()]
+                )
+                backfilled += 1
+            except exceptions.CosmosHttpResponseError:
+                logging.exception(f"Failed to backfill token count for message {message['id']}")
+        if self.cache and backfilled:
+            # Reloaded with their token counts on the next read
+            await self.cache.invalidate(user_id, *{message['conversationId'] for message in missing})
+        return backfilled
+
     async def get_messages(self, user_id, conversation_id):
+        if self.cache:
+            return await self.cache.get_messages(user_id, conversation_id, lambda: self._query_messages(user_id, conversation_id))
+        return await self._query_messages(user_id, conversation_id)
+
+    async def _query_messages(self, user_id, conversation_id):
         parameters = [
             {
                 'name': '@conversationId',
@@ -186,116 +338,203 @@ class CosmosConversationClient():
                 'value': user_id
             }
         ]
-        query = f"SELECT * FROM c WHERE c.conversationId = @conversationId AND c.type='message' AND c.userId = @userId ORDER BY c.timestamp ASC"
+        query = f"SELECT * FROM c WHERE c.conversationId = @conversationId AND c.type='message' AND c.userId = @userId ORDER BY c.createdAt ASC"
         messages =[]
-        async for message in self.convos_container_client.query_items(query=query, parameters=parameters):
+        async for message in self.convos_container_client.query_items(query=query, parameters=parameters, partition_key=user_id):
             messages.append(message)
         return messages
+
+    async def iter_messages(self, user_id, conversation_id, last_n=None, before=None, page_size=50):
+        ## yields messages as Cosmos pages arrive instead of loading the whole conversation.
+        ## Without a window they come oldest first, like get_messages; with last_n and/or before
+        ## (the createdAt of a message already shown) they come newest first, so the newest
+        ## messages can be rendered while older ones are still loading
+        parameters = [
+            {
+                'name': '@conversationId',
+                'value': conversation_id
+            },
+            {
+                'name': '@userId',
+                'value': user_id
+            }
+        ]
+        query = "SELECT * FROM c WHERE c.conversationId = @conversationId AND c.type='message' AND c.userId = @userId"
+        if before is not None:
+            query += " AND c.createdAt < @before"
+            parameters.append({'name': '@before', 'value': before})
+        windowed = last_n is not None or before is not None
+        query += f" ORDER BY c.createdAt {'DESC' if windowed else 'ASC'}"
+        if last_n is not None:
+            query += f" OFFSET 0 LIMIT {int(last_n)}"
+
+        async for message in self.convos_container_client.query_items(
+            query=query,
+            parameters=parameters,
+            partition_key=user_id,
+            max_item_count=page_size
+        ):
+            yield message
+
+    async def get_message(self, user_id, message_id):
+        try:
+            message = await self.convos_container_client.read_item(item=message_id, partition_key=user_id)
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+        return message if message.get('type') == 'message' else None
  
     
     async def share_conversation(self, user_id, conversation_id):
-        # Retrieve the conversation
-        try:
-            logging.info(f"Attempting to retrieve conversation with user_id: {user_id}, conversation_id: {conversation_id}")
-            conversation = await self.convos_container_client.read_item(item=conversation_id, partition_key=user_id)
-            logging.info(f"Retrieved conversation: {conversation}")
-        except Exception as e:
-            logging.error(f"Error retrieving conversation: {e}")
-            return False
-
+        conversation = await self.get_conversation(user_id, conversation_id)
         if not conversation:
-            logging.error("No conversation found.")
+            logging.error(f"Cannot share conversation {conversation_id}: not found")
             return False
+        messages = await self.get_messages(user_id, conversation_id)
 
-        # Retrieve messages associated with the conversation
-        try:
-            logging.info(f"Retrieving messages for user_id: {user_id}, conversation_id: {conversation_id}")
-            messages = await self.get_messages(user_id, conversation_id)  # Ensure this is awaited if it's async
-            logging.info(f"Retrieved messages: {messages}")
-        except Exception as e:
-            logging.error(f"Error retrieving messages: {e}")
-            return False
+        # The conversation remembers the id it was shared under, so sharing it again reuses
+        # that id without looking for it in the shared container
+        shared_conversation_id = conversation.get('sharedConversationId')
+        if not shared_conversation_id:
+            shared_conversation_id = await self._find_legacy_shared_conversation_id(conversation_id) or str(uuid.uuid4())
 
-        # Check if a shared conversation for this originalConversationId already exists
-        existing_shared_conversation_query = "SELECT * FROM c WHERE c.originalConversationId = @conversationId"
+        header, pages = build_snapshot(shared_conversation_id, user_id, conversation, messages, datetime.utcnow().isoformat())
+        existing = await self._read_shared_item(shared_conversation_id)
+        if existing and existing.get('snapshotHash') == header['snapshotHash']:
+            logging.debug(f"Shared conversation {shared_conversation_id} is unchanged; nothing to write")
+        else:
+            # Pages go first and the header last, so a reader never sees a header whose pages are missing
+            existing_pages = set(existing.get('pages', [])) if existing else set()
+            new_pages = [page for page in pages if page['id'] not in existing_pages]
+            if new_pages:
+                # The first write caches the container's partition key definition for the rest
+                await self.shared_convos_container_client.upsert_item(new_pages[0])
+                await asyncio.gather(*(self.shared_convos_container_client.upsert_item(page) for page in new_pages[1:]))
+            await self.shared_convos_container_client.upsert_item(header)
+            stale_pages = existing_pages - set(header['pages'])
+            await self._delete_shared_pages(header, stale_pages)
+            logging.debug(
+                f"Shared conversation {shared_conversation_id}: {len(messages)} messages in {len(pages)} pages, "
+                f"{len(new_pages)} written, {len(stale_pages)} removed"
+            )
+
+        if conversation.get('sharedConversationId') != shared_conversation_id:
+            try:
+                await self.convos_container_client.patch_item(
+                    item=conversation_id,
+                    partition_key=user_id,
+                    patch_operations=[{'op': 'set', 'path': '/sharedConversationId', 'value': shared_conversation_id}]
+                )
+                if self.cache:
+                    await self.cache.put_conversation({**conversation, 'sharedConversationId': shared_conversation_id})
+            except exceptions.CosmosHttpResponseError:
+                # Only costs a lookup the next time the conversation is shared
+                logging.exception(f"Failed to record shared id on conversation {conversation_id}")
+
+        return shared_conversation_id
+
+    async def _find_legacy_shared_conversation_id(self, conversation_id):
+        ## conversations shared before their shared id was stored on them; a cross-partition
+        ## query that runs at most once per conversation
+        query = "SELECT c.id, c.type FROM c WHERE c.originalConversationId = @conversationId"
         parameters = [{"name": "@conversationId", "value": conversation_id}]
-        logging.info(f"Running query: {existing_shared_conversation_query} with parameters: {parameters}")
-
-        existing_shared_conversations = []
+        async for item in self.shared_convos_container_client.query_items(query=query, parameters=parameters):
+            if item.get('type') != 'sharedConversationPage':
+                return item['id']
+        return None
+
+    async def _shared_partition_key_path(self):
+        if self.client_registry:
+            return await self.client_registry.get_partition_key_path(self.database_name, self.shared_convos_container_name)
+        if self._shared_partition_key is None:
+            self._shared_partition_key = partition_key_path(await self.shared_convos_container_client.read())
+        return self._shared_partition_key
+
+    async def _read_shared_item(self, item_id):
+        ## a shared link only carries the shared id, so a point read needs the shared container
+        ## to be partitioned on /id; other layouts keep the cross-partition query
+        if await self._shared_partition_key_path() == '/id':
+            try:
+                return await self.shared_convos_container_client.read_item(item=item_id, partition_key=item_id)
+            except exceptions.CosmosResourceNotFoundError:
+                return None
+
+        query = "SELECT * FROM c WHERE c.id = @id"
+        parameters = [{"name": "@id", "value": item_id}]
+        async for item in self.shared_convos_container_client.query_items(query=query, parameters=parameters):
+            return item
+        return None
+
+    async def _delete_shared_pages(self, header, page_ids):
+        partition_key_field = (await self._shared_partition_key_path()).strip('/')
+        for page_id in page_ids:
+            try:
+                await self.shared_convos_container_client.delete_item(item=page_id, partition_key=page_stub(header, page_id).get(partition_key_field))
+            except exceptions.CosmosHttpResponseError:
+                # An orphaned page is only wasted space; the header no longer points at it
+                logging.exception(f"Failed to delete stale shared conversation page {page_id}")
+
+    async def get_shared_header(self, shared_conversation_id):
         try:
-            async for item in self.shared_convos_container_client.query_items(query=existing_shared_conversation_query, parameters=parameters):
-                existing_shared_conversations.append(item)
-                logging.info(f"Found existing shared conversation: {item}")
+            header = await self._read_shared_item(shared_conversation_id)
         except Exception as e:
-            logging.error(f"Error querying shared conversations: {e}")
-            return False
+            logging.error(f"Error reading shared conversation {shared_conversation_id}: {e}")
+            return None
+        if not header or header.get('type') == 'sharedConversationPage':
+            logging.info(f"No conversations found for ID: {shared_conversation_id}")
+            return None
+        return header
 
-        if existing_shared_conversations:
-            # If an existing shared conversation is found, use its ID to update
-            shared_conversation_id = existing_shared_conversations[0]['id']
-        else:
-            # Otherwise, generate a new unique ID
-            shared_conversation_id = str(uuid.uuid4())
-
-        # Create or update the shared conversation object
-        shared_conversation = {
-            'id': shared_conversation_id,
-            'originalConversationId': conversation_id,
-            'sharedAt': datetime.utcnow().isoformat(),
-            'userId': user_id,  # Add this line to include the userId
-            'conversation': conversation,
-            'messages': messages
-        }
+    async def iter_shared_messages(self, header):
+        ## pages are fetched one ahead of the one being yielded
+        if not is_paged(header):
+            for message in header.get('messages', []):
+                yield message
+            return
 
-        logging.info(f"Upserting shared conversation: {shared_conversation}")
+        page_ids = header['pages']
+        pending = asyncio.ensure_future(self._read_shared_item(page_ids[0])) if page_ids else None
         try:
-            resp = await self.shared_convos_container_client.upsert_item(shared_conversation)
-            logging.info(f"Upsert response: {resp}")
-            if resp:
-                logging.info(f"Successfully upserted shared conversation with ID: {shared_conversation_id}")
-                return shared_conversation_id  # Return the ID of the shared conversation
-            else:
-                logging.error("Failed to upsert shared conversation.")
-                return False
-        except Exception as e:
-            logging.error(f"Error upserting shared conversation: {e}")
-            return False
-        
-    async def get_shared_conversation(self, shared_conversation_id):
-        query = "SELECT * FROM c WHERE c.id = @sharedConversationId"
-        parameters = [{"name": "@sharedConversationId", "value": shared_conversation_id}]
-        logging.info(f"Running query: {query} with parameters: {parameters}")
+            for index in range(len(page_ids)):
+                page = await pending
+                pending = asyncio.ensure_future(self._read_shared_item(page_ids[index + 1])) if index + 1 < len(page_ids) else None
+                if page is None:
+                    raise LookupError(f"Page {index} of shared conversation {header['id']} is missing")
+                for message in page['messages']:
+                    yield message
+        finally:
+            if pending:
+                pending.cancel()
 
-        conversation = []
-        try:
-            async for item in self.shared_convos_container_client.query_items(
-                query=query,
-                parameters=parameters
-            ):
-                conversation.append(item)
-                logging.info(f"Found conversation: {item}")
-        except Exception as e:
-            logging.error(f"Error querying shared conversations: {e}")
+    async def get_shared_conversation(self, shared_conversation_id):
+        header = await self.get_shared_header(shared_conversation_id)
+        if not header:
             return None
+        messages = [message async for message in self.iter_shared_messages(header)]
+        return {**snapshot_summary(header), 'messages': messages}
 
-        if conversation:
-            logging.info(f"Returning conversation with ID: {shared_conversation_id}")
-            return conversation[0]
-        else:
-            logging.info(f"No conversations found for ID: {shared_conversation_id}")
-            return None
 class CosmosTokenClient():
 
-    def __init__(self, cosmosdb_endpoint: str, credential: any, database_name: str, token_container_name: str, user_privilege_container_name: str):
+    def __init__(self, cosmosdb_endpoint: str, credential: any, database_name: str, token_container_name: str, user_privilege_container_name: str, client_registry: CosmosClientRegistry = None):
         self.cosmosdb_endpoint = cosmosdb_endpoint
         self.credential = credential
         self.database_name = database_name
         self.token_container_name = token_container_name
         self.user_privilege_container_name = user_privilege_container_name
-        self.cosmosdb_client = CosmosClient(self.cosmosdb_endpoint, credential=credential)
-        self.database_client = self.cosmosdb_client.get_database_client(database_name)
-        self.token_container_client = self.database_client.get_container_client(token_container_name)
-        self.user_privilege_container_client = self.database_client.get_container_client(user_privilege_container_name)
+        if client_registry:
+            self.cosmosdb_client = client_registry.cosmosdb_client
+            self.database_client = client_registry.get_database_client(database_name)
+            self.token_container_client = client_registry.get_container_client(database_name, token_container_name)
+            self.user_privilege_container_client = client_registry.get_container_client(database_name, user_privilege_container_name)
+        else:
+            self.cosmosdb_client = CosmosClient(self.cosmosdb_endpoint, credential=credential)
+            self.database_client = self.cosmosdb_client.get_database_client(database_name)
+            self.token_container_client = self.database_client.get_container_client(token_container_name)
+            self.user_privilege_container_client = self.database_client.get_container_client(user_privilege_container_name)
+        self.owns_cosmosdb_client = client_registry is None
+
+    async def close(self):
+        if self.owns_cosmosdb_client:
+            await self.cosmosdb_client.close()
 
     async def ensure(self):
         try:
@@ -343,6 +582,19 @@ class CosmosTokenClient():
         else:
             return False
     
+    async def create_default_user_privilege_record(self, user_id, user_name, user_type='regular'):
+        # Deterministic id so that concurrent first requests for a user insert one record
+        privilege_record = {
+            'id': f"{user_id}_privilege",
+            'userId': user_id,
+            'name': user_name,
+            'userType': user_type
+        }
+        try:
+            return await self.user_privilege_container_client.create_item(privilege_record)
+        except exceptions.CosmosResourceExistsError:
+            return None
+
     async def upsert_token_record(self, record):
         resp = await self.token_container_client.upsert_item(record)
         if resp:
@@ -396,6 +648,35 @@ class CosmosTokenClient():
         else:
             return await self.create_token_record(user_id, date)
 
+    async def increment_token_usage(self, user_id, date, deltas: dict):
+        operations = [
+            {'op': 'incr', 'path': f'/{field}', 'value': value}
+            for field, value in deltas.items() if value
+        ]
+        if not operations:
+            return None
+
+        record_id = f"{user_id}_{date}"
+        try:
+            return await self.token_container_client.patch_item(item=record_id, partition_key=user_id, patch_operations=operations)
+        except exceptions.CosmosResourceNotFoundError:
+            token_record = {
+                'id': record_id,
+                'userId': user_id,
+                'date': date,
+                'gpt35InputTokens': 0,
+                'gpt35OutputTokens': 0,
+                'gpt4InputTokens': 0,
+                'gpt4OutputTokens': 0
+            }
+            for field, value in deltas.items():
+                token_record[field] = token_record.get(field, 0) + value
+            try:
+                return await self.token_container_client.create_item(token_record)
+            except exceptions.CosmosResourceExistsError:
+                # Another worker created today's record first; add on top of it
+                return await self.token_container_client.patch_item(item=record_id, partition_key=user_id, patch_operations=operations)
+
     async def delete_token_record(self, user_id, date):
         record_id = f"{user_id}_{date}"
         return await self.token_container_client.delete_item(item=record_id, partition_key=user_id)
@@ -415,14 +696,24 @@ class CosmosTokenClient():
 
 class CosmosPrivacyNoticeClient:
 
-    def __init__(self, cosmosdb_endpoint: str, credential: any, database_name: str, responses_container_name: str):
+    def __init__(self, cosmosdb_endpoint: str, credential: any, database_name: str, responses_container_name: str, client_registry: CosmosClientRegistry = None):
         self.cosmosdb_endpoint = cosmosdb_endpoint
         self.credential = credential
         self.database_name = database_name
         self.responses_container_name = responses_container_name
-        self.cosmosdb_client = CosmosClient(self.cosmosdb_endpoint, credential=credential)
-        self.database_client = self.cosmosdb_client.get_database_client(database_name)
-        self.response_container_client = self.database_client.get_container_client(responses_container_name)
+        if client_registry:
+            self.cosmosdb_client = client_registry.cosmosdb_client
+            self.database_client = client_registry.get_database_client(database_name)
+            self.response_container_client = client_registry.get_container_client(database_name, responses_container_name)
+        else:
+            self.cosmosdb_client = CosmosClient(self.cosmosdb_endpoint, credential=credential)
+            self.database_client = self.cosmosdb_client.get_database_client(database_name)
+            self.response_container_client = self.database_client.get_container_client(responses_container_name)
+        self.owns_cosmosdb_client = client_registry is None
+
+    async def close(self):
+        if self.owns_cosmosdb_client:
+            await self.cosmosdb_client.close()
 
     async def check_user_response(self, user_id):
         query = f"SELECT * FROM c WHERE c.userId = @userId"
@@ -449,14 +740,24 @@ class CosmosPrivacyNoticeClient:
 
 class CosmosSettingsClient:
 
-    def __init__(self, cosmosdb_endpoint: str, credential: any, database_name: str, settings_container_name: str):
+    def __init__(self, cosmosdb_endpoint: str, credential: any, database_name: str, settings_container_name: str, client_registry: CosmosClientRegistry = None):
         self.cosmosdb_endpoint = cosmosdb_endpoint
         self.credential = credential
         self.database_name = database_name
         self.settings_container_name = settings_container_name
-        self.cosmosdb_client = CosmosClient(self.cosmosdb_endpoint, credential=credential)
-        self.database_client = self.cosmosdb_client.get_database_client(database_name)
-        self.settings_container_client = self.database_client.get_container_client(settings_container_name)
+        if client_registry:
+            self.cosmosdb_client = client_registry.cosmosdb_client
+            self.database_client = client_registry.get_database_client(database_name)
+            self.settings_container_client = client_registry.get_container_client(database_name, settings_container_name)
+        else:
+            self.cosmosdb_client = CosmosClient(self.cosmosdb_endpoint, credential=credential)
+            self.database_client = self.cosmosdb_client.get_database_client(database_name)
+            self.settings_container_client = self.database_client.get_container_client(settings_container_name)
+        self.owns_cosmosdb_client = client_registry is None
+
+    async def close(self):
+        if self.owns_cosmosdb_client:
+            await self.cosmosdb_client.close()
 
     async def get_settings(self, user_id):
         query = f"SELECT * FROM c WHERE c.userId = @userId AND c.type = 'userSettings'"
@@ -489,3 +790,130 @@ class CosmosSettingsClient:
         resp = await self.settings_container_client.upsert_item(new_settings_document)
         return resp
 
+
+class CosmosJobClient:
+
+    def __init__(self, cosmosdb_endpoint: str, credential: any, database_name: str, jobs_container_name: str, client_registry: CosmosClientRegistry = None):
+        self.cosmosdb_endpoint = cosmosdb_endpoint
+        self.credential = credential
+        self.database_name = database_name
+        self.jobs_container_name = jobs_container_name
+        if client_registry:
+            self.cosmosdb_client = client_registry.cosmosdb_client
+            self.database_client = client_registry.get_database_client(database_name)
+            self.jobs_container_client = client_registry.get_container_client(database_name, jobs_container_name)
+        else:
+            self.cosmosdb_client = CosmosClient(self.cosmosdb_endpoint, credential=credential)
+            self.database_client = self.cosmosdb_client.get_database_client(database_name)
+            self.jobs_container_client = self.database_client.get_container_client(jobs_container_name)
+        self.owns_cosmosdb_client = client_registry is None
+
+    async def close(self):
+        if self.owns_cosmosdb_client:
+            await self.cosmosdb_client.close()
+
+    async def create_job(self, job):
+        return await self.jobs_container_client.create_item(job)
+
+    async def get_job(self, user_id, job_id):
+        try:
+            job = await self.jobs_container_client.read_item(item=job_id, partition_key=user_id)
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+        return job if job.get('type') == 'job' else None
+
+    async def update_job(self, user_id, job_id, fields: dict):
+        return await self.jobs_container_client.patch_item(
+            item=job_id,
+            partition_key=user_id,
+            patch_operations=[{'op': 'set', 'path': f'/{field}', 'value': value} for field, value in fields.items()]
+        )
+
+    async def get_active_jobs(self, user_id):
+        parameters = [{'name': '@userId', 'value': user_id}]
+        query = "SELECT * FROM c WHERE c.userId = @userId AND c.type = 'job' AND c.status != 'succeeded' AND c.status != 'failed'"
+        jobs = []
+        async for job in self.jobs_container_client.query_items(query=query, parameters=parameters, partition_key=user_id):
+            jobs.append(job)
+        return jobs
+
+    async def get_orphaned_jobs(self, now):
+        ## unfinished jobs whose worker stopped renewing the lease (recycled, crashed or scaled in)
+        parameters = [{'name': '@now', 'value': now}]
+        query = "SELECT * FROM c WHERE c.type = 'job' AND c.status != 'succeeded' AND c.status != 'failed' AND c.leaseExpiresAt < @now"
+        jobs = []
+        async for job in self.jobs_container_client.query_items(query=query, parameters=parameters):
+            jobs.append(job)
+        return jobs
+
+    async def acquire_job_slot(self, user_id, slot: int, job_id, lease_expires_at, now) -> bool:
+        ## one document per allowed active job of a user; creating it (or taking over a free
+        ## or stale one with a server-side check) is atomic, so concurrent submits can't
+        ## both take the same slot
+        slot_id = f'job-slot-{slot}'
+        try:
+            await self.jobs_container_client.create_item({
+                'id': slot_id, 'type': 'jobSlot', 'userId': user_id, 'jobId': job_id, 'leaseExpiresAt': lease_expires_at
+            })
+            return True
+        except exceptions.CosmosResourceExistsError:
+            pass
+
+        try:
+            current = await self.jobs_container_client.read_item(item=slot_id, partition_key=user_id)
+        except exceptions.CosmosResourceNotFoundError:
+            return False
+        holder_id = current.get('jobId') or ''
+        if holder_id:
+            # Held by a job that finished without releasing it, or whose document was never
+            # created (the submit failed part way) once the slot's lease ran out
+            holder = await self.get_job(user_id, holder_id)
+            if holder and holder.get('status') not in ('succeeded', 'failed'):
+                return False
+            if not holder and current.get('leaseExpiresAt', '') >= now:
+                return False
+        try:
+            await self.jobs_container_client.patch_item(
+                item=slot_id,
+                partition_key=user_id,
+                patch_operations=[
+                    {'op': 'set', 'path': '/jobId', 'value': job_id},
+                    {'op': 'set', 'path': '/leaseExpiresAt', 'value': lease_expires_at},
+                ],
+                filter_predicate=f"from c where c.jobId = '{holder_id}'"
+            )
+            return True
+        except exceptions.CosmosHttpResponseError as e:
+            if e.status_code in (404, 412):
+                return False
+            raise
+
+    async def release_job_slot(self, user_id, slot: int, job_id):
+        try:
+            await self.jobs_container_client.patch_item(
+                item=f'job-slot-{slot}',
+                partition_key=user_id,
+                patch_operations=[{'op': 'set', 'path': '/jobId', 'value': ''}],
+                filter_predicate=f"from c where c.jobId = '{job_id}'"
+            )
+        except exceptions.CosmosHttpResponseError as e:
+            # Already free or taken over
+            if e.status_code not in (404, 412):
+                raise
+
+    async def claim_job(self, user_id, job_id, worker_id, lease_expires_at, now):
+        ## the lease check runs on the server, so only one worker can take over an orphaned job
+        try:
+            return await self.jobs_container_client.patch_item(
+                item=job_id,
+                partition_key=user_id,
+                patch_operations=[
+                    {'op': 'set', 'path': '/workerId', 'value': worker_id},
+                    {'op': 'set', 'path': '/leaseExpiresAt', 'value': lease_expires_at},
+                ],
+                filter_predicate=f"from c where c.leaseExpiresAt < '{now}'"
+            )
+        except exceptions.CosmosHttpResponseError as e:
+            if e.status_code in (404, 412):
+                return None
+            raise
@@ -0,0 +1,69 @@
+'''
+Indexing policy for the conversations container, shared by the provisioning
+templates and scripts/migrate_conversations_indexing.py.
+
+The container holds both conversation and message documents, partitioned by
+userId. Every query the app runs filters on userId/type (plus conversationId or
+id) and the history list sorts by updatedAt, so those paths stay indexed and the
+list gets composite indexes in both sort directions. Message bodies and the
+token bookkeeping fields are never filtered on, so they are excluded: that keeps
+large content out of the index and makes message writes cheaper.
+'''
+
+CONVERSATION_LIST_FIELDS = ('id', 'title', 'createdAt', 'updatedAt')
+
+EXCLUDED_PATHS = (
+    '/content/?',
+    '/content/*',
+    '/contentHash/?',
+    '/tokenCount/?',
+    '/tokenEncoding/?',
+    '/"_etag"/?',
+)
+
+COMPOSITE_INDEXES = (
+    (('/userId', 'ascending'), ('/type', 'ascending'), ('/updatedAt', 'descending')),
+    (('/userId', 'ascending'), ('/type', 'ascending'), ('/updatedAt', 'ascending')),
+)
+
+
+def conversations_indexing_policy() -> dict:
+    return {
+        'indexingMode': 'consistent',
+        'automatic': True,
+        'includedPaths': [{'path': '/*'}],
+        'excludedPaths': [{'path': path} for path in EXCLUDED_PATHS],
+        'compositeIndexes': [
+            [{'path': path, 'order': order} for path, order in composite_index]
+            for composite_index in COMPOSITE_INDEXES
+        ],
+    }
+
+
+def merge_indexing_policy(current: dict) -> dict:
+    '''
+    Add the conversations container's exclusions and composite indexes to an existing
+    policy, keeping anything else already configured on it.
+    '''
+    desired = conversations_indexing_policy()
+    merged = dict(current or {})
+    merged['indexingMode'] = merged.get('indexingMode') or desired['indexingMode']
+    merged['automatic'] = merged.get('automatic', True)
+    merged['includedPaths'] = merged.get('includedPaths') or desired['includedPaths']
+
+    excluded = list(merged.get('excludedPaths') or [])
+    existing_paths = {entry['path'] for entry in excluded}
+    excluded += [entry for entry in desired['excludedPaths'] if entry['path'] not in existing_paths]
+    merged['excludedPaths'] = excluded
+
+    def composite_key(composite_index):
+        return tuple((entry['path'], entry.get('order', 'ascending')) for entry in composite_index)
+
+    composites = list(merged.get('compositeIndexes') or [])
+    existing_composites = {composite_key(composite_index) for composite_index in composites}
+    composites += [
+        composite_index for composite_index in desired['compositeIndexes']
+        if composite_key(composite_index) not in existing_composites
+    ]
+    merged['compositeIndexes'] = composites
+    return merged
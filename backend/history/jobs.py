@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+from backend.history.bulk_delete import BulkSoftDeleter
+from backend.history.cosmosdbservice import CosmosJobClient
+
+JOB_FINISHED_STATUSES = ('succeeded', 'failed')
+
+
+class JobLimitExceeded(Exception):
+    pass
+
+
+class JobFailed(Exception):
+    '''
+    Raised by a job handler that finished with errors; result is still stored on the job.
+    '''
+
+    def __init__(self, message, result=None):
+        super().__init__(message)
+        self.result = result
+
+
+def _utcnow(offset_seconds: float = 0.0) -> str:
+    return (datetime.utcnow() + timedelta(seconds=offset_seconds)).isoformat()
+
+
+def public_job(job) -> dict:
+    return {
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': job.get('progress'),
+        'result': job.get('result'),
+        'error': job.get('error'),
+        'createdAt': job.get('createdAt'),
+        'startedAt': job.get('startedAt'),
+        'finishedAt': job.get('finishedAt'),
+    }
+
+
+def delete_all_conversations_handler(conversation_client_factory):
+    '''
+    Job handler soft-deleting all of a user's conversations. The conversation client is
+    built when the job runs, so it picks up the conversation cache (and its
+    invalidations) whatever existed when the runner was set up.
+    '''
+
+    async def delete_all_conversations(user_id, on_progress):
+        cosmos_conversation_client = conversation_client_factory()
+        if not cosmos_conversation_client:
+            raise Exception("CosmosDB is not configured or not working")
+        try:
+            results = await cosmos_conversation_client.soft_delete_all_conversations(user_id, on_progress=on_progress)
+        finally:
+            await cosmos_conversation_client.close()
+        summary = BulkSoftDeleter.summarize(results)
+        if summary["failed"]:
+            raise JobFailed(f"Failed to delete {summary['failed']} of {summary['conversations']} conversations", summary)
+        return summary
+
+    return delete_all_conversations
+
+
+class HistoryJobRunner:
+    '''
+    In-process runner for long history operations (e.g. deleting all of a user's
+    conversations) so the request that asks for them can return straight away.
+
+    Every job is a document in the jobs container (partitioned by userId) holding its
+    status, progress and result. The worker running a job keeps renewing a lease on
+    it; a job whose lease runs out (worker recycled or crashed) is claimed by the next
+    worker to sweep for orphans and run again, so handlers must be safe to repeat.
+    At most max_concurrency jobs run at once per worker and a user can have at most
+    max_active_per_user unfinished jobs, enforced atomically by one slot document per
+    allowed job that a job holds until it finishes; submitting a job identical to an
+    unfinished one returns the existing job.
+    '''
+
+    def __init__(
+        self,
+        cosmos_job_client: CosmosJobClient,
+        handlers: dict,
+        max_concurrency: int = 2,
+        max_active_per_user: int = 1,
+        lease_seconds: float = 60.0,
+        progress_interval_seconds: float = 1.0,
+        worker_id: str = None
+    ):
+        self.cosmos_job_client = cosmos_job_client
+        self.handlers = handlers
+        self.max_concurrency = max_concurrency
+        self.max_active_per_user = max_active_per_user
+        self.lease_seconds = lease_seconds
+        self.progress_interval_seconds = progress_interval_seconds
+        self.worker_id = worker_id or str(uuid.uuid4())
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks = {}
+        self._sweep_task = None
+        self.counters = Counter()
+
+    async def submit(self, user_id, kind, params: dict = None) -> dict:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        params = params or {}
+
+        active = await self.cosmos_job_client.get_active_jobs(user_id)
+        existing = self._find_identical(active, kind, params)
+        if existing:
+            return existing
+        if len(active) >= self.max_active_per_user:
+            self.counters['rejected'] += 1
+            raise JobLimitExceeded(f"User already has {len(active)} history job(s) in progress")
+
+        job_id = str(uuid.uuid4())
+        for slot in range(self.max_active_per_user):
+            if await self.cosmos_job_client.acquire_job_slot(user_id, slot, job_id, _utcnow(self.lease_seconds), _utcnow()):
+                break
+        else:
+            # A concurrent submit took the last slot, possibly for this same job
+            active = await self.cosmos_job_client.get_active_jobs(user_id)
+            existing = self._find_identical(active, kind, params)
+            if existing:
+                return existing
+            self.counters['rejected'] += 1
+            raise JobLimitExceeded(f"User already has {self.max_active_per_user} history job(s) in progress")
+
+        now = _utcnow()
+        try:
+            job = await self.cosmos_job_client.create_job({
+                'id': job_id,
+                'type': 'job',
+                'userId': user_id,
+                'kind': kind,
+                'params': params,
+                'slot': slot,
+                'status': 'queued',
+                'progress': {'done': 0, 'total': None},
+                'createdAt': now,
+                'updatedAt': now,
+                'workerId': self.worker_id,
+                'leaseExpiresAt': _utcnow(self.lease_seconds),
+            })
+        except Exception:
+            await self.cosmos_job_client.release_job_slot(user_id, slot, job_id)
+            raise
+        self.counters['submitted'] += 1
+        self._schedule(job)
+        return job
+
+    def _find_identical(self, active, kind, params):
+        for job in active:
+            if job['kind'] == kind and job.get('params', {}) == params:
+                self.counters['deduplicated'] += 1
+                return job
+        return None
+
+    async def get_job(self, user_id, job_id):
+        return await self.cosmos_job_client.get_job(user_id, job_id)
+
+    def _schedule(self, job):
+        task = asyncio.create_task(self._run(job))
+        self._tasks[job['id']] = task
+        task.add_done_callback(lambda t: self._tasks.pop(job['id'], None))
+
+    async def _run(self, job):
+        user_id, job_id = job['userId'], job['id']
+        progress = dict(job.get('progress') or {'done': 0, 'total': None})
+
+        def on_progress(done, total):
+            progress['done'] = done
+            progress['total'] = total
+
+        # The lease is held (and progress written) from the moment the job is queued here
+        heartbeat = asyncio.create_task(self._heartbeat(user_id, job_id, progress))
+        try:
+            async with self._semaphore:
+                try:
+                    await self.cosmos_job_client.update_job(user_id, job_id, {'status': 'running', 'startedAt': _utcnow(), 'updatedAt': _utcnow()})
+                except Exception:
+                    # 'running' is only informational: the job still runs and its outcome is recorded below
+                    logging.exception(f"HistoryJobRunner: failed to mark job {job_id} as running")
+                self.counters['started'] += 1
+                try:
+                    result = await self.handlers[job['kind']](user_id, on_progress=on_progress, **job.get('params', {}))
+                    status, error = 'succeeded', None
+                except JobFailed as e:
+                    result, status, error = e.result, 'failed', str(e)
+                except Exception as e:
+                    logging.exception(f"HistoryJobRunner: job {job_id} ({job['kind']}) failed")
+                    result, status, error = None, 'failed', str(e)
+        finally:
+            heartbeat.cancel()
+
+        self.counters[status] += 1
+        try:
+            await self.cosmos_job_client.update_job(user_id, job_id, {
+                'status': status,
+                'result': result,
+                'error': error,
+                'progress': progress,
+                'finishedAt': _utcnow(),
+                'updatedAt': _utcnow(),
+            })
+        except Exception:
+            # The lease runs out and another sweep repeats the job, which is safe
+            logging.exception(f"HistoryJobRunner: failed to record the outcome of job {job_id}")
+            return
+
+        if job.get('slot') is not None:
+            try:
+                await self.cosmos_job_client.release_job_slot(user_id, job['slot'], job_id)
+            except Exception:
+                # The next submit takes the slot over, since its job has finished
+                logging.exception(f"HistoryJobRunner: failed to release the slot of job {job_id}")
+
+    async def _heartbeat(self, user_id, job_id, progress):
+        written = None
+        renewed_at = asyncio.get_running_loop().time()
+        while True:
+            await asyncio.sleep(self.progress_interval_seconds)
+            lease_due = asyncio.get_running_loop().time() - renewed_at >= self.lease_seconds / 3
+            if progress == written and not lease_due:
+                continue
+            try:
+                await self.cosmos_job_client.update_job(user_id, job_id, {
+                    'progress': dict(progress),
+                    'leaseExpiresAt': _utcnow(self.lease_seconds),
+                    'updatedAt': _utcnow(),
+                })
+                written = dict(progress)
+                renewed_at = asyncio.get_running_loop().time()
+            except Exception:
+                logging.exception(f"HistoryJobRunner: failed to update job {job_id}")
+
+    async def recover(self) -> int:
+        '''
+        Claim and run unfinished jobs whose worker stopped renewing their lease.
+        '''
+        now = _utcnow()
+        recovered = 0
+        for job in await self.cosmos_job_client.get_orphaned_jobs(now):
+            if job['id'] in self._tasks:
+                continue
+            claimed = await self.cosmos_job_client.claim_job(job['userId'], job['id'], self.worker_id, _utcnow(self.lease_seconds), now)
+            if claimed:
+                logging.info(f"HistoryJobRunner: resuming orphaned job {job['id']} ({job['kind']})")
+                self._schedule(claimed)
+                recovered += 1
+        self.counters['recovered'] += recovered
+        return recovered
+
+    def start(self):
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_periodically())
+
+    async def _sweep_periodically(self):
+        while True:
+            try:
+                await self.recover()
+            except Exception:
+                logging.exception("HistoryJobRunner: failed to sweep for orphaned jobs")
+            await asyncio.sleep(self.lease_seconds)
+
+    async def close(self):
+        # Unfinished jobs keep their documents; their leases run out and they resume elsewhere
+        tasks = [task for task in (self._sweep_task, *self._tasks.values()) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._sweep_task = None
+
+    def stats(self) -> dict:
+        return {
+            'worker_id': self.worker_id,
+            'running_or_queued': len(self._tasks),
+            **self.counters,
+        }
@@ -0,0 +1,113 @@
+'''
+Layout of shared-conversation snapshots in the shared container.
+
+A snapshot is a small header document, whose id is the shared id in the link, plus
+the conversation's messages split into page documents of at most max_page_bytes,
+so no snapshot runs into Cosmos's 2 MB item limit however long the conversation is.
+Page ids are derived from the hash of their content, which lets a re-share write
+only the pages that changed and skip the write altogether when nothing did.
+
+Snapshots written before paging are a single document holding every message; they
+are still read as they are and replaced by the paged layout on their next re-share.
+'''
+import hashlib
+import json
+from datetime import datetime, timezone
+
+MAX_PAGE_BYTES = 256 * 1024
+
+
+def public_fields(document: dict) -> dict:
+    # Drops the Cosmos system properties (_rid, _etag, _ts, ...), which change on every
+    # write and would otherwise defeat the content hash
+    return {key: value for key, value in document.items() if not key.startswith('_')}
+
+
+def content_digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def paginate_messages(messages: list, max_page_bytes: int = MAX_PAGE_BYTES) -> list:
+    pages, page, page_bytes = [], [], 0
+    for message in messages:
+        size = len(json.dumps(message))
+        if page and page_bytes + size > max_page_bytes:
+            pages.append(page)
+            page, page_bytes = [], 0
+        page.append(message)
+        page_bytes += size
+    if page:
+        pages.append(page)
+    return pages
+
+
+def build_snapshot(shared_id: str, user_id: str, conversation: dict, messages: list, shared_at: str, max_page_bytes: int = MAX_PAGE_BYTES):
+    '''
+    Returns the header document and the page documents for a snapshot.
+    '''
+    conversation = {key: value for key, value in public_fields(conversation).items() if key != 'sharedConversationId'}
+    page_documents = []
+    for index, page in enumerate(paginate_messages([public_fields(message) for message in messages], max_page_bytes)):
+        page_documents.append({
+            'id': f"{shared_id}.{content_digest(page)[:32]}",
+            'type': 'sharedConversationPage',
+            'sharedConversationId': shared_id,
+            'originalConversationId': conversation['id'],
+            'userId': user_id,
+            'index': index,
+            'messages': page,
+        })
+    page_ids = [page['id'] for page in page_documents]
+    header = {
+        'id': shared_id,
+        'type': 'sharedConversation',
+        'originalConversationId': conversation['id'],
+        'sharedAt': shared_at,
+        'userId': user_id,
+        'conversation': conversation,
+        'messageCount': len(messages),
+        'pages': page_ids,
+        'snapshotHash': content_digest({'conversation': conversation, 'pages': page_ids}),
+    }
+    return header, page_documents
+
+
+def page_stub(header: dict, page_id: str) -> dict:
+    # Enough of a page document to work out its partition key without reading it
+    return {
+        'id': page_id,
+        'sharedConversationId': header['id'],
+        'originalConversationId': header['originalConversationId'],
+        'userId': header['userId'],
+    }
+
+
+def is_paged(document: dict) -> bool:
+    return 'pages' in document
+
+
+def snapshot_summary(header: dict) -> dict:
+    # What /api/get_shared_conversation returns about the snapshot besides its messages
+    return {
+        'id': header['id'],
+        'originalConversationId': header.get('originalConversationId'),
+        'sharedAt': header.get('sharedAt'),
+        'userId': header.get('userId'),
+        'conversation': header.get('conversation'),
+    }
+
+
+def snapshot_validators(header: dict):
+    '''
+    Returns the ETag and Last-Modified values for a snapshot: the ETag hashes sharedAt
+    together with the snapshot's content hash (or, for a single-document snapshot,
+    the hash of the document), and Last-Modified is sharedAt.
+    '''
+    content_hash = header.get('snapshotHash') or content_digest(public_fields(header))
+    etag = content_digest({'sharedAt': header.get('sharedAt'), 'snapshotHash': content_hash})[:32]
+    try:
+        # sharedAt is written as a naive UTC isoformat string; HTTP dates have no fractions
+        last_modified = datetime.fromisoformat(header['sharedAt']).replace(tzinfo=timezone.utc, microsecond=0)
+    except (KeyError, TypeError, ValueError):
+        last_modified = None
+    return etag, last_modified
@@ -0,0 +1,115 @@
+import asyncio
+import gzip
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+# Bodies smaller than this aren't worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+
+@dataclass(frozen=True)
+class SnapshotBytes:
+    etag: str
+    last_modified: Optional[datetime]
+    body: bytes
+    gzip_body: Optional[bytes]
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + len(self.gzip_body or b'')
+
+
+def encode_snapshot(etag: str, last_modified: Optional[datetime], body: bytes) -> SnapshotBytes:
+    gzip_body = gzip.compress(body, compresslevel=6) if len(body) >= MIN_COMPRESS_BYTES else None
+    return SnapshotBytes(etag, last_modified, body, gzip_body)
+
+
+class SharedSnapshotCache:
+    '''
+    Per-worker cache of serialized shared-conversation responses (JSON body plus its
+    gzip encoding and validators), so a popular shared link skips Cosmos, JSON
+    serialization and compression.
+
+    Entries expire after ttl_seconds, which bounds how long another worker's re-share
+    takes to show up here; re-shares on this worker invalidate() straight away. The
+    least recently used entries are evicted once the cached bytes pass max_bytes.
+    Concurrent misses for the same shared id share one load; a load that finds nothing
+    is not cached.
+    '''
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 60.0, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._loading = {}
+        self.bytes = 0
+        self.counters = Counter()
+
+    async def get_or_load(self, shared_id, loader) -> Optional[SnapshotBytes]:
+        entry = self._entries.get(shared_id)
+        if entry:
+            expires_at, snapshot = entry
+            if expires_at > self.clock():
+                self._entries.move_to_end(shared_id)
+                self.counters['hits'] += 1
+                return snapshot
+            self._remove(shared_id)
+
+        task = self._loading.get(shared_id)
+        if task is None:
+            self.counters['misses'] += 1
+            task = asyncio.ensure_future(loader())
+            self._loading[shared_id] = task
+            task.add_done_callback(lambda t: self._loaded(shared_id, t))
+        else:
+            self.counters['coalesced'] += 1
+
+        # Shielded so one caller going away does not cancel the load the others wait on
+        return await asyncio.shield(task)
+
+    def _loaded(self, shared_id, task):
+        # A load that was invalidated while in flight must not repopulate the cache
+        if self._loading.get(shared_id) is not task:
+            return
+        del self._loading[shared_id]
+        if task.cancelled() or task.exception() is not None:
+            self.counters['load_failures'] += 1
+            return
+        snapshot = task.result()
+        if snapshot is not None and snapshot.size <= self.max_bytes:
+            self._set(shared_id, snapshot)
+
+    def _set(self, shared_id, snapshot: SnapshotBytes):
+        self._remove(shared_id)
+        self._entries[shared_id] = (self.clock() + self.ttl_seconds, snapshot)
+        self.bytes += snapshot.size
+        while self.bytes > self.max_bytes:
+            evicted, (_, evicted_snapshot) = self._entries.popitem(last=False)
+            self.bytes -= evicted_snapshot.size
+            self.counters['evictions'] += 1
+
+    def _remove(self, shared_id):
+        entry = self._entries.pop(shared_id, None)
+        if entry:
+            self.bytes -= entry[1].size
+
+    def invalidate(self, shared_id) -> bool:
+        self._loading.pop(shared_id, None)
+        removed = shared_id in self._entries
+        self._remove(shared_id)
+        self.counters['invalidations'] += int(removed)
+        return removed
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'loading': len(self._loading),
+            'hits': self.counters['hits'],
+            'misses': self.counters['misses'],
+            **{k: v for k, v in self.counters.items() if k not in ('hits', 'misses')},
+        }
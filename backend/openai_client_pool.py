@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+
+import httpx
+from azure.identity.aio import DefaultAzureCredential
+from openai import AsyncAzureOpenAI
+
+COGNITIVE_SERVICES_SCOPE = "https://cognitiveservices.azure.com/.default"
+
+
+class CachedTokenProvider:
+    '''
+    Async bearer token provider for AsyncAzureOpenAI that keeps one token per worker.
+
+    Once a token is inside the refresh window a replacement is fetched in the
+    background while the current token keeps being served, so requests only wait
+    on Entra ID for the very first token or after an outright expiry.
+    '''
+
+    def __init__(self, credential, scope: str = COGNITIVE_SERVICES_SCOPE, refresh_margin_seconds: float = 300):
+        self.credential = credential
+        self.scope = scope
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self._token = None
+        self._expires_on = 0
+        self._refresh_task = None
+        self.refreshes = 0
+
+    async def __call__(self) -> str:
+        now = time.time()
+        if self._token is None or now >= self._expires_on:
+            await self._start_refresh()
+        elif now >= self._expires_on - self.refresh_margin_seconds:
+            self._start_refresh()
+        return self._token
+
+    def _start_refresh(self) -> asyncio.Task:
+        # Concurrent callers share the in-flight refresh instead of each fetching a token
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+            self._refresh_task.add_done_callback(self._log_refresh_failure)
+        return self._refresh_task
+
+    async def _refresh(self):
+        access_token = await self.credential.get_token(self.scope)
+        self._token = access_token.token
+        self._expires_on = access_token.expires_on
+        self.refreshes += 1
+        logging.debug(f"CachedTokenProvider: refreshed token, expires at {self._expires_on}")
+
+    @staticmethod
+    def _log_refresh_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            logging.error(f"CachedTokenProvider: token refresh failed: {task.exception()}")
+
+    async def close(self):
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+
+
+class AzureOpenAIClientPool:
+    '''
+    Worker-lifetime pool of AsyncAzureOpenAI clients keyed by
+    (endpoint, deployment, api_version, auth mode).
+
+    All clients share a single httpx.AsyncClient, so keep-alive connections to
+    an endpoint are reused across requests and across the chat and title calls,
+    and keyless clients share a single credential and token cache.
+    '''
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 600.0,
+        default_headers: dict = None,
+        credential_factory=None
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = timeout
+        self.default_headers = default_headers or {}
+        self.credential_factory = credential_factory
+        self._http_client = None
+        self._credential = None
+        self._token_provider = None
+        self._clients = {}
+        self.counters = Counter()
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        return self._http_client
+
+    @property
+    def token_provider(self) -> CachedTokenProvider:
+        if self._token_provider is None:
+            if self.credential_factory:
+                self._credential = self.credential_factory()
+            else:
+                self._credential = DefaultAzureCredential()
+            self._token_provider = CachedTokenProvider(self._credential)
+        return self._token_provider
+
+    def get_client(self, endpoint: str, deployment: str, api_version: str, api_key: str = None) -> AsyncAzureOpenAI:
+        auth_mode = "api_key" if api_key else "entra_id"
+        # The key itself is part of the identity so a rotated key gets a fresh client
+        key = (endpoint, deployment, api_version, auth_mode, api_key)
+        client = self._clients.get(key)
+        if client is not None:
+            self.counters["client_reuses"] += 1
+            return client
+
+        client = AsyncAzureOpenAI(
+            api_version=api_version,
+            api_key=api_key,
+            azure_ad_token_provider=None if api_key else self.token_provider,
+            default_headers=self.default_headers,
+            azure_endpoint=endpoint,
+            http_client=self.http_client,
+        )
+        self._clients[key] = client
+        self.counters["clients_created"] += 1
+        logging.debug(f"AzureOpenAIClientPool: created client for {endpoint} ({deployment}, {api_version}, {auth_mode})")
+        return client
+
+    def connection_count(self) -> int:
+        # httpx does not expose pool state publicly; reach through to httpcore defensively
+        transport = getattr(self._http_client, "_transport", None)
+        pool = getattr(transport, "_pool", None)
+        return len(getattr(pool, "connections", []) or [])
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self._clients),
+            "clients_created": self.counters["clients_created"],
+            "client_reuses": self.counters["client_reuses"],
+            "open_connections": self.connection_count(),
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "token_refreshes": self._token_provider.refreshes if self._token_provider else 0,
+        }
+
+    async def close(self):
+        self._clients.clear()
+        if self._token_provider is not None:
+            await self._token_provider.close()
+            self._token_provider = None
+        if self._credential is not None:
+            await self._credential.close()
+            self._credential = None
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
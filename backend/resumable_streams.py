@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from itertools import islice
+from typing import Optional
+
+from backend.utils import dumps_bytes
+
+
+class StreamGone(Exception):
+    '''
+    The events after the requested Last-Event-ID are no longer buffered.
+    '''
+
+
+def sse_frame(event: str, data, event_id: Optional[int] = None) -> bytes:
+    # JSON never contains a raw newline, so the data always fits on one data: line
+    frame = b"event: " + event.encode() + b"\ndata: " + dumps_bytes(data) + b"\n\n"
+    if event_id is not None:
+        frame = b"id: %d\n" % event_id + frame
+    return frame
+
+
+HEARTBEAT_FRAME = b": heartbeat\n\n"
+
+
+class ResumableStream:
+    '''
+    One generation, kept as the SSE frames it produced. Frames get ids 1, 2, 3, ... and
+    the newest max_events of them are kept, so a client that lost its connection can
+    ask for the frames after its Last-Event-ID without the model being called again.
+    The stream ends with an "end" frame ({"count": <messages>}) or an "error" frame.
+    '''
+
+    def __init__(self, stream_id: str, user_id: str, max_events: int):
+        self.stream_id = stream_id
+        self.user_id = user_id
+        self.frames = deque(maxlen=max_events)
+        self.last_id = 0
+        self.finished = False
+        self.finished_at = None
+        self.readers = 0
+        self.task = None
+        self._waiter = None
+
+    def append(self, event: str, data):
+        self.last_id += 1
+        self.frames.append((self.last_id, sse_frame(event, data, self.last_id)))
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def frames_after(self, last_event_id: int) -> list:
+        first_id = self.frames[0][0] if self.frames else self.last_id + 1
+        if last_event_id < first_id - 1:
+            raise StreamGone(f"Events after {last_event_id} are no longer buffered")
+        # Ids are contiguous, so the position in the deque follows from the id
+        return list(islice(self.frames, max(last_event_id - first_id + 1, 0), None))
+
+    async def wait(self, timeout: float) -> bool:
+        if self._waiter is None or self._waiter.done():
+            self._waiter = asyncio.get_running_loop().create_future()
+        done, _ = await asyncio.wait((self._waiter,), timeout=timeout)
+        return bool(done)
+
+    async def sse(self, last_event_id: int = 0, heartbeat_seconds: float = 15.0):
+        '''
+        The frames after last_event_id, then the rest of the stream as it is produced,
+        with a comment line every heartbeat_seconds without a frame to keep proxies
+        from timing the connection out. Raises StreamGone up front when the frames
+        after last_event_id have already been dropped, and ValueError for an id the
+        stream never sent.
+        '''
+        if last_event_id < 0 or last_event_id > self.last_id:
+            raise ValueError(f"Stream {self.stream_id} has not sent event {last_event_id}")
+        self.frames_after(last_event_id)
+        return self._sse(last_event_id, heartbeat_seconds)
+
+    async def _sse(self, last_event_id, heartbeat_seconds):
+        self.readers += 1
+        try:
+            yield sse_frame("stream", {"stream_id": self.stream_id})
+            while True:
+                for frame_id, frame in self.frames_after(last_event_id):
+                    last_event_id = frame_id
+                    yield frame
+                if self.finished and last_event_id == self.last_id:
+                    return
+                if not await self.wait(heartbeat_seconds):
+                    yield HEARTBEAT_FRAME
+        except StreamGone:
+            # This reader fell further behind than the buffer holds
+            yield sse_frame("error", {"error": "Stream events are no longer available"})
+        finally:
+            self.readers -= 1
+
+
+class ResumableStreams:
+    '''
+    Per-worker registry of ResumableStream.
+
+    start() hands the events of a generation to a task of its own, so the generation
+    (and its usage accounting) runs to the end even when the client that started it
+    goes away; any client of the same user can then read it again by stream id.
+    Finished streams are dropped ttl_seconds after they finish, and the oldest finished
+    ones once more than max_streams are kept.
+    '''
+
+    def __init__(self, max_events: int = 2048, ttl_seconds: float = 300.0, max_streams: int = 1000, clock=time.monotonic):
+        self.max_events = max_events
+        self.ttl_seconds = ttl_seconds
+        self.max_streams = max_streams
+        self.clock = clock
+        self._streams = OrderedDict()
+        self._tasks = set()
+        self.counters = Counter()
+
+    def start(self, user_id: str, events) -> ResumableStream:
+        self._prune()
+        stream = ResumableStream(uuid.uuid4().hex, user_id, self.max_events)
+        self._streams[stream.stream_id] = stream
+        task = stream.task = asyncio.ensure_future(self._produce(stream, events))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.counters['started'] += 1
+        return stream
+
+    async def _produce(self, stream: ResumableStream, events):
+        count = 0
+        try:
+            async for event in events:
+                if event:
+                    count += 1
+                    stream.append("message", event)
+            stream.append("end", {"count": count})
+        except asyncio.CancelledError:
+            stream.append("error", {"error": "The stream was cancelled"})
+            raise
+        except Exception as error:
+            logging.exception("Exception while generating response stream: %s", error)
+            stream.append("error", {"error": str(error)})
+        finally:
+            stream.finished = True
+            stream.finished_at = self.clock()
+
+    def get(self, stream_id: str, user_id: str) -> Optional[ResumableStream]:
+        self._prune()
+        stream = self._streams.get(stream_id)
+        # Someone else's stream id is treated as unknown
+        if stream is None or stream.user_id != user_id:
+            self.counters['misses'] += 1
+            return None
+        self.counters['resumes'] += 1
+        return stream
+
+    def _prune(self):
+        now = self.clock()
+        for stream_id, stream in list(self._streams.items()):
+            if stream.finished and stream.finished_at + self.ttl_seconds <= now:
+                del self._streams[stream_id]
+                self.counters['expired'] += 1
+        finished = [stream_id for stream_id, stream in self._streams.items() if stream.finished]
+        for stream_id in finished[:max(len(self._streams) - self.max_streams, 0)]:
+            del self._streams[stream_id]
+            self.counters['evicted'] += 1
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+        self._streams.clear()
+
+    def stats(self) -> dict:
+        return {
+            'streams': len(self._streams),
+            'running': len(self._tasks),
+            'readers': sum(stream.readers for stream in self._streams.values()),
+            'buffered_bytes': sum(len(frame) for stream in self._streams.values() for _, frame in stream.frames),
+            **self.counters,
+        }
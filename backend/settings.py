@@ -18,8 +18,7 @@ from pydantic.alias_generators import to_snake
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from typing import List, Literal, Optional
 from typing_extensions import Self
-from quart import Request
-from backend.utils import parse_multi_columns, generateFilterString
+from backend.utils import freeze_payload, parse_multi_columns
 
 DOTENV_PATH = os.environ.get(
     "DOTENV_PATH",
@@ -31,6 +30,8 @@ DOTENV_PATH = os.environ.get(
     )
 )
 MINIMUM_SUPPORTED_AZURE_OPENAI_PREVIEW_API_VERSION = "2024-05-01-preview"
+# Older preview versions reject stream_options with a 400
+STREAM_OPTIONS_MINIMUM_PREVIEW_API_VERSION = "2024-07-01-preview"
 
 
 class _UiSettings(BaseSettings):
@@ -86,6 +87,8 @@ class _ChatHistorySettings(BaseSettings):
     
     container_settings: str
 
+    container_jobs: Optional[str] = None
+
 class _PromptflowSettings(BaseSettings):
     model_config = SettingsConfigDict(
         env_prefix="PROMPTFLOW_",
@@ -130,6 +133,7 @@ class _AzureOpenAISettings(BaseSettings):
     top_p: float = 0
     max_tokens: int = 1000
     stream: bool = True
+    stream_include_usage: bool = True
     stop_sequence: Optional[List[str]] = None
     seed: Optional[int] = None
     choices_count: Optional[conint(ge=1, le=128)] = Field(default=1, serialization_alias="n")
@@ -145,6 +149,10 @@ class _AzureOpenAISettings(BaseSettings):
     embedding_key: Optional[str] = None
     embedding_name: Optional[str] = None
 
+    # Shared HTTP connection pool used by every AsyncAzureOpenAI client in a worker
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
 
     model_v4: str
     model_name_v4: str
@@ -269,6 +277,7 @@ class _SearchCommonSettings(BaseSettings):
 
 class DatasourcePayloadConstructor(BaseModel, ABC):
     _settings: '_AppSettings' = PrivateAttr()
+    _payload_template: Optional[dict] = PrivateAttr(default=None)
     
     def __init__(self, settings: '_AppSettings', **data):
         super().__init__(**data)
@@ -282,6 +291,22 @@ class DatasourcePayloadConstructor(BaseModel, ABC):
     ):
         pass
 
+    def payload_template(self) -> dict:
+        # Everything in the payload except the per-request fields comes from settings that
+        # don't change while the app runs, so it is built (and frozen) once
+        if self._payload_template is None:
+            self._payload_template = freeze_payload(self.construct_payload_configuration())
+        return self._payload_template
+
+    def build_payload(self, filter_string: Optional[str] = None, role_information: Optional[str] = None) -> dict:
+        template = self.payload_template()
+        parameters = dict(template["parameters"])
+        if filter_string is not None:
+            parameters["filter"] = filter_string
+        if role_information is not None:
+            parameters["role_information"] = role_information
+        return {"type": template["type"], "parameters": parameters}
+
 
 class _AzureSearchSettings(BaseSettings, DatasourcePayloadConstructor):
     model_config = SettingsConfigDict(
@@ -360,16 +385,16 @@ class _AzureSearchSettings(BaseSettings, DatasourcePayloadConstructor):
     def set_query_type(self) -> Self:
         self.query_type = to_snake(self.query_type)
 
-    def _set_filter_string(self, request: Request) -> str:
+    async def resolve_filter_string(self, request_headers, group_resolver) -> Optional[str]:
         if self.permitted_groups_column:
-            user_token = request.headers.get("X-MS-TOKEN-AAD-ACCESS-TOKEN", "")
+            user_token = request_headers.get("X-MS-TOKEN-AAD-ACCESS-TOKEN", "")
             logging.debug(f"USER TOKEN is {'present' if user_token else 'not present'}")
             if not user_token:
                 raise ValueError(
                     "Document-level access control is enabled, but user access token could not be fetched."
                 )
 
-            filter_string = generateFilterString(user_token)
+            filter_string = await group_resolver.get_filter_string(user_token, self.permitted_groups_column)
             logging.debug(f"FILTER: {filter_string}")
             return filter_string
         
@@ -380,10 +405,6 @@ class _AzureSearchSettings(BaseSettings, DatasourcePayloadConstructor):
         *args,
         **kwargs
     ):
-        request = kwargs.pop('request', None)
-        if request and self.permitted_groups_column:
-            self.filter = self._set_filter_string(request)
-            
         self.embedding_dependency = \
             self._settings.azure_openai.extract_embedding_dependency()
         parameters = self.model_dump(exclude_none=True, by_alias=True)
@@ -719,6 +740,35 @@ class _BaseSettings(BaseSettings):
     is_local: bool = False
     daily_token_cost_limit_super: float = 1.0
     daily_token_cost_limit_regular: float = 0.25
+    token_usage_flush_interval: float = 5.0
+    # Privilege caches are per worker and /admin/privileges/invalidate only clears the
+    # one it reaches, so this bounds how long other workers see a privilege change late
+    privilege_cache_ttl: float = 60.0
+    privilege_cache_max_entries: int = 10000
+    privilege_admins: Optional[str] = None
+    graph_endpoint: str = "https://graph.microsoft.com/v1.0"
+    graph_groups_cache_ttl: float = 300.0
+    graph_groups_max: int = 2000
+    graph_timeout: float = 5.0
+    history_jobs_max_concurrency: int = 2
+    history_jobs_max_per_user: int = 1
+    history_jobs_lease: float = 60.0
+    conversation_cache_enabled: bool = True
+    conversation_cache_ttl: float = 60.0
+    conversation_cache_max_entries: int = 1000
+    conversation_cache_redis_url: Optional[str] = None
+    conversation_cache_in_process: bool = False
+    shared_snapshot_cache_enabled: bool = True
+    shared_snapshot_cache_ttl: float = 60.0
+    shared_snapshot_cache_max_bytes: int = 64 * 1024 * 1024
+    shared_conversation_max_age: int = 60
+    stream_coalesce_window_ms: float = 30.0
+    stream_coalesce_max_bytes: int = 1024
+    sse_heartbeat_seconds: float = 15.0
+    sse_buffer_max_events: int = 2048
+    sse_stream_ttl: float = 300.0
+    sse_max_streams: int = 1000
+    ws_max_in_flight: int = 4
     webapp_name: Optional[str] = None
 
 
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from collections import deque
+
+
+def assistant_delta(event):
+    # The text of a format_stream_response event carrying one assistant delta, else None
+    try:
+        messages = event["choices"][0]["messages"]
+    except (KeyError, IndexError, TypeError):
+        return None
+    if len(messages) != 1 or messages[0].get("role") != "assistant" or not isinstance(messages[0].get("content"), str):
+        return None
+    return messages[0]["content"]
+
+
+async def coalesce_stream_deltas(events, window_seconds: float = 0.03, max_bytes: int = 1024):
+    '''
+    Merges consecutive assistant deltas from format_stream_response events, so a burst
+    of one- or two-character deltas goes out as one line and one HTTP chunk.
+
+    The upstream is read by its own task, which appends each delta to the pending merge.
+    The merge is sent once it reaches max_bytes or window_seconds after its first delta,
+    whichever comes first, also when the upstream stalls in between; the reader of this
+    generator is only woken per merge, not per delta. Anything that is not an assistant
+    delta (tool/citation messages) flushes the pending text and passes through
+    unmerged; empty events are dropped. An upstream error is raised after the text
+    received before it.
+    '''
+    loop = asyncio.get_running_loop()
+    ready = deque()
+    parts, first_event, pending_bytes, timer = [], None, 0, None
+    waiter, finished, upstream_error = None, False, None
+
+    def wake():
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def flush():
+        nonlocal parts, first_event, pending_bytes, timer
+        if timer is not None:
+            timer.cancel()
+            timer = None
+        if parts:
+            ready.append({**first_event, "choices": [{"messages": [{"role": "assistant", "content": "".join(parts)}]}]})
+            parts, first_event, pending_bytes = [], None, 0
+            wake()
+
+    async def pump():
+        nonlocal first_event, pending_bytes, timer, finished, upstream_error
+        try:
+            async for event in events:
+                if not event:
+                    continue
+                content = assistant_delta(event)
+                if content is None:
+                    flush()
+                    ready.append(event)
+                    wake()
+                    continue
+                if not parts:
+                    first_event = event
+                    timer = loop.call_later(window_seconds, flush)
+                parts.append(content)
+                pending_bytes += len(content.encode())
+                if pending_bytes >= max_bytes:
+                    flush()
+        except Exception as error:
+            upstream_error = error
+        finally:
+            flush()
+            finished = True
+            wake()
+
+    pump_task = asyncio.ensure_future(pump())
+    try:
+        while True:
+            while ready:
+                yield ready.popleft()
+            if finished:
+                break
+            waiter = loop.create_future()
+            await waiter
+        if upstream_error is not None:
+            raise upstream_error
+    finally:
+        # Also reached when the client goes away; stopping the reader closes the upstream
+        if not pump_task.done():
+            pump_task.cancel()
+            await asyncio.wait((pump_task,))
+        if timer is not None:
+            timer.cancel()
+        aclose = getattr(events, "aclose", None)
+        if aclose:
+            try:
+                await aclose()
+            except Exception:
+                logging.exception("Exception while closing the upstream stream")
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+
+# Closes started from task callbacks, kept referenced until they are done
+_pending_closes = set()
+
+
+class StreamMetrics:
+    '''
+    Per-worker counts of streamed chat completions by how they ended: completed, aborted
+    (the client went away or the stream was cancelled, and the upstream was closed
+    early) or failed (an error from the upstream or while producing the stream).
+    '''
+
+    def __init__(self):
+        self.active = 0
+        self.counters = Counter()
+        self.seconds = Counter()
+
+    def started(self):
+        self.active += 1
+        self.counters['started'] += 1
+
+    def finished(self, outcome: str, chunks: int, seconds: float):
+        self.active -= 1
+        self.counters[outcome] += 1
+        self.counters[f'{outcome}_chunks'] += chunks
+        self.seconds[outcome] += seconds
+
+    def stats(self) -> dict:
+        return {
+            'active': self.active,
+            **self.counters,
+            **{f'{outcome}_seconds': round(seconds, 3) for outcome, seconds in self.seconds.items()},
+        }
+
+
+class StreamLifecycle:
+    '''
+    Owns what one streamed chat completion holds open: the upstream OpenAI stream, the
+    StreamUsage to settle and the clients to close afterwards (the Cosmos token client).
+
+    open() is called once the upstream stream is there, and the lifecycle is used as
+    `async with lifecycle:` around the loop over it. However the loop ends, the upstream
+    HTTP stream is closed straight away (so an abandoned completion stops generating),
+    usage is settled exactly once and the clients are closed. A client disconnect
+    reaches the loop as the cancellation or aclose() Quart applies to the response body,
+    and is counted as aborted. The cleanup is shielded, so a second cancellation can't
+    interrupt the usage write.
+
+    A generator that never ran has nothing to clean up on aclose(), and Quart does not
+    even get to close the body when the client goes away before the first chunk; see
+    close_with() for that case.
+    '''
+
+    def __init__(self, stream_usage, close_callbacks=(), metrics: StreamMetrics = None, clock=time.monotonic):
+        self.stream_usage = stream_usage
+        self.close_callbacks = list(close_callbacks)
+        self.metrics = metrics
+        self.clock = clock
+        self.upstream = None
+        self.chunks = 0
+        self.outcome = None
+        self._started_at = None
+        self._closing = None
+
+    def open(self, upstream):
+        self.upstream = upstream
+        self._started_at = self.clock()
+        if self.metrics:
+            self.metrics.started()
+
+    def close_with(self, task: asyncio.Task):
+        # Closes the stream as aborted once the task meant to read it is done, when that
+        # task ended without reading it to the end or closing it
+        task.add_done_callback(self._consumer_done)
+
+    def _consumer_done(self, task):
+        if self._closing is None:
+            self._closing = asyncio.ensure_future(self._close('aborted', True))
+            _pending_closes.add(self._closing)
+            self._closing.add_done_callback(_pending_closes.discard)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            outcome = 'completed'
+        elif issubclass(exc_type, (GeneratorExit, asyncio.CancelledError)):
+            outcome = 'aborted'
+        else:
+            outcome = 'failed'
+        await self.close(outcome)
+        return False
+
+    async def close(self, outcome: str = 'aborted', settle: bool = True):
+        if self._closing is None:
+            self._closing = asyncio.ensure_future(self._close(outcome, settle))
+        await asyncio.shield(self._closing)
+
+    async def _close(self, outcome, settle):
+        self.outcome = outcome
+        if self.upstream is not None:
+            try:
+                await self.upstream.close()
+            except Exception:
+                logging.exception("StreamLifecycle: failed to close the upstream stream")
+        if settle:
+            await self.stream_usage.settle()
+        for close_callback in self.close_callbacks:
+            try:
+                await close_callback()
+            except Exception:
+                logging.exception("StreamLifecycle: failed to close a client")
+        if self.metrics and self._started_at is not None:
+            self.metrics.finished(outcome, self.chunks, self.clock() - self._started_at)
+        if outcome != 'completed':
+            logging.info(f"StreamLifecycle: stream {outcome} after {self.chunks} chunks")
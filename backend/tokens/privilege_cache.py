@@ -0,0 +1,83 @@
+import asyncio
+import time
+from collections import Counter, OrderedDict
+
+
+class PrivilegeCache:
+    '''
+    Bounded per-worker cache of user_id -> userType.
+
+    Entries expire after ttl_seconds and the least recently used ones are evicted
+    past max_entries. A lookup that found nothing (None) is kept for the shorter
+    negative_ttl_seconds. Concurrent misses for the same user share one load, and
+    invalidate() drops entries (and any load in flight) after a privilege change.
+    '''
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 300.0, negative_ttl_seconds: float = 30.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._loading = {}
+        self.counters = Counter()
+
+    async def get_or_load(self, user_id, loader):
+        entry = self._entries.get(user_id)
+        if entry:
+            expires_at, user_type = entry
+            if expires_at > self.clock():
+                self._entries.move_to_end(user_id)
+                self.counters['hits'] += 1
+                return user_type
+            del self._entries[user_id]
+
+        task = self._loading.get(user_id)
+        if task is None:
+            self.counters['misses'] += 1
+            task = asyncio.ensure_future(loader())
+            self._loading[user_id] = task
+            task.add_done_callback(lambda t: self._loaded(user_id, t))
+        else:
+            self.counters['coalesced'] += 1
+
+        # Shielded so one caller going away does not cancel the load the others wait on
+        return await asyncio.shield(task)
+
+    def _loaded(self, user_id, task):
+        # A load that was invalidated while in flight must not repopulate the cache
+        if self._loading.get(user_id) is not task:
+            return
+        del self._loading[user_id]
+        if task.cancelled() or task.exception() is not None:
+            self.counters['load_failures'] += 1
+            return
+        self.set(user_id, task.result())
+
+    def set(self, user_id, user_type):
+        ttl = self.negative_ttl_seconds if user_type is None else self.ttl_seconds
+        self._entries[user_id] = (self.clock() + ttl, user_type)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def invalidate(self, user_id=None) -> int:
+        if user_id is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            self._loading.clear()
+        else:
+            removed = 1 if self._entries.pop(user_id, None) else 0
+            self._loading.pop(user_id, None)
+        self.counters['invalidations'] += removed
+        return removed
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'loading': len(self._loading),
+            'hits': self.counters['hits'],
+            'misses': self.counters['misses'],
+            **{k: v for k, v in self.counters.items() if k not in ('hits', 'misses')},
+        }
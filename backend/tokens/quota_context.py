@@ -0,0 +1,63 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from backend.auth.auth_utils import get_authenticated_user_details
+
+
+class QuotaContext:
+    '''
+    Everything one request needs to answer quota questions for its user.
+
+    The privilege type and today's token record are loaded once, concurrently, when
+    the request starts (with the usage ledger's unflushed deltas applied). The daily
+    limit, today's cost, the pre-call limit check and the usage percentage are then
+    answered from that snapshot without further Cosmos reads.
+    '''
+
+    def __init__(self, token_limits, user_id, user_type, daily_limit, token_record, today):
+        self.token_limits = token_limits
+        self.user_id = user_id
+        self.user_type = user_type
+        self.daily_limit = daily_limit
+        self.token_record = token_record
+        self.today = today
+
+    @classmethod
+    async def load(cls, token_limits, request_headers):
+        user_id = get_authenticated_user_details(request_headers)['user_principal_id']
+        today = datetime.utcnow().date().isoformat()
+
+        user_type, token_record = await asyncio.gather(
+            token_limits.token_privileges.check_user_token_privileges(request_headers),
+            token_limits.cosmos_token_client.get_token_usage(user_id, today)
+        )
+        if token_limits.usage_ledger:
+            token_record = token_limits.usage_ledger.apply_unflushed(token_record, user_id, today)
+
+        daily_limit = await token_limits.get_user_daily_limit('super' if user_type == 'super' else 'regular')
+        return cls(token_limits, user_id, user_type, daily_limit, token_record, today)
+
+    def todays_cost(self):
+        return self.token_limits.calculate_record_cost(self.token_record)
+
+    def limit_exceeded(self):
+        current_cost = self.token_limits.calculate_records_cost([self.token_record] if self.token_record else [])
+        return current_cost >= self.daily_limit
+
+    def amount_left(self, prompt_cost=0):
+        return self.daily_limit - (self.todays_cost() + prompt_cost)
+
+    def usage_percentage_remaining(self):
+        if isinstance(self.user_type, dict) and "error" in self.user_type:
+            logging.error(f"Error in user privileges: {self.user_type['error']}")
+            return self.user_type
+
+        todays_cost = self.todays_cost()
+        if todays_cost == 0:
+            percentage_remaining = 100.0
+        else:
+            percentage_used = (todays_cost / self.daily_limit) * 100
+            percentage_remaining = max(0, 100 - percentage_used)
+
+        return round(percentage_remaining, 1)
@@ -0,0 +1,66 @@
+import logging
+
+
+class StreamUsage:
+    '''
+    Token accounting for one streamed chat completion.
+
+    While the stream runs, assistant deltas are only buffered so nothing sits between
+    two chunks reaching the user. Usage is settled once at the end: the usage chunk the
+    service sends when stream_options.include_usage is set wins. It is only asked for
+    on preview API versions that accept stream_options and without On Your Data (see
+    stream_usage_supported in app.py); without it, or when the client disconnected
+    first, the prompt estimate from send_chat_request plus a single local count of the
+    buffered text is used.
+    '''
+
+    def __init__(self, token_limits, request_headers, model_used):
+        self.token_limits = token_limits
+        self.request_headers = request_headers
+        self.model_used = model_used
+        self.estimated_prompt_tokens = 0
+        self.reported_usage = None
+        self.settled = False
+        self._completion_parts = []
+
+    def observe_chunk(self, chunk):
+        usage = getattr(chunk, 'usage', None)
+        if usage:
+            self.reported_usage = {
+                'prompt_tokens': usage.prompt_tokens,
+                'completion_tokens': usage.completion_tokens
+            }
+
+    def add_completion_text(self, content):
+        self._completion_parts.append(content)
+
+    async def usage(self):
+        if self.reported_usage:
+            return self.reported_usage
+        return {
+            'prompt_tokens': self.estimated_prompt_tokens,
+            'completion_tokens': await self.token_limits.calculate_tokens_async(''.join(self._completion_parts))
+        }
+
+    async def settle(self):
+        if self.settled:
+            return None
+        self.settled = True
+
+        try:
+            usage = await self.usage()
+        except Exception:
+            logging.exception("StreamUsage: failed to count streamed usage")
+            return None
+        logging.info(f"StreamUsage: settling {usage} for {self.model_used} (reported by service: {self.reported_usage is not None})")
+        try:
+            entry = await self.token_limits.update_usage_from_openai_response(
+                request_headers=self.request_headers,
+                usage_data=usage,
+                model_used=self.model_used
+            )
+            await self.token_limits.flush_usage(self.request_headers)
+            return entry
+        except Exception:
+            logging.exception("StreamUsage: failed to record streamed usage")
+            return None
@@ -1,5 +1,4 @@
 
-import tiktoken
 import logging
 from datetime import datetime
 import os
@@ -9,19 +8,43 @@ from backend.history.cosmosdbservice import CosmosTokenClient
 from backend.settings import (
     app_settings
 )
+from backend.tokens.privilege_cache import PrivilegeCache
 from backend.tokens.token_privileges import TokenPrivileges
+from backend.tokens.tokenizer import TOKEN_ENCODING, get_tokenizer
+from backend.tokens.usage_ledger import TokenUsageLedger
 
 class TokenLimits:
-    def __init__(self, cosmos_token_client: CosmosTokenClient):
+    def __init__(self, cosmos_token_client: CosmosTokenClient, usage_ledger: TokenUsageLedger = None, privilege_cache: PrivilegeCache = None):
         self.cosmos_token_client = cosmos_token_client
-        self.token_privileges = TokenPrivileges(cosmos_token_client)
-        self.encoding = tiktoken.get_encoding("cl100k_base")
+        self.token_privileges = TokenPrivileges(cosmos_token_client, privilege_cache)
+        self.usage_ledger = usage_ledger
+        self.tokenizer = get_tokenizer(TOKEN_ENCODING)
 
-    def calculate_tokens(self, message: str) -> int:
+    @property
+    def encoding(self):
+        return self.tokenizer.encoding
+
+    def _check_message_type(self, message):
         if not isinstance(message, str):
             logging.error(f"Invalid message type: {type(message)} - {message}")
             raise TypeError(f"Expected string or buffer, got {type(message)}")
-        return len(self.encoding.encode(message))
+
+    def calculate_tokens(self, message: str) -> int:
+        self._check_message_type(message)
+        return self.tokenizer.count(message)
+
+    async def calculate_tokens_async(self, message: str) -> int:
+        self._check_message_type(message)
+        return await self.tokenizer.count_async(message)
+
+    async def calculate_tokens_many(self, messages, stored_counts: dict = None) -> list:
+        '''
+        Count each message, taking the count stored on its message document (keyed by
+        content hash) where there is one so that only new text is tokenised.
+        '''
+        for message in messages:
+            self._check_message_type(message)
+        return await self.tokenizer.count_many(messages, known_counts=stored_counts)
 
     async def update_usage_from_message(self, request_headers, message, model_used, message_type):
         user_details = get_authenticated_user_details(request_headers)
@@ -34,6 +57,18 @@ class TokenLimits:
         tokens = self.calculate_tokens(message)
         logging.info(f"update_usage_from_message: tokens: {tokens}")
 
+        if self.usage_ledger:
+            try:
+                return self.usage_ledger.record(
+                    user_id,
+                    today,
+                    model_used,
+                    input_tokens=tokens if message_type == 'input' else 0,
+                    output_tokens=tokens if message_type == 'output' else 0
+                )
+            except ValueError:
+                return {"error": "Unknown model"}
+
         token_record = await self.cosmos_token_client.get_token_usage(user_id, today)
 
         if not token_record:
@@ -61,6 +96,15 @@ class TokenLimits:
         user_details = get_authenticated_user_details(request_headers)
         user_id = user_details['user_principal_id']
 
+        if self.usage_ledger:
+            return self.usage_ledger.record(
+                user_id,
+                today,
+                model_used,
+                input_tokens=usage_data['prompt_tokens'],
+                output_tokens=usage_data['completion_tokens']
+            )
+
         token_record = await self.cosmos_token_client.get_token_usage(user_id, today)
 
         if not token_record:
@@ -79,14 +123,25 @@ class TokenLimits:
 
         return await self.cosmos_token_client.upsert_token_record(token_record)
 
+    async def flush_usage(self, request_headers):
+        if not self.usage_ledger:
+            return
+        user_id = get_authenticated_user_details(request_headers)['user_principal_id']
+        await self.usage_ledger.flush(user_id)
+
     async def check_token_costs(self, user_id, start_date, end_date):
+        token_records = await self.cosmos_token_client.query_token_usage(user_id, start_date, end_date)
+        if self.usage_ledger:
+            token_records = self.usage_ledger.apply_unflushed_to_records(token_records, user_id, start_date, end_date)
+
+        return self.calculate_records_cost(token_records)
+
+    def calculate_records_cost(self, token_records):
         gpt4_input_cost = 0.01 / 1000  # $0.01 per 1,000 tokens
         gpt4_output_cost = 0.03 / 1000  # $0.03 per 1,000 tokens
         gpt35_input_cost = 0.003 / 1000  # $0.003 per 1,000 tokens
         gpt35_output_cost = 0.004 / 1000  # $0.004 per 1,000 tokens
 
-        token_records = await self.cosmos_token_client.query_token_usage(user_id, start_date, end_date)
-
         total_cost = 0
         for record in token_records:
             total_cost += (record['gpt4InputTokens'] * gpt4_input_cost +
@@ -99,7 +154,12 @@ class TokenLimits:
     async def get_todays_cost(self, user_id):
         today = datetime.utcnow().date().isoformat()
         token_record = await self.cosmos_token_client.get_token_usage(user_id, today)
+        if self.usage_ledger:
+            token_record = self.usage_ledger.apply_unflushed(token_record, user_id, today)
+
+        return self.calculate_record_cost(token_record)
 
+    def calculate_record_cost(self, token_record):
         if not token_record:
             return 0
 
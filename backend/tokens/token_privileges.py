@@ -1,10 +1,13 @@
+import logging
 
 from backend.auth.auth_utils import get_authenticated_user_details
 from backend.history.cosmosdbservice import CosmosTokenClient
+from backend.tokens.privilege_cache import PrivilegeCache
 
 class TokenPrivileges:
-    def __init__(self, cosmos_token_client: CosmosTokenClient):
+    def __init__(self, cosmos_token_client: CosmosTokenClient, privilege_cache: PrivilegeCache = None):
         self.cosmos_token_client = cosmos_token_client
+        self.privilege_cache = privilege_cache
 
     async def check_user_token_privileges(self, request_headers):
         user_details = get_authenticated_user_details(request_headers)
@@ -14,10 +17,22 @@ class TokenPrivileges:
         user_id = user_details['user_principal_id']
         user_name = user_details['user_name']
 
+        if self.privilege_cache:
+            user_type = await self.privilege_cache.get_or_load(user_id, lambda: self.load_user_privilege_type(user_id, user_name))
+        else:
+            user_type = await self.load_user_privilege_type(user_id, user_name)
+
+        return user_type if user_type is not None else 'regular'
+
+    async def load_user_privilege_type(self, user_id, user_name):
         user_type = await self.cosmos_token_client.get_user_privilege_type(user_id)
-        
+
         if user_type is None:
-            user_type = 'regular'
-            await self.cosmos_token_client.create_user_privilege_record(user_id, user_name, user_type)
+            try:
+                await self.cosmos_token_client.create_default_user_privilege_record(user_id, user_name)
+                user_type = 'regular'
+            except Exception:
+                # Left as a negative cache entry so a failing insert isn't retried on every request
+                logging.exception(f"Failed to create the default privilege record for {user_id}")
 
         return user_type
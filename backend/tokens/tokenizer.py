@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import tiktoken
+
+TOKEN_ENCODING = "cl100k_base"
+
+
+def content_hash(text: str) -> str:
+    '''
+    Stable digest of a message's text, used to key cached and stored token counts.
+    '''
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+class TokenizerService:
+    '''
+    Token counting for one tiktoken encoding, shared by every TokenLimits in the worker.
+
+    Counts are memoised in a bounded LRU keyed by a hash of the text, so conversation
+    history that is re-sent on every turn is only encoded once. Batches of uncached
+    text above offload_threshold_chars are encoded with encode_batch on a small thread
+    pool so a long conversation never holds the event loop for long.
+    '''
+
+    def __init__(self, encoding_name: str = TOKEN_ENCODING, cache_size: int = 20000, offload_threshold_chars: int = 8000, max_workers: int = 2):
+        self.encoding_name = encoding_name
+        self.cache_size = cache_size
+        self.offload_threshold_chars = offload_threshold_chars
+        self.max_workers = max_workers
+        self._encoding = None
+        self._executor = None
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = Counter()
+
+    @property
+    def encoding(self):
+        if self._encoding is None:
+            self._encoding = tiktoken.get_encoding(self.encoding_name)
+        return self._encoding
+
+    @staticmethod
+    def _key(text):
+        return content_hash(text)
+
+    def _cached(self, key):
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                self.counters['hits'] += 1
+            return count
+
+    def _store(self, key, count):
+        with self._lock:
+            self._counts[key] = count
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+            self.counters['misses'] += 1
+
+    def count(self, text: str) -> int:
+        key = self._key(text)
+        count = self._cached(key)
+        if count is None:
+            count = len(self.encoding.encode(text))
+            self._store(key, count)
+        return count
+
+    async def count_async(self, text: str) -> int:
+        return (await self.count_many([text]))[0]
+
+    async def count_many(self, texts, known_counts: dict = None) -> list:
+        keys = [self._key(text) for text in texts]
+        # Counts stored elsewhere (e.g. on message documents) are used as they are
+        known_counts = known_counts or {}
+        counts = [known_counts[key] if key in known_counts else self._cached(key) for key in keys]
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if not missing:
+            return counts
+
+        uncached = [texts[i] for i in missing]
+        if sum(len(text) for text in uncached) >= self.offload_threshold_chars:
+            self.counters['offloaded_batches'] += 1
+            loop = asyncio.get_running_loop()
+            encoded = await loop.run_in_executor(self._get_executor(), self._encode_batch, uncached)
+        else:
+            encoded = [self.encoding.encode(text) for text in uncached]
+
+        for i, tokens in zip(missing, encoded):
+            counts[i] = len(tokens)
+            self._store(keys[i], counts[i])
+        return counts
+
+    def _encode_batch(self, texts):
+        return self.encoding.encode_batch(texts, num_threads=self.max_workers)
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tokenizer")
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            'encoding': self.encoding_name,
+            'cached_counts': len(self._counts),
+            'hits': self.counters['hits'],
+            'misses': self.counters['misses'],
+            'offloaded_batches': self.counters['offloaded_batches'],
+        }
+
+
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+
+
+def get_tokenizer(encoding_name: str = TOKEN_ENCODING) -> TokenizerService:
+    '''
+    Return the process-wide TokenizerService for an encoding, creating it on first use.
+    '''
+    tokenizer = _tokenizers.get(encoding_name)
+    if tokenizer is None:
+        with _tokenizers_lock:
+            tokenizer = _tokenizers.setdefault(encoding_name, TokenizerService(encoding_name))
+    return tokenizer
+
+
+def close_tokenizers():
+    for tokenizer in list(_tokenizers.values()):
+        tokenizer.close()
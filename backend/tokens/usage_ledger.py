@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from collections import Counter, defaultdict
+
+from backend.history.cosmosdbservice import CosmosTokenClient
+
+TOKEN_USAGE_FIELDS = ('gpt35InputTokens', 'gpt35OutputTokens', 'gpt4InputTokens', 'gpt4OutputTokens')
+
+
+def usage_fields_for_model(model_used):
+    '''
+    Map a model name onto the (input, output) counters of a token usage record.
+    '''
+    if model_used.startswith('gpt-35-turbo'):
+        return 'gpt35InputTokens', 'gpt35OutputTokens'
+    elif model_used.startswith('gpt-4o'):
+        return 'gpt4InputTokens', 'gpt4OutputTokens'
+    raise ValueError("Unknown model")
+
+
+class TokenUsageLedger:
+    '''
+    Write-behind ledger of token usage per (user, day).
+
+    Usage is accumulated in memory and written to the token container as Cosmos
+    patch increments, so a request costs one write no matter how many messages
+    or stream chunks it counted, and concurrent workers add to the same record
+    instead of overwriting each other. Unflushed deltas (including ones whose
+    write is still in flight) are exposed so quota checks stay exact.
+    '''
+
+    def __init__(self, cosmos_token_client: CosmosTokenClient, flush_interval_seconds: float = 5.0):
+        self.cosmos_token_client = cosmos_token_client
+        self.flush_interval_seconds = flush_interval_seconds
+        self._pending = defaultdict(Counter)
+        self._in_flight = defaultdict(Counter)
+        self._flush_task = None
+        self.counters = Counter()
+
+    def record(self, user_id, date, model_used, input_tokens=0, output_tokens=0):
+        input_field, output_field = usage_fields_for_model(model_used)
+        deltas = self._pending[(user_id, date)]
+        if input_tokens:
+            deltas[input_field] += input_tokens
+        if output_tokens:
+            deltas[output_field] += output_tokens
+        self.counters['records'] += 1
+        return dict(deltas)
+
+    def unflushed(self, user_id, date) -> Counter:
+        key = (user_id, date)
+        return self._pending.get(key, Counter()) + self._in_flight.get(key, Counter())
+
+    def apply_unflushed(self, token_record, user_id, date):
+        '''
+        Return the stored record for (user, day) with the unflushed deltas added.
+        '''
+        deltas = self.unflushed(user_id, date)
+        if not token_record and not deltas:
+            return token_record
+
+        adjusted = dict(token_record) if token_record else {'userId': user_id, 'date': date}
+        for field in TOKEN_USAGE_FIELDS:
+            adjusted[field] = adjusted.get(field, 0) + deltas.get(field, 0)
+        return adjusted
+
+    def apply_unflushed_to_records(self, token_records, user_id, start_date, end_date):
+        records_by_date = {record['date']: record for record in token_records}
+        dates = set(records_by_date)
+        dates.update(date for (uid, date) in list(self._pending) + list(self._in_flight) if uid == user_id and start_date <= date <= end_date)
+        return [self.apply_unflushed(records_by_date.get(date), user_id, date) for date in sorted(dates)]
+
+    async def flush(self, user_id=None):
+        keys = [key for key in list(self._pending) if user_id is None or key[0] == user_id]
+        if keys:
+            await asyncio.gather(*(self._flush_key(key) for key in keys))
+
+    async def _flush_key(self, key):
+        deltas = self._pending.pop(key, None)
+        if not deltas:
+            return
+
+        user_id, date = key
+        self._in_flight[key].update(deltas)
+        try:
+            await self.cosmos_token_client.increment_token_usage(user_id, date, dict(deltas))
+            self.counters['writes'] += 1
+        except BaseException as e:
+            # Keep the usage so the next flush retries it rather than losing it
+            self._pending[key].update(deltas)
+            self.counters['write_failures'] += 1
+            if isinstance(e, Exception):
+                logging.exception(f"TokenUsageLedger: failed to flush usage for {user_id} on {date}")
+            else:
+                raise
+        finally:
+            remaining = self._in_flight[key] - deltas
+            if remaining:
+                self._in_flight[key] = remaining
+            else:
+                del self._in_flight[key]
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            await self.flush()
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            'pending_keys': len(self._pending),
+            'in_flight_keys': len(self._in_flight),
+            **self.counters,
+        }
@@ -1,20 +1,20 @@
 import os
+import base64
 import json
 import logging
-import requests
 import dataclasses
 
 from typing import List
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 DEBUG = os.environ.get("DEBUG", "false")
 if DEBUG.lower() == "true":
     logging.basicConfig(level=logging.DEBUG)
 
-AZURE_SEARCH_PERMITTED_GROUPS_COLUMN = os.environ.get(
-    "AZURE_SEARCH_PERMITTED_GROUPS_COLUMN"
-)
-
-
 class JSONEncoder(json.JSONEncoder):
     def default(self, o):
         if dataclasses.is_dataclass(o):
@@ -22,6 +22,14 @@ class JSONEncoder(json.JSONEncoder):
         return super().default(o)
 
 
+async def close_source(r):
+    # Closes the stream being formatted as soon as the response is closed (the client
+    # went away) instead of whenever the garbage collector gets to it
+    aclose = getattr(r, "aclose", None)
+    if aclose:
+        await aclose()
+
+
 async def format_as_ndjson(r):
     try:
         async for event in r:
@@ -29,50 +37,124 @@ async def format_as_ndjson(r):
     except Exception as error:
         logging.exception("Exception while generating response stream: %s", error)
         yield json.dumps({"error": str(error)})
+    finally:
+        await close_source(r)
 
 
-def parse_multi_columns(columns: str) -> list:
-    if "|" in columns:
-        return columns.split("|")
-    else:
-        return columns.split(",")
+# Accept type (and response type) of the compact stream format
+COMPACT_STREAM_MIMETYPE = "application/vnd.chat-delta+json-lines"
 
+# Fields format_stream_response repeats on every chunk
+STREAM_ENVELOPE_FIELDS = ("id", "model", "created", "object", "history_metadata", "apim-request-id")
+
+
+def dumps_line(value) -> bytes:
+    # orjson when it is installed; it serializes dataclasses natively
+    if orjson:
+        return orjson.dumps(value, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(value, cls=JSONEncoder, separators=(",", ":")) + "\n").encode()
+
+
+def dumps_bytes(value) -> bytes:
+    # Same as dumps_line without the newline
+    if orjson:
+        return orjson.dumps(value)
+    return json.dumps(value, cls=JSONEncoder, separators=(",", ":")).encode()
 
-def fetchUserGroups(userToken, nextLink=None):
-    # Recursively fetch group membership
-    if nextLink:
-        endpoint = nextLink
-    else:
-        endpoint = "https://graph.microsoft.com/v1.0/me/transitiveMemberOf?$select=id"
 
-    headers = {"Authorization": "bearer " + userToken}
+async def format_as_compact_ndjson(r):
+    """
+    Compact alternative to format_as_ndjson for format_stream_response events. The
+    envelope is sent once in a header frame, {"t": "header", "id": ..., "history_metadata": ...},
+    and again only if it changes; every chunk after that is just its delta, {"c": "..."},
+    with "r" set when the role is not assistant. Chunks without a message are dropped,
+    and {"t": "end", "count": <deltas>} closes a stream that finished without an error.
+    """
+    envelope = None
+    count = 0
     try:
-        r = requests.get(endpoint, headers=headers)
-        if r.status_code != 200:
-            logging.error(f"Error fetching user groups: {r.status_code} {r.text}")
-            return []
+        async for event in r:
+            if not event or not event.get("choices"):
+                continue
+            event_envelope = {field: event.get(field) for field in STREAM_ENVELOPE_FIELDS}
+            if event_envelope != envelope:
+                envelope = event_envelope
+                yield dumps_line({"t": "header", **envelope})
+            for message in event["choices"][0]["messages"]:
+                delta = {"c": message.get("content")}
+                if message.get("role") != "assistant":
+                    delta["r"] = message.get("role")
+                count += 1
+                yield dumps_line(delta)
+        yield dumps_line({"t": "end", "count": count})
+    except Exception as error:
+        logging.exception("Exception while generating response stream: %s", error)
+        yield dumps_line({"t": "error", "error": str(error)})
+    finally:
+        await close_source(r)
 
-        r = r.json()
-        if "@odata.nextLink" in r:
-            nextLinkData = fetchUserGroups(userToken, r["@odata.nextLink"])
-            r["value"].extend(nextLinkData)
 
-        return r["value"]
-    except Exception as e:
-        logging.error(f"Exception in fetchUserGroups: {e}")
-        return []
+class FrozenDict(dict):
+    """A dict that refuses in-place changes but still serializes as a plain JSON object."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("FrozenDict is read-only; copy it before changing it")
 
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
 
-def generateFilterString(userToken):
-    # Get list of groups user is a member of
-    userGroups = fetchUserGroups(userToken)
+    def __ior__(self, other):
+        self._readonly()
 
-    # Construct filter string
-    if not userGroups:
-        logging.debug("No user groups found")
+    def __reduce__(self):
+        # copy/deepcopy/pickle rebuild from a plain dict instead of item-by-item assignment
+        return (type(self), (dict(self),))
 
-    group_ids = ", ".join([obj["id"] for obj in userGroups])
-    return f"{AZURE_SEARCH_PERMITTED_GROUPS_COLUMN}/any(g:search.in(g, '{group_ids}'))"
+
+def freeze_payload(value):
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze_payload(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze_payload(item) for item in value)
+    return value
+
+
+SECRET_PARAMS = ("key", "connection_string", "embedding_key", "encoded_api_key", "api_key")
+
+
+def redact_secrets(value):
+    if isinstance(value, dict):
+        return {
+            key: "*****" if key in SECRET_PARAMS and item else redact_secrets(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact_secrets(item) for item in value]
+    return value
+
+
+def encode_cursor(continuation_token: str) -> str:
+    # Opaque to clients: the Cosmos continuation token is wrapped so its format can change
+    payload = json.dumps({"v": 1, "token": continuation_token}).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if payload.get("v") != 1 or not isinstance(payload.get("token"), str):
+            raise ValueError
+        return payload["token"]
+    except (ValueError, TypeError, AttributeError, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+
+def parse_multi_columns(columns: str) -> list:
+    if "|" in columns:
+        return columns.split("|")
+    else:
+        return columns.split(",")
 
 
 def format_non_streaming_response(chatCompletion, history_metadata, apim_request_id):
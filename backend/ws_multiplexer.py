@@ -0,0 +1,112 @@
+import asyncio
+import json
+import logging
+from collections import Counter
+
+from backend.utils import dumps_bytes
+
+
+class WebSocketMultiplexer:
+    '''
+    Runs the operations of one websocket connection, several at a time.
+
+    Clients send {"id": ..., "type": <operation>, "body": {...}}; the id is the
+    client's and tags every frame sent back for that operation:
+
+        {"id", "type": "event", "data": ...}     one per event of a streamed operation
+        {"id", "type": "end", "count": n}        after the last event
+        {"id", "type": "result", "status", "data"}   the answer of a non-streamed one
+        {"id", "type": "error", "status", "error"}
+        {"id", "type": "cancelled"}              after {"id", "type": "cancel"}
+
+    An operation is an async callable taking the body and returning either an async
+    iterator of events or a (payload, status) tuple, the way the REST handlers answer.
+    Closing the multiplexer cancels whatever is still running.
+    '''
+
+    def __init__(self, send, operations: dict, max_in_flight: int = 4):
+        self.send = send
+        self.operations = operations
+        self.max_in_flight = max_in_flight
+        self.closed = False
+        self._in_flight = {}
+        self.counters = Counter()
+
+    async def _send(self, frame):
+        if self.closed:
+            return
+        try:
+            await self.send(dumps_bytes(frame).decode())
+        except Exception:
+            # The connection is going away; the receive loop notices and closes us
+            logging.debug("WebSocketMultiplexer: dropped a frame for a closed connection")
+
+    async def dispatch(self, raw):
+        try:
+            message = json.loads(raw)
+            op_id, kind = message["id"], message["type"]
+        except (ValueError, TypeError, KeyError):
+            await self._send({"id": None, "type": "error", "status": 400, "error": "Messages must be JSON objects with an id and a type"})
+            return
+
+        if kind == "cancel":
+            task = self._in_flight.get(op_id)
+            if task:
+                task.cancel()
+            return
+        operation = self.operations.get(kind)
+        if operation is None:
+            await self._send({"id": op_id, "type": "error", "status": 400, "error": f"Unknown message type {kind}"})
+            return
+        if op_id in self._in_flight:
+            await self._send({"id": op_id, "type": "error", "status": 409, "error": f"Message {op_id} is already in flight"})
+            return
+        if len(self._in_flight) >= self.max_in_flight:
+            await self._send({"id": op_id, "type": "error", "status": 429, "error": f"At most {self.max_in_flight} operations can run at once"})
+            return
+
+        self.counters[kind] += 1
+        task = asyncio.ensure_future(self._run(op_id, operation, message.get("body") or {}))
+        self._in_flight[op_id] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(op_id, None))
+
+    async def _run(self, op_id, operation, body):
+        try:
+            result = await operation(body)
+            if isinstance(result, tuple):
+                payload, status = result
+                if status >= 400:
+                    await self._send({"id": op_id, "type": "error", "status": status, "error": payload.get("error")})
+                else:
+                    await self._send({"id": op_id, "type": "result", "status": status, "data": payload})
+                return
+
+            count = 0
+            try:
+                async for event in result:
+                    if event:
+                        count += 1
+                        await self._send({"id": op_id, "type": "event", "data": event})
+            finally:
+                aclose = getattr(result, "aclose", None)
+                if aclose:
+                    await aclose()
+            await self._send({"id": op_id, "type": "end", "count": count})
+        except asyncio.CancelledError:
+            self.counters['cancelled'] += 1
+            await self._send({"id": op_id, "type": "cancelled"})
+        except Exception as e:
+            logging.exception(f"Exception in websocket operation {op_id}")
+            self.counters['errors'] += 1
+            await self._send({"id": op_id, "type": "error", "status": getattr(e, "status_code", 500), "error": str(e)})
+
+    async def close(self):
+        self.closed = True
+        tasks = list(self._in_flight.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+
+    def stats(self) -> dict:
+        return {'in_flight': len(self._in_flight), **self.counters}
@@ -1,6 +1,14 @@
 import { chatHistorySampleData } from '../constants/chatHistory'
 
-import { ChatMessage, Conversation, ConversationRequest, CosmosDBHealth, CosmosDBStatus, UserInfo } from './models'
+import {
+  ChatMessage,
+  Conversation,
+  ConversationRequest,
+  CosmosDBHealth,
+  CosmosDBStatus,
+  HistoryListPage,
+  UserInfo
+} from './models'
 
 export async function conversationApi(options: ConversationRequest, abortSignal: AbortSignal): Promise<Response> {
   const response = await fetch('/conversation', {
@@ -35,11 +43,14 @@ export const fetchChatHistoryInit = (): Conversation[] | null => {
   return chatHistorySampleData
 }
 
-export const historyList = async (offset = 0): Promise<Conversation[] | null> => {
-  const response = await fetch(`/history/list?offset=${offset}`, {
+export const historyList = async (cursor: string | null = null): Promise<HistoryListPage | null> => {
+  // Pass the cursor from the previous page to get the next one; a null cursor in the result means no more pages
+  const url = cursor ? `/history/list?cursor=${encodeURIComponent(cursor)}` : '/history/list'
+  const response = await fetch(url, {
     method: 'GET'
   })
     .then(async res => {
+      const nextCursor = res.headers.get('X-History-Cursor')
       const payload = await res.json()
       if (!Array.isArray(payload)) {
         console.error('There was an issue fetching your data.')
@@ -65,7 +76,7 @@ export const historyList = async (offset = 0): Promise<Conversation[] | null> =>
           return conversation
         })
       )
-      return conversations
+      return { conversations, cursor: nextCursor }
     })
     .catch(_err => {
       console.error('There was an issue fetching your data.')
@@ -220,6 +231,25 @@ export const historyDeleteAll = async (): Promise<Response> => {
   return response
 }
 
+export const historyWaitForJob = async (jobId: string, pollIntervalMs = 1000): Promise<boolean> => {
+  // Polls a background history job (e.g. delete all) until it succeeds or fails
+  for (;;) {
+    const job = await fetch(`/history/jobs/${encodeURIComponent(jobId)}`, { method: 'GET' })
+      .then(async res => (res.ok ? res.json() : null))
+      .catch(_err => {
+        console.error('There was an issue fetching your data.')
+        return null
+      })
+    if (!job || job.status === 'failed') {
+      return false
+    }
+    if (job.status === 'succeeded') {
+      return true
+    }
+    await new Promise(resolve => setTimeout(resolve, pollIntervalMs))
+  }
+}
+
 export const historyClear = async (convId: string): Promise<Response> => {
   const response = await fetch('/history/clear', {
     method: 'POST',
@@ -68,6 +68,11 @@ export type Conversation = {
   date: string
 }
 
+export type HistoryListPage = {
+  conversations: Conversation[]
+  cursor: string | null
+}
+
 export enum ChatCompletionType {
   ChatCompletion = 'chat.completion',
   ChatCompletionChunk = 'chat.completion.chunk'
@@ -299,7 +299,6 @@ export const ChatHistoryListItemGroups: React.FC<ChatHistoryListItemGroupsProps>
   const appStateContext = useContext(AppStateContext)
   const observerTarget = useRef(null)
   const [, setSelectedItem] = React.useState<Conversation | null>(null)
-  const [offset, setOffset] = useState<number>(25)
   const [observerCounter, setObserverCounter] = useState(0)
   const [showSpinner, setShowSpinner] = useState(false)
   const firstRender = useRef(true)
@@ -320,17 +319,22 @@ export const ChatHistoryListItemGroups: React.FC<ChatHistoryListItemGroupsProps>
       return
     }
     handleFetchHistory()
-    setOffset(offset => (offset += 25))
   }, [observerCounter])
 
   const handleFetchHistory = async () => {
     const currentChatHistory = appStateContext?.state.chatHistory
+    const cursor = appStateContext?.state.chatHistoryCursor
+    if (!cursor) {
+      // The last page has already been loaded
+      return
+    }
     setShowSpinner(true)
 
-    await historyList(offset).then(response => {
-      const concatenatedChatHistory = currentChatHistory && response && currentChatHistory.concat(...response)
+    await historyList(cursor).then(response => {
+      const concatenatedChatHistory = currentChatHistory && response && currentChatHistory.concat(...response.conversations)
       if (response) {
-        appStateContext?.dispatch({ type: 'FETCH_CHAT_HISTORY', payload: concatenatedChatHistory || response })
+        appStateContext?.dispatch({ type: 'FETCH_CHAT_HISTORY', payload: concatenatedChatHistory || response.conversations })
+        appStateContext?.dispatch({ type: 'SET_CHAT_HISTORY_CURSOR', payload: response.cursor })
       } else {
         appStateContext?.dispatch({ type: 'FETCH_CHAT_HISTORY', payload: null })
       }
@@ -19,7 +19,7 @@ import {
 } from '@fluentui/react'
 import { useBoolean } from '@fluentui/react-hooks'
 
-import { ChatHistoryLoadingState, historyDeleteAll } from '../../api'
+import { ChatHistoryLoadingState, historyDeleteAll, historyWaitForJob } from '../../api'
 import { AppStateContext } from '../../state/AppProvider'
 
 import ChatHistoryList from './ChatHistoryList'
@@ -84,7 +84,9 @@ export function ChatHistoryPanel(_props: ChatHistoryPanelProps) {
   const onClearAllChatHistory = async () => {
     setClearing(true)
     const response = await historyDeleteAll()
-    if (!response.ok) {
+    // 202: the delete runs as a background job, so wait for it before clearing the list
+    const deleted = response.status === 202 ? await historyWaitForJob((await response.json()).job_id) : response.ok
+    if (!deleted) {
       setClearingError(true)
     } else {
       appStateContext?.dispatch({ type: 'DELETE_CHAT_HISTORY' })
@@ -46,7 +46,7 @@ export const appStateReducer = (state: AppState, action: Action): AppState => {
       return { ...state, chatHistory: filteredChat }
     case 'DELETE_CHAT_HISTORY':
       //TODO: make api call to delete all conversations from DB
-      return { ...state, chatHistory: [], filteredChatHistory: [], currentChat: null }
+      return { ...state, chatHistory: [], chatHistoryCursor: null, filteredChatHistory: [], currentChat: null }
     case 'DELETE_CURRENT_CHAT_MESSAGES':
       //TODO: make api call to delete current conversation messages from DB
       if (!state.currentChat || !state.chatHistory) {
@@ -62,6 +62,8 @@ export const appStateReducer = (state: AppState, action: Action): AppState => {
       }
     case 'FETCH_CHAT_HISTORY':
       return { ...state, chatHistory: action.payload }
+    case 'SET_CHAT_HISTORY_CURSOR':
+      return { ...state, chatHistoryCursor: action.payload }
     case 'SET_COSMOSDB_STATUS':
       return { ...state, isCosmosDBAvailable: action.payload }
     case 'FETCH_FRONTEND_SETTINGS':
@@ -0,0 +1,136 @@
+"""
+Apply the conversations container indexing policy to an existing Cosmos DB account.
+
+Adds composite indexes on (userId, type, updatedAt) for the history list and
+excludes message content and token bookkeeping fields from indexing (see
+backend/history/indexing_policy.py). New deployments get the same policy from the
+infra templates; this script is for containers created before it.
+
+Without --apply the current and proposed policies are printed and nothing changes.
+The index transformation after --apply runs online in the background; progress is
+printed until it finishes (or use --no-wait). --measure runs the history list query
+and writes and deletes one probe message, printing the request charges, so it can be
+run before and after the migration to compare.
+
+    python scripts/migrate_conversations_indexing.py --measure
+    python scripts/migrate_conversations_indexing.py --apply --measure
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+from azure.cosmos import CosmosClient, PartitionKey
+from azure.identity import DefaultAzureCredential
+from dotenv import load_dotenv
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from backend.history.indexing_policy import CONVERSATION_LIST_FIELDS, merge_indexing_policy
+
+load_dotenv()
+
+PROBE_USER_ID = "indexing-policy-probe"
+TRANSFORMATION_PROGRESS_HEADER = "x-ms-documentdb-collection-index-transformation-progress"
+
+
+def get_container(args):
+    endpoint = args.endpoint or f"https://{os.environ['AZURE_COSMOSDB_ACCOUNT']}.documents.azure.com:443/"
+    key = os.environ.get("AZURE_COSMOSDB_ACCOUNT_KEY")
+    client = CosmosClient(endpoint, credential=key if key else DefaultAzureCredential())
+    return client, client.get_database_client(args.database).get_container_client(args.container)
+
+
+def last_request_charge(client):
+    return float(client.client_connection.last_response_headers.get("x-ms-request-charge", 0))
+
+
+def measure(client, container, user_id):
+    fields = ", ".join(f"c.{field}" for field in CONVERSATION_LIST_FIELDS)
+    queries = {
+        "list (SELECT *)": "SELECT * FROM c where c.userId = @userId and c.type='conversation' order by c.updatedAt DESC",
+        "list (projected)": f"SELECT {fields} FROM c where c.userId = @userId and c.type='conversation' order by c.updatedAt DESC",
+    }
+    for name, query in queries.items():
+        pages = container.query_items(query=query, parameters=[{"name": "@userId", "value": user_id}], partition_key=user_id, max_item_count=25).by_page()
+        items = list(next(pages, []))
+        print(f"{name:<18} {last_request_charge(client):>8.2f} RU for {len(items)} conversations")
+
+    message = {
+        "id": str(uuid.uuid4()),
+        "type": "message",
+        "userId": PROBE_USER_ID,
+        "createdAt": datetime.utcnow().isoformat(),
+        "updatedAt": datetime.utcnow().isoformat(),
+        "conversationId": str(uuid.uuid4()),
+        "role": "assistant",
+        "content": "Indexing policy probe. " * 200,
+    }
+    container.upsert_item(message)
+    print(f"{'message write':<18} {last_request_charge(client):>8.2f} RU for a {len(json.dumps(message)) / 1024:.1f} KB message")
+    container.delete_item(item=message["id"], partition_key=PROBE_USER_ID)
+
+
+def wait_for_transformation(client, container):
+    while True:
+        container.read(populate_quota_info=True)
+        progress = client.client_connection.last_response_headers.get(TRANSFORMATION_PROGRESS_HEADER)
+        print(f"index transformation: {progress or '?'}%")
+        if progress is None or int(progress) >= 100:
+            return
+        time.sleep(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", help="Cosmos DB endpoint (default: built from AZURE_COSMOSDB_ACCOUNT)")
+    parser.add_argument("--database", default=os.environ.get("AZURE_COSMOSDB_DATABASE", "db_conversation_history"))
+    parser.add_argument("--container", default=os.environ.get("AZURE_COSMOSDB_CONVERSATIONS_CONTAINER", "conversations"))
+    parser.add_argument("--apply", action="store_true", help="replace the container's indexing policy")
+    parser.add_argument("--no-wait", action="store_true", help="don't wait for the index transformation")
+    parser.add_argument("--measure", action="store_true", help="print request charges for a list query and a message write")
+    parser.add_argument("--measure-user", default=PROBE_USER_ID, help="user whose conversations the list query reads")
+    args = parser.parse_args()
+
+    client, container = get_container(args)
+    properties = container.read()
+    current = properties.get("indexingPolicy", {})
+    proposed = merge_indexing_policy(current)
+
+    print("current indexing policy:")
+    print(json.dumps(current, indent=2))
+    if proposed == current:
+        print("the container already has the conversations indexing policy")
+    else:
+        print("proposed indexing policy:")
+        print(json.dumps(proposed, indent=2))
+
+    if args.measure:
+        print("before:" if args.apply else "charges:")
+        measure(client, container, args.measure_user)
+
+    if not args.apply or proposed == current:
+        return
+
+    partition_key = properties["partitionKey"]
+    client.get_database_client(args.database).replace_container(
+        container,
+        partition_key=PartitionKey(path=partition_key["paths"][0], kind=partition_key.get("kind", "Hash")),
+        indexing_policy=proposed,
+        default_ttl=properties.get("defaultTtl")
+    )
+    print("indexing policy replaced")
+
+    if args.no_wait:
+        return
+    wait_for_transformation(client, container)
+    if args.measure:
+        print("after:")
+        measure(client, container, args.measure_user)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import asyncio
+import pytest
+from azure.cosmos import exceptions
+from backend.history.bulk_delete import BulkSoftDeleter
+
+USER_ID = "user-1"
+
+
+class FakeContainer:
+    def __init__(self, docs=(), throttle=0, fail_ids=()):
+        self.docs = {doc["id"]: dict(doc) for doc in docs}
+        self.throttle = throttle
+        self.fail_ids = set(fail_ids)
+        self.batches = []
+        self.queries = []
+        self.active = 0
+        self.max_active = 0
+
+    async def query_items(self, query, parameters, partition_key):
+        values = {p["name"]: p["value"] for p in parameters}
+        self.queries.append(query)
+        for doc in list(self.docs.values()):
+            if "@conversationId" in values and doc.get("conversationId") != values["@conversationId"]:
+                continue
+            if "@ids" in values and doc["id"] not in values["@ids"]:
+                continue
+            if query.startswith("SELECT c.id, c.type, c.conversationId "):
+                doc = {key: doc[key] for key in ("id", "type", "conversationId") if key in doc}
+            yield dict(doc)
+
+    async def read_item(self, item, partition_key):
+        if item not in self.docs:
+            raise exceptions.CosmosResourceNotFoundError(status_code=404, message="not found")
+        return self.docs[item]
+
+    async def execute_item_batch(self, batch_operations, partition_key):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(0.001)
+            if self.throttle:
+                self.throttle -= 1
+                raise exceptions.CosmosHttpResponseError(status_code=429, message="throttled")
+            self.batches.append(batch_operations)
+            for index, (kind, args) in enumerate(batch_operations):
+                doc_id = args[0] if kind == "delete" else args[0]["id"]
+                if doc_id in self.fail_ids:
+                    raise exceptions.CosmosBatchOperationError(error_index=index, headers={}, status_code=400, message="bad")
+                if kind == "delete" and doc_id not in self.docs:
+                    raise exceptions.CosmosBatchOperationError(error_index=index, headers={}, status_code=404, message="gone")
+            for kind, args in batch_operations:
+                if kind == "delete":
+                    del self.docs[args[0]]
+                else:
+                    self.docs[args[0]["id"]] = dict(args[0])
+            return [{"statusCode": 200} for _ in batch_operations]
+        finally:
+            self.active -= 1
+
+
+def conversation_docs(conversation_id, messages):
+    docs = [{"id": conversation_id, "type": "conversation", "userId": USER_ID}]
+    docs += [
+        {"id": f"{conversation_id}-m{i}", "type": "message", "userId": USER_ID, "conversationId": conversation_id, "content": f"message {i}"}
+        for i in range(messages)
+    ]
+    return docs
+
+
+async def no_sleep(seconds):
+    pass
+
+
+@pytest.mark.asyncio
+async def test_soft_delete_all_moves_everything_in_batches():
+    live = FakeContainer(conversation_docs("c1", 250) + conversation_docs("c2", 3))
+    deleted = FakeContainer()
+    deleter = BulkSoftDeleter(live, deleted, max_concurrency=2, max_batch_operations=100)
+
+    results = await deleter.soft_delete(USER_ID, await deleter.load_documents(USER_ID))
+
+    assert results == {
+        "c1": {"status": "deleted", "messages_deleted": 250, "conversation_deleted": True},
+        "c2": {"status": "deleted", "messages_deleted": 3, "conversation_deleted": True},
+    }
+    assert live.docs == {}
+    assert len(deleted.docs) == 255
+    assert max(len(batch) for batch in deleted.batches) == 100
+    assert deleted.max_active <= 2
+
+
+@pytest.mark.asyncio
+async def test_throttled_batches_are_retried():
+    live = FakeContainer(conversation_docs("c1", 5))
+    deleted = FakeContainer(throttle=2)
+    deleter = BulkSoftDeleter(live, deleted, sleep=no_sleep)
+
+    results = await deleter.soft_delete(USER_ID, await deleter.load_documents(USER_ID, "c1"))
+
+    assert results["c1"]["status"] == "deleted"
+    assert live.docs == {}
+
+
+@pytest.mark.asyncio
+async def test_failed_messages_keep_the_conversation():
+    live = FakeContainer(conversation_docs("c1", 5) + conversation_docs("c2", 1))
+    deleted = FakeContainer(fail_ids={"c1-m2"})
+    deleter = BulkSoftDeleter(live, deleted, max_batch_operations=2)
+
+    results = await deleter.soft_delete(USER_ID, await deleter.load_documents(USER_ID))
+
+    assert results["c1"]["status"] == "failed"
+    assert results["c1"]["conversation_deleted"] is False
+    assert results["c1"]["messages_deleted"] == 3
+    assert "c1" in live.docs and "c1-m2" in live.docs
+    assert results["c2"]["status"] == "deleted"
+
+
+@pytest.mark.asyncio
+async def test_messages_only_and_missing_conversation():
+    live = FakeContainer(conversation_docs("c1", 4))
+    deleter = BulkSoftDeleter(live, FakeContainer())
+
+    results = await deleter.soft_delete(USER_ID, await deleter.load_documents(USER_ID, "c1"), include_conversations=False)
+    assert results["c1"] == {"status": "deleted", "messages_deleted": 4, "conversation_deleted": False}
+    assert list(live.docs) == ["c1"]
+
+    assert await deleter.load_documents(USER_ID, "missing") == {}
+
+
+@pytest.mark.asyncio
+async def test_only_ids_are_loaded_up_front():
+    live = FakeContainer(conversation_docs("c1", 3))
+    deleted = FakeContainer()
+    deleter = BulkSoftDeleter(live, deleted)
+
+    documents = await deleter.load_documents(USER_ID)
+    assert documents["c1"]["messages"][0] == {"id": "c1-m0", "type": "message", "conversationId": "c1"}
+
+    await deleter.soft_delete(USER_ID, documents)
+    # The full documents are read per chunk when moved
+    assert deleted.docs["c1-m0"]["content"] == "message 0"
+    assert deleted.docs["c1"]["userId"] == USER_ID
+    assert live.docs == {}
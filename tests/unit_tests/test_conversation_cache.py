@@ -0,0 +1,201 @@
+import asyncio
+import pytest
+from azure.cosmos import exceptions
+from backend.history.conversation_cache import ConversationCache, InProcessCacheBackend, RedisCacheBackend
+from backend.history.cosmosdbservice import CosmosConversationClient
+from tools.benchmarks.redis_standin import RedisStandIn
+
+USER_ID = "user-1"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def conversation(conversation_id="c1"):
+    return {"id": conversation_id, "type": "conversation", "userId": USER_ID, "title": "Budget", "updatedAt": "2024-01-01T00:00:00"}
+
+
+def message(message_id, conversation_id="c1", created_at="2024-01-01T00:01:00"):
+    return {"id": message_id, "type": "message", "userId": USER_ID, "conversationId": conversation_id, "role": "user", "content": message_id, "createdAt": created_at}
+
+
+class Loader:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+@pytest.mark.asyncio
+async def test_read_through_and_write_through():
+    clock = FakeClock()
+    cache = ConversationCache(InProcessCacheBackend(max_entries=10, clock=clock), ttl_seconds=60)
+
+    load_conversation = Loader(conversation())
+    load_messages = Loader([message("m1")])
+    assert (await cache.get_conversation(USER_ID, "c1", load_conversation))["title"] == "Budget"
+    assert await cache.get_conversation(USER_ID, "c1", load_conversation) == conversation()
+    assert [m["id"] for m in await cache.get_messages(USER_ID, "c1", load_messages)] == ["m1"]
+    assert load_conversation.calls == 1 and load_messages.calls == 1
+
+    # Cached documents are copies: changing one does not change the cache
+    (await cache.get_conversation(USER_ID, "c1", load_conversation))["title"] = "changed"
+
+    await cache.put_message(message("m2", created_at="2024-01-01T00:02:00"))
+    await cache.put_message({**message("m1"), "feedback": "positive"}, touch_conversation=False)
+    messages = await cache.get_messages(USER_ID, "c1", load_messages)
+    assert [(m["id"], m.get("feedback")) for m in messages] == [("m1", "positive"), ("m2", None)]
+    cached = await cache.get_conversation(USER_ID, "c1", load_conversation)
+    assert cached["title"] == "Budget" and cached["updatedAt"] == "2024-01-01T00:02:00"
+    assert load_messages.calls == 1
+
+    await cache.invalidate(USER_ID, "c1")
+    await cache.get_messages(USER_ID, "c1", load_messages)
+    assert load_messages.calls == 2
+
+    clock.now = 61
+    await cache.get_conversation(USER_ID, "c1", load_conversation)
+    assert load_conversation.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction_and_failing_backend():
+    backend = InProcessCacheBackend(max_entries=2)
+    cache = ConversationCache(backend)
+    for conversation_id in ("c1", "c2", "c3"):
+        await cache.put_conversation(conversation(conversation_id), messages=[])
+    assert await cache.get(USER_ID, "c1") is None
+    assert backend.stats()["evictions"] == 1
+
+    class BrokenBackend(InProcessCacheBackend):
+        async def get(self, key):
+            raise ConnectionError("cache is down")
+
+    cache = ConversationCache(BrokenBackend())
+    loader = Loader(conversation())
+    assert await cache.get_conversation(USER_ID, "c1", loader) == conversation()
+    assert cache.stats()["errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_is_shared_between_workers():
+    async with RedisStandIn() as redis_standin:
+        worker_a = ConversationCache(RedisCacheBackend(redis_standin.url), ttl_seconds=60)
+        worker_b = ConversationCache(RedisCacheBackend(redis_standin.url), ttl_seconds=60)
+
+        await worker_a.put_conversation(conversation(), messages=[message("m1")])
+        await worker_a.put_message(message("m2"))
+        loader = Loader([])
+        assert [m["id"] for m in await worker_b.get_messages(USER_ID, "c1", loader)] == ["m1", "m2"]
+        assert loader.calls == 0
+
+        await worker_b.invalidate(USER_ID, "c1")
+        assert await worker_a.get(USER_ID, "c1") is None
+        await worker_a.close()
+        await worker_b.close()
+
+
+class BlockingLoader:
+    """Returns what the store held when called, but only once released."""
+
+    def __init__(self, store):
+        self.store = store
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        value = list(self.store)
+        self.started.set()
+        await self.release.wait()
+        return value
+
+
+async def load_racing_a_write(reader, writer):
+    store = [message("m1")]
+    loader = BlockingLoader(store)
+    load = asyncio.ensure_future(reader.get_messages(USER_ID, "c1", loader))
+    await loader.started.wait()
+    # The new message lands in Cosmos and the cache while the old list is in flight
+    store.append(message("m2"))
+    await writer.put_message(message("m2"))
+    loader.release.set()
+    assert [m["id"] for m in await load] == ["m1"]
+    return loader
+
+
+@pytest.mark.asyncio
+async def test_a_load_started_before_a_write_is_not_stored():
+    cache = ConversationCache(InProcessCacheBackend())
+    loader = await load_racing_a_write(cache, cache)
+
+    assert [m["id"] for m in await cache.get_messages(USER_ID, "c1", loader)] == ["m1", "m2"]
+    assert loader.calls == 2
+    assert cache.stats()["stale_loads"] == 1
+
+
+@pytest.mark.asyncio
+async def test_a_load_started_before_a_write_on_another_worker_is_not_stored():
+    async with RedisStandIn() as redis_standin:
+        worker_a = ConversationCache(RedisCacheBackend(redis_standin.url), ttl_seconds=60)
+        worker_b = ConversationCache(RedisCacheBackend(redis_standin.url), ttl_seconds=60)
+        loader = await load_racing_a_write(worker_a, worker_b)
+
+        assert [m["id"] for m in await worker_b.get_messages(USER_ID, "c1", loader)] == ["m1", "m2"]
+        assert [m["id"] for m in await worker_a.get_messages(USER_ID, "c1", loader)] == ["m1", "m2"]
+        assert loader.calls == 2
+        await worker_a.close()
+        await worker_b.close()
+
+
+class PatchingContainer:
+    def __init__(self, docs):
+        self.docs = docs
+        self.patches = []
+
+    async def patch_item(self, item, partition_key, patch_operations, filter_predicate=None):
+        self.patches.append(patch_operations)
+        doc = self.docs.get(item)
+        if doc is None:
+            raise exceptions.CosmosResourceNotFoundError(status_code=404, message="not found")
+        if doc["type"] != "conversation":
+            raise exceptions.CosmosHttpResponseError(status_code=412, message="precondition failed")
+        for operation in patch_operations:
+            doc[operation["path"].strip("/")] = operation["value"]
+        return dict(doc)
+
+
+@pytest.mark.asyncio
+async def test_rename_patches_the_title_and_keeps_newer_fields():
+    cache = ConversationCache(InProcessCacheBackend())
+    client = CosmosConversationClient(
+        cosmosdb_endpoint="http://127.0.0.1:8081/",
+        credential="c3RhbmRpbi1rZXk=",
+        database_name="db",
+        convos_container_name="conversations",
+        deleted_convos_container_name="deleted",
+        shared_convos_container_name="shared",
+        cache=cache
+    )
+    # This worker cached the conversation before another one shared it and added a message
+    await cache.put_conversation(conversation(), messages=[])
+    stored = {**conversation(), "updatedAt": "2024-01-02T00:00:00", "sharedConversationId": "s1"}
+    client.convos_container_client = PatchingContainer({"c1": stored, "m1": message("m1")})
+
+    renamed = await client.rename_conversation(USER_ID, "c1", "Renamed")
+
+    assert client.convos_container_client.patches == [[{"op": "set", "path": "/title", "value": "Renamed"}]]
+    assert (renamed["title"], renamed["updatedAt"], renamed["sharedConversationId"]) == ("Renamed", "2024-01-02T00:00:00", "s1")
+    assert (await cache.get(USER_ID, "c1"))["conversation"] == renamed
+    assert await client.rename_conversation(USER_ID, "missing", "x") is None
+    assert await client.rename_conversation(USER_ID, "m1", "x") is None
+    await client.close()
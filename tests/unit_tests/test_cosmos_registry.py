@@ -0,0 +1,64 @@
+import pytest
+from backend.history.cosmos_registry import CosmosClientRegistry
+from backend.history.cosmosdbservice import CosmosConversationClient, CosmosTokenClient
+
+ENDPOINT = "http://127.0.0.1:8081/"
+KEY = "c3RhbmRpbi1rZXk="
+
+
+def conversation_client(client_registry=None):
+    return CosmosConversationClient(
+        cosmosdb_endpoint=ENDPOINT,
+        credential=KEY,
+        database_name="db",
+        convos_container_name="conversations",
+        deleted_convos_container_name="deleted",
+        shared_convos_container_name="shared",
+        client_registry=client_registry
+    )
+
+
+@pytest.mark.asyncio
+async def test_registry_shares_client_and_proxies():
+    client_registry = CosmosClientRegistry(ENDPOINT, KEY)
+    first = conversation_client(client_registry)
+    second = conversation_client(client_registry)
+    tokens = CosmosTokenClient(ENDPOINT, KEY, "tokens", "usage", "privileges", client_registry=client_registry)
+
+    assert first.cosmosdb_client is second.cosmosdb_client is tokens.cosmosdb_client
+    assert first.convos_container_client is second.convos_container_client
+    assert client_registry.stats()["clients_created"] == 1
+    assert client_registry.stats()["containers_cached"] == 5
+
+    # Closing a borrowing client must leave the shared one usable
+    await first.close()
+    assert client_registry._cosmosdb_client is not None
+
+    await client_registry.close()
+    assert client_registry._cosmosdb_client is None
+    assert client_registry.stats()["containers_cached"] == 0
+
+
+@pytest.mark.asyncio
+async def test_client_without_registry_owns_its_client():
+    client = conversation_client()
+    assert client.owns_cosmosdb_client
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_shared_partition_key_path_is_read_once_per_worker():
+    client_registry = CosmosClientRegistry(ENDPOINT, KEY)
+    reads = []
+
+    async def read():
+        reads.append(True)
+        return {"id": "shared", "partitionKey": {"paths": ["/id"], "kind": "Hash"}}
+
+    client_registry.get_container_client("db", "shared").read = read
+    for _ in range(3):
+        assert await conversation_client(client_registry)._shared_partition_key_path() == "/id"
+
+    assert len(reads) == 1
+    assert client_registry.stats()["partition_key_paths_cached"] == 1
+    await client_registry.close()
@@ -0,0 +1,46 @@
+import asyncio
+import pytest
+from backend.auth.graph_groups import GraphGroupResolver
+from tools.benchmarks.graph_standin import GraphStandIn
+
+COLUMN = "group_ids"
+
+
+@pytest.mark.asyncio
+async def test_pages_are_followed_and_filter_is_cached():
+    async with GraphStandIn(page_size=2) as graph:
+        graph.add_user("token-a", ["g1", "g2", "g3", "g4", "g5"])
+        resolver = GraphGroupResolver(graph_endpoint=graph.endpoint)
+
+        filters = await asyncio.gather(*(resolver.get_filter_string("token-a", COLUMN) for _ in range(5)))
+        assert filters == ["group_ids/any(g:search.in(g, 'g1, g2, g3, g4, g5'))"] * 5
+        assert await resolver.get_filter_string("token-a", COLUMN) == filters[0]
+
+        assert graph.stats()["requests"] == 3
+        stats = resolver.stats()
+        assert stats["misses"] == 1 and stats["coalesced"] == 4 and stats["hits"] == 1
+        await resolver.close()
+
+
+@pytest.mark.asyncio
+async def test_group_cap_stops_paging():
+    async with GraphStandIn(page_size=10) as graph:
+        graph.add_user("token-a", [f"g{i}" for i in range(100)])
+        resolver = GraphGroupResolver(graph_endpoint=graph.endpoint, max_groups=25)
+
+        assert len(await resolver.fetch_group_ids("token-a")) == 25
+        assert graph.stats()["requests"] == 3
+        await resolver.close()
+
+
+@pytest.mark.asyncio
+async def test_slow_or_failing_graph_resolves_to_no_groups_uncached():
+    async with GraphStandIn(delay_ms=500) as graph:
+        graph.add_user("token-a", ["g1"])
+        resolver = GraphGroupResolver(graph_endpoint=graph.endpoint, timeout_seconds=0.05)
+
+        assert await resolver.get_filter_string("token-a", COLUMN) == "group_ids/any(g:search.in(g, ''))"
+        assert await resolver.get_filter_string("unknown-token", COLUMN) == "group_ids/any(g:search.in(g, ''))"
+        assert resolver.stats()["failures"] == 2
+        assert resolver.stats()["cached_filters"] == 0
+        await resolver.close()
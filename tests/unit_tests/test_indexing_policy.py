@@ -0,0 +1,22 @@
+from backend.history.indexing_policy import conversations_indexing_policy, merge_indexing_policy
+
+
+def test_merge_indexing_policy_keeps_existing_settings():
+    current = {
+        "indexingMode": "consistent",
+        "automatic": True,
+        "includedPaths": [{"path": "/*"}],
+        "excludedPaths": [{"path": "/\"_etag\"/?"}, {"path": "/legacy/*"}],
+        "compositeIndexes": [[{"path": "/userId", "order": "ascending"}, {"path": "/createdAt", "order": "descending"}]],
+    }
+    merged = merge_indexing_policy(current)
+
+    excluded = [entry["path"] for entry in merged["excludedPaths"]]
+    assert "/legacy/*" in excluded and "/content/*" in excluded
+    assert excluded.count("/\"_etag\"/?") == 1
+    assert current["compositeIndexes"][0] in merged["compositeIndexes"]
+    for composite_index in conversations_indexing_policy()["compositeIndexes"]:
+        assert composite_index in merged["compositeIndexes"]
+
+    assert merge_indexing_policy(merged) == merged
+    assert merge_indexing_policy({}) == conversations_indexing_policy()
@@ -0,0 +1,227 @@
+import asyncio
+import pytest
+from backend.history.conversation_cache import ConversationCache, InProcessCacheBackend
+from backend.history.cosmosdbservice import CosmosConversationClient
+from backend.history.jobs import HistoryJobRunner, JobFailed, JobLimitExceeded, delete_all_conversations_handler
+
+USER_ID = "user-1"
+
+
+class FakeJobClient:
+    def __init__(self, jobs=()):
+        self.jobs = {job["id"]: dict(job) for job in jobs}
+        self.slots = {}
+
+    async def create_job(self, job):
+        await asyncio.sleep(0)
+        self.jobs[job["id"]] = dict(job)
+        return dict(job)
+
+    async def acquire_job_slot(self, user_id, slot, job_id, lease_expires_at, now):
+        await asyncio.sleep(0)
+        holder, holder_lease = self.slots.get((user_id, slot), ("", ""))
+        if holder in self.jobs and self.jobs[holder]["status"] not in ("succeeded", "failed"):
+            return False
+        if holder and holder not in self.jobs and holder_lease >= now:
+            return False
+        self.slots[(user_id, slot)] = (job_id, lease_expires_at)
+        return True
+
+    async def release_job_slot(self, user_id, slot, job_id):
+        if self.slots.get((user_id, slot), ("",))[0] == job_id:
+            self.slots[(user_id, slot)] = ("", "")
+
+    async def get_job(self, user_id, job_id):
+        job = self.jobs.get(job_id)
+        return dict(job) if job and job["userId"] == user_id else None
+
+    async def update_job(self, user_id, job_id, fields):
+        self.jobs[job_id].update(fields)
+        return dict(self.jobs[job_id])
+
+    async def get_active_jobs(self, user_id):
+        await asyncio.sleep(0)
+        return [dict(job) for job in self.jobs.values() if job["userId"] == user_id and job["status"] not in ("succeeded", "failed")]
+
+    async def get_orphaned_jobs(self, now):
+        return [dict(job) for job in self.jobs.values() if job["status"] not in ("succeeded", "failed") and job["leaseExpiresAt"] < now]
+
+    async def claim_job(self, user_id, job_id, worker_id, lease_expires_at, now):
+        job = self.jobs[job_id]
+        if job["leaseExpiresAt"] >= now:
+            return None
+        job.update({"workerId": worker_id, "leaseExpiresAt": lease_expires_at})
+        return dict(job)
+
+
+async def wait_for(client, job_id, status):
+    for _ in range(200):
+        if client.jobs[job_id]["status"] == status:
+            return client.jobs[job_id]
+        await asyncio.sleep(0.005)
+    raise AssertionError(f"job {job_id} never reached {status}: {client.jobs[job_id]}")
+
+
+@pytest.mark.asyncio
+async def test_job_runs_in_background_and_records_progress():
+    release = asyncio.Event()
+
+    async def delete_all(user_id, on_progress):
+        on_progress(1, 2)
+        await release.wait()
+        on_progress(2, 2)
+        return {"deleted": 2}
+
+    client = FakeJobClient()
+    runner = HistoryJobRunner(client, {"delete_all": delete_all}, progress_interval_seconds=0.01)
+    job = await runner.submit(USER_ID, "delete_all")
+    assert job["status"] == "queued"
+
+    running = await wait_for(client, job["id"], "running")
+    await asyncio.sleep(0.03)
+    assert client.jobs[job["id"]]["progress"] == {"done": 1, "total": 2}
+
+    # Submitting the same job again while it runs returns the existing one
+    assert (await runner.submit(USER_ID, "delete_all"))["id"] == running["id"]
+
+    release.set()
+    finished = await wait_for(client, job["id"], "succeeded")
+    assert finished["result"] == {"deleted": 2}
+    assert finished["progress"] == {"done": 2, "total": 2}
+    await runner.close()
+
+
+@pytest.mark.asyncio
+async def test_per_user_limit_and_failed_jobs():
+    release = asyncio.Event()
+
+    async def export(user_id, on_progress, conversation_id=None):
+        await release.wait()
+        raise JobFailed("1 conversation failed", {"failed": 1})
+
+    client = FakeJobClient()
+    runner = HistoryJobRunner(client, {"export": export}, max_active_per_user=1)
+    job = await runner.submit(USER_ID, "export", {"conversation_id": "c1"})
+    with pytest.raises(JobLimitExceeded):
+        await runner.submit(USER_ID, "export", {"conversation_id": "c2"})
+    with pytest.raises(ValueError):
+        await runner.submit(USER_ID, "unknown")
+
+    release.set()
+    failed = await wait_for(client, job["id"], "failed")
+    assert failed["result"] == {"failed": 1}
+    assert failed["error"] == "1 conversation failed"
+    await runner.close()
+
+
+@pytest.mark.asyncio
+async def test_job_still_runs_when_marking_it_running_fails():
+    class FlakyJobClient(FakeJobClient):
+        async def update_job(self, user_id, job_id, fields):
+            if fields.get("status") == "running":
+                raise ConnectionError("cosmos is unavailable")
+            return await super().update_job(user_id, job_id, fields)
+
+    async def export(user_id, on_progress, conversation_id=None):
+        return {"exported": 1}
+
+    client = FlakyJobClient()
+    runner = HistoryJobRunner(client, {"export": export}, max_active_per_user=1)
+    job = await runner.submit(USER_ID, "export", {"conversation_id": "c1"})
+
+    finished = await wait_for(client, job["id"], "succeeded")
+    assert finished["result"] == {"exported": 1}
+    assert (runner.counters["started"], runner.counters["succeeded"]) == (1, 1)
+    # The slot was released, so the user can start another job straight away
+    await asyncio.sleep(0.01)
+    assert (await runner.submit(USER_ID, "export", {"conversation_id": "c2"}))["slot"] == 0
+    await runner.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_submits_respect_the_per_user_limit():
+    release = asyncio.Event()
+
+    async def export(user_id, on_progress, conversation_id=None):
+        await release.wait()
+        return {}
+
+    client = FakeJobClient()
+    runner = HistoryJobRunner(client, {"export": export}, max_active_per_user=1)
+    outcomes = await asyncio.gather(
+        *(runner.submit(USER_ID, "export", {"conversation_id": f"c{i}"}) for i in range(3)),
+        return_exceptions=True
+    )
+
+    assert sum(1 for outcome in outcomes if isinstance(outcome, JobLimitExceeded)) == 2
+    job = next(outcome for outcome in outcomes if isinstance(outcome, dict))
+    assert list(client.jobs) == [job["id"]]
+
+    # The slot is free again once the job finished
+    release.set()
+    await wait_for(client, job["id"], "succeeded")
+    await asyncio.sleep(0.01)
+    assert (await runner.submit(USER_ID, "export", {"conversation_id": "c9"}))["slot"] == 0
+    await runner.close()
+
+
+@pytest.mark.asyncio
+async def test_orphaned_jobs_are_claimed_and_resumed():
+    calls = []
+
+    async def delete_all(user_id, on_progress):
+        calls.append(user_id)
+        return {}
+
+    client = FakeJobClient([
+        {"id": "orphan", "userId": "user-2", "kind": "delete_all", "params": {}, "status": "running", "leaseExpiresAt": "2000-01-01T00:00:00"},
+        {"id": "leased", "userId": "user-3", "kind": "delete_all", "params": {}, "status": "running", "leaseExpiresAt": "2999-01-01T00:00:00"},
+    ])
+    runner = HistoryJobRunner(client, {"delete_all": delete_all}, worker_id="worker-b")
+    assert await runner.recover() == 1
+
+    resumed = await wait_for(client, "orphan", "succeeded")
+    assert resumed["workerId"] == "worker-b"
+    assert calls == ["user-2"]
+    assert client.jobs["leased"]["status"] == "running"
+    await runner.close()
+
+
+class FakeBulkDeleter:
+    async def load_documents(self, user_id, conversation_id=None):
+        return {"c1": {"conversation": {"id": "c1", "type": "conversation"}, "messages": []}}
+
+    async def soft_delete(self, user_id, documents, include_conversations=True, on_progress=None):
+        return {conversation_id: {"status": "deleted", "messages_deleted": 0, "conversation_deleted": True} for conversation_id in documents}
+
+
+@pytest.mark.asyncio
+async def test_delete_all_job_invalidates_the_cache_set_up_after_the_runner():
+    current = {"cache": None}
+
+    def conversation_client():
+        client = CosmosConversationClient(
+            cosmosdb_endpoint="http://127.0.0.1:8081/",
+            credential="c3RhbmRpbi1rZXk=",
+            database_name="db",
+            convos_container_name="conversations",
+            deleted_convos_container_name="deleted",
+            shared_convos_container_name="shared",
+            cache=current["cache"]
+        )
+        client.bulk_deleter = FakeBulkDeleter()
+        return client
+
+    client = FakeJobClient()
+    runner = HistoryJobRunner(client, {"delete_all": delete_all_conversations_handler(conversation_client)})
+    # The cache only exists once the runner is there, as with the app's serving hooks
+    cache = current["cache"] = ConversationCache(InProcessCacheBackend())
+    await cache.put_conversation({"id": "c1", "type": "conversation", "userId": USER_ID, "title": "Budget"}, messages=[])
+    assert await cache.get(USER_ID, "c1") is not None
+
+    job = await runner.submit(USER_ID, "delete_all")
+    finished = await wait_for(client, job["id"], "succeeded")
+
+    assert finished["result"]["deleted"] == 1
+    assert await cache.get(USER_ID, "c1") is None
+    await runner.close()
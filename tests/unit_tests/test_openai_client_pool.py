@@ -0,0 +1,64 @@
+import asyncio
+import time
+import pytest
+from azure.core.credentials import AccessToken
+from backend.openai_client_pool import AzureOpenAIClientPool, CachedTokenProvider
+
+ENDPOINT = "https://example.openai.azure.com/"
+API_VERSION = "2024-05-01-preview"
+
+
+class FakeCredential:
+    def __init__(self, lifetime_seconds=3600):
+        self.lifetime_seconds = lifetime_seconds
+        self.calls = 0
+
+    async def get_token(self, *scopes):
+        self.calls += 1
+        await asyncio.sleep(0)
+        return AccessToken(f"token-{self.calls}", int(time.time() + self.lifetime_seconds))
+
+    async def close(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_clients_per_key():
+    pool = AzureOpenAIClientPool(credential_factory=FakeCredential)
+    first = pool.get_client(ENDPOINT, "gpt-35-turbo", API_VERSION, api_key="key")
+    again = pool.get_client(ENDPOINT, "gpt-35-turbo", API_VERSION, api_key="key")
+    other_model = pool.get_client(ENDPOINT, "gpt-4o", API_VERSION, api_key="key")
+    keyless = pool.get_client(ENDPOINT, "gpt-35-turbo", API_VERSION)
+
+    assert first is again
+    assert first is not other_model and first is not keyless
+    assert first._client is other_model._client is keyless._client
+
+    stats = pool.stats()
+    assert stats["clients_created"] == 3
+    assert stats["client_reuses"] == 1
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_token_provider_single_flight_and_cached():
+    credential = FakeCredential()
+    provider = CachedTokenProvider(credential)
+
+    tokens = await asyncio.gather(*(provider() for _ in range(5)))
+    assert tokens == ["token-1"] * 5
+    assert await provider() == "token-1"
+    assert credential.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_token_provider_refreshes_ahead_of_expiry():
+    # Lifetime inside the refresh margin: the current token is served while a new one is fetched
+    credential = FakeCredential(lifetime_seconds=60)
+    provider = CachedTokenProvider(credential, refresh_margin_seconds=300)
+
+    assert await provider() == "token-1"
+    assert await provider() == "token-1"
+    await asyncio.sleep(0.01)
+    assert await provider() == "token-2"
+    await provider.close()
@@ -0,0 +1,76 @@
+import asyncio
+import pytest
+from backend.tokens.privilege_cache import PrivilegeCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Loader:
+    def __init__(self, user_type="regular", delay=0.01):
+        self.user_type = user_type
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.user_type
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_load():
+    cache = PrivilegeCache()
+    loader = Loader("super")
+
+    results = await asyncio.gather(*(cache.get_or_load("user", loader) for _ in range(10)))
+    assert results == ["super"] * 10
+    assert await cache.get_or_load("user", loader) == "super"
+
+    assert loader.calls == 1
+    stats = cache.stats()
+    assert stats["misses"] == 1
+    assert stats["coalesced"] == 9
+    assert stats["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_ttl_negative_ttl_and_lru_bound():
+    clock = FakeClock()
+    cache = PrivilegeCache(max_entries=2, ttl_seconds=100, negative_ttl_seconds=10, clock=clock)
+    loader = Loader("regular")
+    missing = Loader(None)
+
+    await cache.get_or_load("a", loader)
+    await cache.get_or_load("b", missing)
+    clock.now = 50
+    await cache.get_or_load("a", loader)
+    await cache.get_or_load("b", missing)
+    assert loader.calls == 1 and missing.calls == 2
+
+    await cache.get_or_load("c", loader)
+    assert cache.stats()["evictions"] == 1
+    clock.now = 200
+    await cache.get_or_load("a", loader)
+    assert loader.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_invalidate_drops_entry_and_in_flight_load():
+    cache = PrivilegeCache()
+    loader = Loader("regular", delay=0.05)
+
+    pending = asyncio.ensure_future(cache.get_or_load("user", loader))
+    await asyncio.sleep(0)
+    cache.invalidate("user")
+    assert await pending == "regular"
+
+    loader.user_type = "super"
+    assert await cache.get_or_load("user", loader) == "super"
+    assert cache.invalidate() == 1
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,76 @@
+import asyncio
+import pytest
+from backend.tokens.quota_context import QuotaContext
+from backend.tokens.usage_ledger import TokenUsageLedger
+
+USER_ID = "00000000-0000-0000-0000-000000000000"
+
+
+class FakeTokenClient:
+    def __init__(self, token_record):
+        self.token_record = token_record
+        self.reads = []
+
+    async def get_token_usage(self, user_id, date):
+        self.reads.append("usage")
+        await asyncio.sleep(0.05)
+        return self.token_record
+
+
+class FakePrivileges:
+    def __init__(self, user_type):
+        self.user_type = user_type
+
+    async def check_user_token_privileges(self, request_headers):
+        await asyncio.sleep(0.05)
+        return self.user_type
+
+
+class FakeTokenLimits:
+    def __init__(self, user_type, token_record, usage_ledger=None):
+        self.cosmos_token_client = FakeTokenClient(token_record)
+        self.token_privileges = FakePrivileges(user_type)
+        self.usage_ledger = usage_ledger
+
+    async def get_user_daily_limit(self, user_type):
+        return {"regular": 1.0, "super": 10.0}[user_type]
+
+    def calculate_record_cost(self, token_record):
+        return token_record["gpt4OutputTokens"] / 1000 if token_record else 0
+
+    def calculate_records_cost(self, token_records):
+        return sum(self.calculate_record_cost(record) for record in token_records)
+
+
+def usage(output_tokens):
+    return {"userId": USER_ID, "gpt35InputTokens": 0, "gpt35OutputTokens": 0, "gpt4InputTokens": 0, "gpt4OutputTokens": output_tokens}
+
+
+@pytest.mark.asyncio
+async def test_load_reads_privilege_and_usage_concurrently():
+    token_limits = FakeTokenLimits("super", usage(500))
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    quota_context = await QuotaContext.load(token_limits, {})
+    assert loop.time() - start < 0.09
+
+    assert quota_context.daily_limit == 10.0
+    assert quota_context.todays_cost() == 0.5
+    assert quota_context.amount_left(prompt_cost=0.5) == 9.0
+    assert not quota_context.limit_exceeded()
+    assert quota_context.usage_percentage_remaining() == 95.0
+    assert token_limits.cosmos_token_client.reads == ["usage"]
+
+
+@pytest.mark.asyncio
+async def test_unflushed_usage_counts_towards_the_limit():
+    ledger = TokenUsageLedger(cosmos_token_client=None)
+    token_limits = FakeTokenLimits("regular", None, usage_ledger=ledger)
+    quota_context = await QuotaContext.load(token_limits, {})
+    assert quota_context.usage_percentage_remaining() == 100.0
+
+    ledger.record(USER_ID, quota_context.today, "gpt-4o", output_tokens=1200)
+    quota_context = await QuotaContext.load(token_limits, {})
+    assert quota_context.limit_exceeded()
+    assert quota_context.usage_percentage_remaining() == 0
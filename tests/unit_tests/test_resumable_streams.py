@@ -0,0 +1,77 @@
+import asyncio
+import json
+import pytest
+from backend.resumable_streams import ResumableStreams, StreamGone
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def parse(frames):
+    events = []
+    for frame in frames:
+        fields = dict(line.split(": ", 1) for line in frame.decode().strip().splitlines() if not line.startswith(":"))
+        events.append((int(fields["id"]) if "id" in fields else None, fields.get("event", "heartbeat"), json.loads(fields["data"]) if "data" in fields else None))
+    return events
+
+
+async def upstream(count, delay=0.0, started=None):
+    for i in range(count):
+        if started and i == 1:
+            started.set()
+        await asyncio.sleep(delay)
+        yield {"choices": [{"messages": [{"role": "assistant", "content": str(i)}]}]}
+
+
+@pytest.mark.asyncio
+async def test_stream_keeps_running_without_readers_and_resumes():
+    streams = ResumableStreams()
+    stream = streams.start("user-1", upstream(5, delay=0.01))
+
+    reader = await stream.sse()
+    first = parse([await reader.__anext__(), await reader.__anext__()])
+    assert first[0] == (None, "stream", {"stream_id": stream.stream_id})
+    assert first[1][:2] == (1, "message")
+    # The client goes away; the generation does not
+    await reader.aclose()
+    await asyncio.sleep(0.1)
+    assert stream.finished
+
+    assert streams.get(stream.stream_id, "user-2") is None
+    resumed = parse([frame async for frame in await streams.get(stream.stream_id, "user-1").sse(last_event_id=1)])
+    assert [(event_id, event) for event_id, event, _ in resumed[1:]] == [(2, "message"), (3, "message"), (4, "message"), (5, "message"), (6, "end")]
+    assert resumed[-1][2] == {"count": 5}
+    with pytest.raises(ValueError):
+        await stream.sse(last_event_id=7)
+
+
+@pytest.mark.asyncio
+async def test_ring_buffer_heartbeats_and_expiry():
+    clock = FakeClock()
+    streams = ResumableStreams(max_events=3, ttl_seconds=60, clock=clock)
+    stream = streams.start("user-1", upstream(5))
+    await asyncio.sleep(0.05)
+    with pytest.raises(StreamGone):
+        await stream.sse(last_event_id=2)
+    assert [event_id for event_id, _, _ in parse([frame async for frame in await stream.sse(last_event_id=3)])] == [None, 4, 5, 6]
+
+    started = asyncio.Event()
+    slow = streams.start("user-1", upstream(3, delay=0.2, started=started))
+    await started.wait()
+    frames = []
+    async for frame in await slow.sse(last_event_id=1, heartbeat_seconds=0.05):
+        frames.append(frame)
+        if len(frames) == 3:
+            break
+    assert [event for _, event, _ in parse(frames)][1:] == ["heartbeat", "heartbeat"]
+
+    clock.now = 61
+    assert streams.get(stream.stream_id, "user-1") is None
+    assert streams.stats()["expired"] == 1
+    await streams.close()
+    assert slow.finished and parse([slow.frames[-1][1]])[0][1] == "error"
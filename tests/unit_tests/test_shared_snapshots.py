@@ -0,0 +1,36 @@
+import json
+from backend.history.shared_snapshots import build_snapshot, paginate_messages
+
+
+def messages(count, size):
+    return [
+        {"id": f"m{i}", "role": "user", "content": "x" * size, "_etag": f"\"{i}\"", "_ts": i}
+        for i in range(count)
+    ]
+
+
+def test_pages_are_bounded():
+    pages = paginate_messages(messages(10, 1000), max_page_bytes=3000)
+    assert [len(page) for page in pages] == [2, 2, 2, 2, 2]
+    assert all(len(json.dumps(page)) <= 3000 for page in pages)
+    # A message larger than a page still gets a page of its own
+    assert [len(page) for page in paginate_messages(messages(2, 5000), max_page_bytes=3000)] == [1, 1]
+
+
+def test_snapshot_pages_are_content_addressed():
+    conversation = {"id": "c1", "title": "Budget", "_etag": "\"1\""}
+    header, pages = build_snapshot("s1", "u1", conversation, messages(10, 1000), "2024-01-01", max_page_bytes=3000)
+    assert header["pages"] == [page["id"] for page in pages]
+    assert header["messageCount"] == 10
+    assert "_etag" not in header["conversation"] and "_etag" not in pages[0]["messages"][0]
+
+    # System properties don't count as changes; a new message only changes the last page
+    touched = [{**m, "_etag": "\"new\""} for m in messages(10, 1000)]
+    same_header, _ = build_snapshot("s1", "u1", {**conversation, "_etag": "\"2\""}, touched, "2024-01-02", max_page_bytes=3000)
+    assert same_header["snapshotHash"] == header["snapshotHash"]
+
+    more = messages(10, 1000) + [{"id": "m10", "role": "assistant", "content": "short"}]
+    new_header, _ = build_snapshot("s1", "u1", conversation, more, "2024-01-02", max_page_bytes=3000)
+    assert new_header["pages"][:-1] == header["pages"][:-1]
+    assert new_header["pages"][-1] != header["pages"][-1]
+    assert new_header["snapshotHash"] != header["snapshotHash"]
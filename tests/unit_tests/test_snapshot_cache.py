@@ -0,0 +1,86 @@
+import asyncio
+import gzip
+import pytest
+from backend.history.shared_snapshots import build_snapshot, snapshot_validators
+from backend.history.snapshot_cache import SharedSnapshotCache, encode_snapshot
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Loader:
+    def __init__(self, body=b"x" * 2000, delay=0.01):
+        self.body = body
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return encode_snapshot(f"etag-{self.calls}", None, self.body) if self.body else None
+
+
+def test_validators_follow_content_and_shared_at():
+    header, _ = build_snapshot("s1", "u1", {"id": "c1"}, [{"id": "m1", "content": "hi"}], "2024-01-01T10:00:00.123456")
+    etag, last_modified = snapshot_validators(header)
+    assert last_modified.isoformat() == "2024-01-01T10:00:00+00:00"
+    assert snapshot_validators(dict(header))[0] == etag
+    assert snapshot_validators({**header, "sharedAt": "2024-01-02T10:00:00"})[0] != etag
+
+    # Single-document snapshots have no snapshotHash; the document itself is hashed
+    legacy = {"id": "s1", "sharedAt": "2024-01-01T10:00:00", "messages": [{"id": "m1"}], "_etag": "\"1\""}
+    assert snapshot_validators(legacy)[0] == snapshot_validators({**legacy, "_etag": "\"2\""})[0]
+    assert snapshot_validators({**legacy, "messages": []})[0] != snapshot_validators(legacy)[0]
+    assert snapshot_validators({"id": "s1"})[1] is None
+
+
+def test_encode_snapshot_compresses_large_bodies_only():
+    snapshot = encode_snapshot("e", None, b"{}" * 1000)
+    assert gzip.decompress(snapshot.gzip_body) == snapshot.body
+    assert encode_snapshot("e", None, b"{}").gzip_body is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_load_and_expire():
+    clock = FakeClock()
+    cache = SharedSnapshotCache(ttl_seconds=60, clock=clock)
+    loader = Loader()
+
+    results = await asyncio.gather(*(cache.get_or_load("s1", loader) for _ in range(5)))
+    assert {snapshot.etag for snapshot in results} == {"etag-1"}
+    assert (await cache.get_or_load("s1", loader)).etag == "etag-1"
+    assert loader.calls == 1
+    assert cache.stats()["coalesced"] == 4 and cache.stats()["hits"] == 1
+
+    clock.now = 61
+    assert (await cache.get_or_load("s1", loader)).etag == "etag-2"
+
+    # Missing snapshots are not cached
+    missing = Loader(body=None)
+    assert await cache.get_or_load("s2", missing) is None
+    assert await cache.get_or_load("s2", missing) is None
+    assert missing.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_invalidate_during_load_and_byte_bound():
+    cache = SharedSnapshotCache()
+    loader = Loader()
+    pending = asyncio.ensure_future(cache.get_or_load("s1", loader))
+    await asyncio.sleep(0)
+    cache.invalidate("s1")
+    assert (await pending).etag == "etag-1"
+    assert (await cache.get_or_load("s1", loader)).etag == "etag-2"
+
+    size = (await cache.get_or_load("s1", loader)).size
+    cache = SharedSnapshotCache(max_bytes=size * 2)
+    for shared_id in ("s1", "s2", "s3"):
+        await cache.get_or_load(shared_id, Loader())
+    assert cache.stats()["entries"] == 2 and cache.stats()["evictions"] == 1
+    assert cache.bytes <= size * 2
+    assert cache.invalidate("s3") and not cache.invalidate("s1")
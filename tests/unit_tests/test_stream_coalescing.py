@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+from backend.stream_coalescing import coalesce_stream_deltas
+
+
+def delta_event(content, role="assistant"):
+    return {"id": "chatcmpl-1", "choices": [{"messages": [{"role": role, "content": content}]}], "history_metadata": {}}
+
+
+def contents(events):
+    return [(event["choices"][0]["messages"][0]["role"], event["choices"][0]["messages"][0]["content"]) for event in events]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_stream_deltas_merges_until_size_or_other_message():
+    async def dummy_generator():
+        yield delta_event('{"citations": []}', role="tool")
+        for content in ("a", "b", "", "cd", "efg"):
+            yield delta_event(content)
+        yield {}
+        yield delta_event("h")
+        yield delta_event("{}", role="tool")
+        yield delta_event("i")
+
+    events = [event async for event in coalesce_stream_deltas(dummy_generator(), window_seconds=10, max_bytes=4)]
+    assert contents(events) == [("tool", '{"citations": []}'), ("assistant", "abcd"), ("assistant", "efgh"), ("tool", "{}"), ("assistant", "i")]
+    assert events[1]["id"] == "chatcmpl-1" and events[1]["history_metadata"] == {}
+
+
+@pytest.mark.asyncio
+async def test_coalesce_stream_deltas_flushes_when_the_upstream_stalls():
+    closed = asyncio.Event()
+
+    async def dummy_generator():
+        try:
+            yield delta_event("a")
+            yield delta_event("b")
+            await asyncio.sleep(0.2)
+            yield delta_event("c")
+            await asyncio.sleep(10)
+        finally:
+            closed.set()
+
+    coalesced = coalesce_stream_deltas(dummy_generator(), window_seconds=0.02, max_bytes=1024)
+    assert contents([await asyncio.wait_for(coalesced.__anext__(), 0.1)]) == [("assistant", "ab")]
+    assert contents([await coalesced.__anext__()]) == [("assistant", "c")]
+    # Closing mid-read cancels the upstream read and closes the upstream
+    await coalesced.aclose()
+    assert closed.is_set()
+
+
+@pytest.mark.asyncio
+async def test_coalesce_stream_deltas_raises_upstream_errors_after_pending_text():
+    async def dummy_generator():
+        yield delta_event("a")
+        raise ValueError("upstream failed")
+
+    coalesced = coalesce_stream_deltas(dummy_generator(), window_seconds=10)
+    assert contents([await coalesced.__anext__()]) == [("assistant", "a")]
+    with pytest.raises(ValueError):
+        await coalesced.__anext__()
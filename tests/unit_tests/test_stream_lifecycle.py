@@ -0,0 +1,157 @@
+import asyncio
+import pytest
+from backend.stream_lifecycle import StreamLifecycle, StreamMetrics
+from backend.utils import format_as_ndjson
+
+
+class FakeUsage:
+    def __init__(self):
+        self.settled = 0
+
+    async def settle(self):
+        await asyncio.sleep(0)
+        self.settled += 1
+
+
+class FakeUpstream:
+    def __init__(self, count, delay=0.0, fail_at=None):
+        self.count = count
+        self.delay = delay
+        self.fail_at = fail_at
+        self.closed = 0
+
+    async def __aiter__(self):
+        for i in range(self.count):
+            if self.closed:
+                return
+            if i == self.fail_at:
+                raise RuntimeError("upstream failed")
+            await asyncio.sleep(self.delay)
+            yield i
+
+    async def close(self):
+        self.closed += 1
+
+
+def stream(upstream, usage, metrics, closed):
+    async def close_client():
+        closed.append(True)
+
+    lifecycle = StreamLifecycle(usage, close_callbacks=[close_client], metrics=metrics)
+    lifecycle.open(upstream)
+
+    async def generate():
+        async with lifecycle:
+            async for chunk in upstream:
+                lifecycle.chunks += 1
+                yield {"chunk": chunk}
+
+    return lifecycle, generate()
+
+
+@pytest.mark.asyncio
+async def test_completed_stream_settles_once_and_closes():
+    usage, metrics, closed, upstream = FakeUsage(), StreamMetrics(), [], FakeUpstream(3)
+    lifecycle, events = stream(upstream, usage, metrics, closed)
+
+    assert [event async for event in events] == [{"chunk": 0}, {"chunk": 1}, {"chunk": 2}]
+    await lifecycle.close()
+
+    assert lifecycle.outcome == "completed"
+    assert (usage.settled, upstream.closed, len(closed)) == (1, 1, 1)
+    stats = metrics.stats()
+    assert (stats["active"], stats["completed"], stats["completed_chunks"]) == (0, 1, 3)
+
+
+@pytest.mark.asyncio
+async def test_client_disconnect_closes_upstream_and_counts_aborted():
+    usage, metrics, closed, upstream = FakeUsage(), StreamMetrics(), [], FakeUpstream(1000, delay=0.01)
+    lifecycle, events = stream(upstream, usage, metrics, closed)
+    body = format_as_ndjson(events)
+
+    async def client():
+        async for _ in body:
+            pass
+
+    task = asyncio.ensure_future(client())
+    await asyncio.sleep(0.05)
+    # What Quart does when the client goes away: cancel the handler, close the body
+    task.cancel()
+    await asyncio.wait((task,))
+    await body.aclose()
+
+    assert lifecycle.outcome == "aborted"
+    assert (usage.settled, upstream.closed, len(closed)) == (1, 1, 1)
+    stats = metrics.stats()
+    assert (stats["active"], stats["aborted"]) == (0, 1)
+    assert 0 < stats["aborted_chunks"] < 1000
+
+
+@pytest.mark.asyncio
+async def test_upstream_error_counts_failed():
+    usage, metrics, closed, upstream = FakeUsage(), StreamMetrics(), [], FakeUpstream(5, fail_at=2)
+    lifecycle, events = stream(upstream, usage, metrics, closed)
+
+    with pytest.raises(RuntimeError):
+        async for _ in events:
+            pass
+
+    assert lifecycle.outcome == "failed"
+    assert (usage.settled, upstream.closed) == (1, 1)
+    assert metrics.stats()["failed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_close_before_streaming_skips_settle():
+    usage, metrics, closed = FakeUsage(), StreamMetrics(), []
+    lifecycle = StreamLifecycle(usage, close_callbacks=[lambda: asyncio.sleep(0, closed.append(True))], metrics=metrics)
+
+    await lifecycle.close("failed", settle=False)
+    await lifecycle.close("aborted")
+
+    assert lifecycle.outcome == "failed"
+    assert usage.settled == 0 and closed == [True]
+    # Never opened, so never counted as started
+    assert metrics.stats() == {"active": 0}
+
+
+@pytest.mark.asyncio
+async def test_consumer_ending_before_the_first_chunk_aborts_the_stream():
+    usage, metrics, closed, upstream = FakeUsage(), StreamMetrics(), [], FakeUpstream(1000, delay=0.01)
+    lifecycle, events = stream(upstream, usage, metrics, closed)
+
+    async def handler():
+        lifecycle.close_with(asyncio.current_task())
+        body = format_as_ndjson(events)
+        # The client goes away while the response is being started
+        await asyncio.sleep(10)
+        async for _ in body:
+            pass
+
+    task = asyncio.ensure_future(handler())
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.wait((task,))
+    await asyncio.sleep(0.01)
+
+    assert lifecycle.outcome == "aborted"
+    assert (usage.settled, upstream.closed, len(closed)) == (1, 1, 1)
+    stats = metrics.stats()
+    assert (stats["active"], stats["aborted"], stats["aborted_chunks"]) == (0, 1, 0)
+
+
+@pytest.mark.asyncio
+async def test_consumer_finishing_the_stream_closes_it_once():
+    usage, metrics, closed, upstream = FakeUsage(), StreamMetrics(), [], FakeUpstream(3)
+    lifecycle, events = stream(upstream, usage, metrics, closed)
+
+    async def handler():
+        lifecycle.close_with(asyncio.current_task())
+        return [event async for event in events]
+
+    assert len(await asyncio.ensure_future(handler())) == 3
+    await asyncio.sleep(0.01)
+
+    assert lifecycle.outcome == "completed"
+    assert (usage.settled, upstream.closed, len(closed)) == (1, 1, 1)
+    assert metrics.stats()["completed"] == 1
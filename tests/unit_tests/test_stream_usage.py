@@ -0,0 +1,57 @@
+import pytest
+from types import SimpleNamespace
+from backend.tokens.stream_usage import StreamUsage
+
+HEADERS = {}
+
+
+class FakeTokenLimits:
+    def __init__(self):
+        self.recorded = []
+        self.flushes = 0
+
+    async def calculate_tokens_async(self, message):
+        return len(message.split())
+
+    async def update_usage_from_openai_response(self, request_headers, usage_data, model_used):
+        self.recorded.append((model_used, usage_data))
+        return usage_data
+
+    async def flush_usage(self, request_headers):
+        self.flushes += 1
+
+
+def chunk(content=None, usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=content))] if content else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+@pytest.mark.asyncio
+async def test_reported_usage_is_settled_once():
+    token_limits = FakeTokenLimits()
+    stream_usage = StreamUsage(token_limits, HEADERS, "gpt-4o")
+    stream_usage.estimated_prompt_tokens = 12
+    for word in ("one ", "two ", "three "):
+        stream_usage.observe_chunk(chunk(word))
+        stream_usage.add_completion_text(word)
+    stream_usage.observe_chunk(chunk(usage=SimpleNamespace(prompt_tokens=20, completion_tokens=4)))
+
+    await stream_usage.settle()
+    await stream_usage.settle()
+
+    assert token_limits.recorded == [("gpt-4o", {"prompt_tokens": 20, "completion_tokens": 4})]
+    assert token_limits.flushes == 1
+
+
+@pytest.mark.asyncio
+async def test_local_count_when_usage_chunk_never_arrives():
+    token_limits = FakeTokenLimits()
+    stream_usage = StreamUsage(token_limits, HEADERS, "gpt-35-turbo")
+    stream_usage.estimated_prompt_tokens = 12
+    for word in ("one ", "two "):
+        stream_usage.observe_chunk(chunk(word))
+        stream_usage.add_completion_text(word)
+
+    await stream_usage.settle()
+
+    assert token_limits.recorded == [("gpt-35-turbo", {"prompt_tokens": 12, "completion_tokens": 2})]
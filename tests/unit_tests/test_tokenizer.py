@@ -0,0 +1,68 @@
+import pytest
+from backend.tokens.tokenizer import TokenizerService, content_hash, get_tokenizer
+
+
+class CountingEncoding:
+    def __init__(self):
+        self.encoded = 0
+        self.batches = 0
+
+    def encode(self, text):
+        self.encoded += 1
+        return text.split()
+
+    def encode_batch(self, texts, num_threads=8):
+        self.batches += 1
+        return [text.split() for text in texts]
+
+
+def tokenizer_with(encoding, **kwargs):
+    tokenizer = TokenizerService(**kwargs)
+    tokenizer._encoding = encoding
+    return tokenizer
+
+
+def test_get_tokenizer_is_a_singleton_per_encoding():
+    assert get_tokenizer("cl100k_base") is get_tokenizer("cl100k_base")
+
+
+def test_counts_are_memoised_and_bounded():
+    encoding = CountingEncoding()
+    tokenizer = tokenizer_with(encoding, cache_size=2)
+
+    assert tokenizer.count("one two") == 2
+    assert tokenizer.count("one two") == 2
+    assert encoding.encoded == 1
+
+    tokenizer.count("three")
+    tokenizer.count("four five six")
+    assert tokenizer.stats()["cached_counts"] == 2
+    tokenizer.count("one two")
+    assert encoding.encoded == 4
+
+
+@pytest.mark.asyncio
+async def test_large_batches_are_encoded_off_the_loop():
+    encoding = CountingEncoding()
+    tokenizer = tokenizer_with(encoding, offload_threshold_chars=50)
+
+    history = ["word " * 20, "short", "word " * 5]
+    assert await tokenizer.count_many(history) == [20, 1, 5]
+    assert encoding.batches == 1 and encoding.encoded == 0
+
+    # Next turn re-sends the history plus one new small message
+    assert await tokenizer.count_many(history + ["new message"]) == [20, 1, 5, 2]
+    assert encoding.batches == 1 and encoding.encoded == 1
+    assert tokenizer.stats()["offloaded_batches"] == 1
+    tokenizer.close()
+
+
+@pytest.mark.asyncio
+async def test_stored_counts_skip_encoding():
+    encoding = CountingEncoding()
+    tokenizer = tokenizer_with(encoding)
+    history = ["stored answer from an earlier turn", "new question"]
+
+    counts = await tokenizer.count_many(history, known_counts={content_hash(history[0]): 42})
+    assert counts == [42, 2]
+    assert encoding.encoded == 1
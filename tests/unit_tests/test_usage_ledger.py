@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+from backend.tokens.usage_ledger import TokenUsageLedger, usage_fields_for_model
+
+USER_ID = "user-1"
+TODAY = "2024-06-01"
+
+
+class FakeTokenClient:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.increments = []
+
+    async def increment_token_usage(self, user_id, date, deltas):
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("cosmos unavailable")
+        self.increments.append((user_id, date, deltas))
+
+
+def test_usage_fields_for_model():
+    assert usage_fields_for_model("gpt-35-turbo-16k") == ("gpt35InputTokens", "gpt35OutputTokens")
+    assert usage_fields_for_model("gpt-4o") == ("gpt4InputTokens", "gpt4OutputTokens")
+    with pytest.raises(ValueError):
+        usage_fields_for_model("davinci")
+
+
+@pytest.mark.asyncio
+async def test_records_are_coalesced_into_one_increment():
+    client = FakeTokenClient()
+    ledger = TokenUsageLedger(client)
+    ledger.record(USER_ID, TODAY, "gpt-35-turbo", input_tokens=10)
+    for _ in range(50):
+        ledger.record(USER_ID, TODAY, "gpt-35-turbo", output_tokens=2)
+
+    stored = {"userId": USER_ID, "date": TODAY, "gpt35InputTokens": 5, "gpt35OutputTokens": 0, "gpt4InputTokens": 0, "gpt4OutputTokens": 0}
+    adjusted = ledger.apply_unflushed(stored, USER_ID, TODAY)
+    assert adjusted["gpt35InputTokens"] == 15
+    assert adjusted["gpt35OutputTokens"] == 100
+
+    await ledger.flush(USER_ID)
+    assert client.increments == [(USER_ID, TODAY, {"gpt35InputTokens": 10, "gpt35OutputTokens": 100})]
+    assert ledger.apply_unflushed(stored, USER_ID, TODAY) == stored
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_usage_for_retry():
+    client = FakeTokenClient(fail=True)
+    ledger = TokenUsageLedger(client)
+    ledger.record(USER_ID, TODAY, "gpt-4o", input_tokens=7, output_tokens=3)
+
+    await ledger.flush()
+    assert ledger.unflushed(USER_ID, TODAY) == {"gpt4InputTokens": 7, "gpt4OutputTokens": 3}
+    assert ledger.stats()["write_failures"] == 1
+
+    client.fail = False
+    await ledger.close()
+    assert client.increments == [(USER_ID, TODAY, {"gpt4InputTokens": 7, "gpt4OutputTokens": 3})]
+    assert not ledger.unflushed(USER_ID, TODAY)
+
+
+@pytest.mark.asyncio
+async def test_unflushed_days_are_included_in_range():
+    ledger = TokenUsageLedger(FakeTokenClient())
+    ledger.record(USER_ID, TODAY, "gpt-4o", output_tokens=4)
+    ledger.record("someone-else", TODAY, "gpt-4o", output_tokens=9)
+
+    records = ledger.apply_unflushed_to_records([], USER_ID, "2024-05-31", TODAY)
+    assert len(records) == 1
+    assert records[0]["gpt4OutputTokens"] == 4
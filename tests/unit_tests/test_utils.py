@@ -1,5 +1,6 @@
 import pytest
-from backend.utils import format_as_ndjson, parse_multi_columns
+import json
+from backend.utils import decode_cursor, encode_cursor, format_as_compact_ndjson, format_as_ndjson, freeze_payload, parse_multi_columns, redact_secrets
 
 
 @pytest.mark.asyncio
@@ -20,6 +21,41 @@ async def test_format_as_ndjson_exception():
     async for event in format_as_ndjson(dummy_generator()):
         assert event == '{"error": "test exception"}'
 
+
+@pytest.mark.asyncio
+async def test_format_as_compact_ndjson():
+    def event(content, role="assistant", conversation_id="c1"):
+        return {
+            "id": "chatcmpl-1", "model": "gpt-4o", "created": 1, "object": "chat.completion.chunk",
+            "choices": [{"messages": [{"role": role, "content": content}]}],
+            "history_metadata": {"conversation_id": conversation_id}, "apim-request-id": "r1",
+        }
+
+    async def dummy_generator():
+        yield event('{"citations": []}', role="tool")
+        yield {}
+        yield event("Hel")
+        yield event("lo")
+        yield event("!", conversation_id="c2")
+
+    frames = [json.loads(line) async for line in format_as_compact_ndjson(dummy_generator())]
+    assert frames[0] == {"t": "header", "id": "chatcmpl-1", "model": "gpt-4o", "created": 1, "object": "chat.completion.chunk",
+                         "history_metadata": {"conversation_id": "c1"}, "apim-request-id": "r1"}
+    assert frames[1:4] == [{"c": '{"citations": []}', "r": "tool"}, {"c": "Hel"}, {"c": "lo"}]
+    # A changed envelope is sent again before the delta that carries it
+    assert frames[4]["t"] == "header" and frames[4]["history_metadata"] == {"conversation_id": "c2"}
+    assert frames[5:] == [{"c": "!"}, {"t": "end", "count": 4}]
+
+
+@pytest.mark.asyncio
+async def test_format_as_compact_ndjson_exception():
+    async def dummy_generator():
+        raise Exception("test exception")
+        yield {}
+
+    frames = [json.loads(line) async for line in format_as_compact_ndjson(dummy_generator())]
+    assert frames == [{"t": "error", "error": "test exception"}]
+
 def test_parse_multi_columns():
     test_pipes = "col1|col2|col3"
     test_commas = "col1,col2,col3"
@@ -27,3 +63,38 @@ def test_parse_multi_columns():
     assert parse_multi_columns(test_pipes) == ["col1", "col2", "col3"]
     assert parse_multi_columns(test_commas) == ["col1", "col2", "col3"]
     assert parse_multi_columns(test_single) == ["col1"]
+
+
+def test_freeze_payload():
+    frozen = freeze_payload({"parameters": {"fields": ["a", "b"], "authentication": {"key": "secret"}}})
+    assert frozen == {"parameters": {"fields": ("a", "b"), "authentication": {"key": "secret"}}}
+    with pytest.raises(TypeError):
+        frozen["parameters"]["filter"] = "x"
+    with pytest.raises(TypeError):
+        frozen.update({"type": "other"})
+
+
+def test_redact_secrets():
+    payload = {
+        "parameters": {
+            "key": "secret",
+            "authentication": {"type": "api_key", "key": "secret"},
+            "embedding_dependency": {"authentication": {"api_key": "secret"}},
+            "fields": ("content",),
+        }
+    }
+    redacted = redact_secrets(payload)
+    assert redacted["parameters"]["key"] == "*****"
+    assert redacted["parameters"]["authentication"] == {"type": "api_key", "key": "*****"}
+    assert redacted["parameters"]["embedding_dependency"]["authentication"]["api_key"] == "*****"
+    assert payload["parameters"]["key"] == "secret"
+
+
+def test_cursor_round_trip():
+    token = '{"token":"+RID:~abc==#RT:2#TRC:50","range":{"min":"","max":"FF"}}'
+    cursor = encode_cursor(token)
+    assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+    assert decode_cursor(cursor) == token
+    for bad in ("garbage", "", encode_cursor(token)[:-4]):
+        with pytest.raises(ValueError):
+            decode_cursor(bad)
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import pytest
+from backend.ws_multiplexer import WebSocketMultiplexer
+
+
+class FakeSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send(self, data):
+        self.frames.append(json.loads(data))
+
+    def of(self, op_id):
+        return [frame["type"] for frame in self.frames if frame["id"] == op_id]
+
+
+async def slow_stream(body):
+    async def events():
+        for i in range(body.get("events", 3)):
+            await asyncio.sleep(body.get("delay", 0))
+            yield {"choices": [{"messages": [{"role": "assistant", "content": str(i)}]}]}
+    return events()
+
+
+async def feedback(body):
+    if not body.get("message_id"):
+        return {"error": "message_id is required"}, 400
+    return {"message_id": body["message_id"]}, 200
+
+
+async def broken(body):
+    raise RuntimeError("upstream failed")
+
+
+def message(op_id, kind, **body):
+    return json.dumps({"id": op_id, "type": kind, "body": body})
+
+
+@pytest.mark.asyncio
+async def test_operations_run_concurrently_with_their_own_ids():
+    socket = FakeSocket()
+    multiplexer = WebSocketMultiplexer(socket.send, {"generate": slow_stream, "feedback": feedback, "broken": broken}, max_in_flight=8)
+
+    await multiplexer.dispatch(message("1", "generate", events=3, delay=0.01))
+    await multiplexer.dispatch(message("2", "generate", events=2, delay=0.01))
+    await multiplexer.dispatch(message("3", "feedback", message_id="m1"))
+    await multiplexer.dispatch(message("4", "feedback"))
+    await multiplexer.dispatch(message("5", "broken"))
+    await multiplexer.dispatch(message("6", "unknown"))
+    await multiplexer.dispatch("not json")
+    await asyncio.sleep(0.1)
+
+    assert socket.of("1") == ["event", "event", "event", "end"]
+    assert socket.of("2") == ["event", "event", "end"]
+    assert [frame for frame in socket.frames if frame["id"] == "3"] == [{"id": "3", "type": "result", "status": 200, "data": {"message_id": "m1"}}]
+    assert [(frame["status"], frame["error"]) for frame in socket.frames if frame["id"] in ("4", "5", "6", None)] == [
+        (400, "Unknown message type unknown"),
+        (400, "Messages must be JSON objects with an id and a type"),
+        (400, "message_id is required"),
+        (500, "upstream failed"),
+    ]
+    # Events of the two streams interleave rather than one waiting for the other
+    order = [frame["id"] for frame in socket.frames if frame["type"] == "event"]
+    assert order.index("2") < len(order) - 1 - order[::-1].index("1")
+
+
+@pytest.mark.asyncio
+async def test_cancel_limits_and_close():
+    socket = FakeSocket()
+    closed = asyncio.Event()
+
+    async def endless(body):
+        async def events():
+            try:
+                while True:
+                    await asyncio.sleep(0.01)
+                    yield {"n": 1}
+            finally:
+                closed.set()
+        return events()
+
+    multiplexer = WebSocketMultiplexer(socket.send, {"generate": endless}, max_in_flight=2)
+    await multiplexer.dispatch(message("1", "generate"))
+    await multiplexer.dispatch(message("1", "generate"))
+    await multiplexer.dispatch(message("2", "generate"))
+    await multiplexer.dispatch(message("3", "generate"))
+    await asyncio.sleep(0.05)
+    assert [frame["status"] for frame in socket.frames if frame["type"] == "error"] == [409, 429]
+
+    await multiplexer.dispatch(json.dumps({"id": "1", "type": "cancel"}))
+    await asyncio.sleep(0.01)
+    assert socket.of("1")[-1] == "cancelled" and closed.is_set()
+    assert multiplexer.stats()["in_flight"] == 1
+
+    await multiplexer.close()
+    assert multiplexer.stats()["in_flight"] == 0
+    assert "cancelled" not in socket.of("2")
@@ -0,0 +1,108 @@
+"""
+Serial per-document soft-delete vs. the bulk soft-delete engine for /history/delete_all.
+
+Seeds one heavy user on the local Cosmos DB stand-in and deletes all of their
+history. The serial mode replays what /history/delete_all used to do: list the
+conversations, then for each one query its messages and copy/delete them one pair of
+awaits at a time before copying and deleting the conversation itself. The bulk mode
+calls CosmosConversationClient.soft_delete_all_conversations, which loads the ids
+in the partition once and moves documents in transactional batches with bounded
+concurrency, reading each batch's documents right before moving it. Reports wall time, Cosmos requests and simulated RU.
+
+    python tools/benchmarks/bench_bulk_delete.py --conversations 200 --messages 20 --rtt-ms 2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from backend.history.cosmos_registry import CosmosClientRegistry
+from backend.history.cosmosdbservice import CosmosConversationClient
+from tools.benchmarks.cosmos_standin import CosmosStandIn
+
+DATABASE = "db_conversation_history"
+CONTAINER = "conversations"
+DELETED_CONTAINER = "deleted_conversations"
+USER_ID = "heavy-user"
+
+
+def seed_history(standin, conversations, messages):
+    now = datetime.utcnow().isoformat()
+    docs = []
+    for _ in range(conversations):
+        conversation_id = str(uuid.uuid4())
+        docs.append({"id": conversation_id, "type": "conversation", "userId": USER_ID, "createdAt": now, "updatedAt": now, "title": "Quarterly supplier review"})
+        for i in range(messages):
+            docs.append({
+                "id": str(uuid.uuid4()),
+                "type": "message",
+                "userId": USER_ID,
+                "conversationId": conversation_id,
+                "createdAt": now,
+                "role": "user" if i % 2 == 0 else "assistant",
+                "content": "Summarise the variance in the sterile packaging forecast. " * 8,
+            })
+    standin.seed(DATABASE, CONTAINER, docs)
+    return len(docs)
+
+
+async def delete_all_serial(client):
+    # The old /history/delete_all loop with the old soft_delete_messages / soft_delete_conversation
+    conversations = await client.get_conversations(USER_ID, offset=0, limit=None)
+    for conversation in conversations:
+        for message in await client.get_messages(USER_ID, conversation["id"]):
+            await client.deleted_convos_container_client.upsert_item(message)
+            await client.convos_container_client.delete_item(item=message["id"], partition_key=USER_ID)
+        doc = await client.convos_container_client.read_item(item=conversation["id"], partition_key=USER_ID)
+        await client.deleted_convos_container_client.upsert_item(doc)
+        await client.convos_container_client.delete_item(item=conversation["id"], partition_key=USER_ID)
+    return len(conversations)
+
+
+async def delete_all_bulk(client):
+    results = await client.soft_delete_all_conversations(USER_ID)
+    assert all(result["status"] == "deleted" for result in results.values())
+    return len(results)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    results = []
+    for mode, delete_all in (("serial", delete_all_serial), ("bulk", delete_all_bulk)):
+        async with CosmosStandIn(rtt_ms=args.rtt_ms) as standin:
+            documents = seed_history(standin, args.conversations, args.messages)
+            registry = CosmosClientRegistry(standin.endpoint, standin.key)
+            client = CosmosConversationClient(standin.endpoint, standin.key, DATABASE, CONTAINER, DELETED_CONTAINER, "shared", client_registry=registry)
+            # Fetch the container properties before counting
+            await client.convos_container_client.read()
+            await client.deleted_convos_container_client.read()
+            standin.reset_counters()
+
+            start = time.perf_counter()
+            deleted = await delete_all(client)
+            elapsed = time.perf_counter() - start
+            stats = standin.stats()
+            assert deleted == args.conversations
+            assert not standin.containers[(DATABASE, CONTAINER)]
+            assert len(standin.containers[(DATABASE, DELETED_CONTAINER)]) == documents
+            results.append((mode, elapsed, stats["requests"], stats["request_charge"]))
+            await registry.close()
+
+    print(f"delete_all for {args.conversations} conversations x {args.messages} messages ({documents} documents), rtt {args.rtt_ms} ms")
+    print(f"{'mode':<7} {'seconds':>8} {'requests':>9} {'RU':>9}")
+    for mode, elapsed, requests, ru in results:
+        print(f"{mode:<7} {elapsed:>8.2f} {requests:>9} {ru:>9.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""
+Conversation reads with and without the read-through conversation cache.
+
+Replays chat sessions against the local Cosmos DB stand-in through
+CosmosConversationClient, making the calls the history endpoints make each turn:
+/history/generate (get_conversation, create_message, get_message_token_counts),
+/history/update (create_message) and the history panel re-reading the conversation
+(/history/read: get_conversation, get_messages). Runs with no cache, the in-process
+cache and a Redis-protocol cache (local stand-in), and reports Cosmos requests, RU
+and latency per turn.
+
+    python tools/benchmarks/bench_conversation_cache.py --sessions 20 --turns 10 --rtt-ms 2
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from backend.history.conversation_cache import ConversationCache, InProcessCacheBackend, RedisCacheBackend
+from backend.history.cosmos_registry import CosmosClientRegistry
+from backend.history.cosmosdbservice import CosmosConversationClient
+from tools.benchmarks.cosmos_standin import CosmosStandIn
+from tools.benchmarks.redis_standin import RedisStandIn
+
+DATABASE = "db_conversation_history"
+CONTAINER = "conversations"
+
+
+async def turn(client, user_id, conversation_id, turn_number):
+    await client.get_conversation(user_id, conversation_id)
+    await client.create_message(str(uuid.uuid4()), conversation_id, user_id, {"role": "user", "content": f"Question {turn_number} about the rollout plan"})
+    await client.get_message_token_counts(user_id, conversation_id)
+    await client.create_message(str(uuid.uuid4()), conversation_id, user_id, {"role": "assistant", "content": "An answer with a few citations. " * 40})
+    await client.get_conversation(user_id, conversation_id)
+    await client.get_messages(user_id, conversation_id)
+
+
+async def run(standin, cache, sessions, turns):
+    registry = CosmosClientRegistry(standin.endpoint, standin.key)
+    client = CosmosConversationClient(standin.endpoint, standin.key, DATABASE, CONTAINER, "deleted", "shared", client_registry=registry, cache=cache)
+    await client.get_conversation("warmup", "warmup")
+
+    latencies = []
+    standin.reset_counters()
+    for session in range(sessions):
+        user_id = f"user-{session}"
+        conversation = await client.create_conversation(user_id, "Rollout plan")
+        for turn_number in range(turns):
+            start = time.perf_counter()
+            await turn(client, user_id, conversation["id"], turn_number)
+            latencies.append(time.perf_counter() - start)
+    stats = standin.stats()
+    await registry.close()
+    if cache:
+        await cache.close()
+    count = sessions * turns
+    return stats["requests"] / count, stats["request_charge"] / count, statistics.median(latencies), cache.stats() if cache else None
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    parser.add_argument("--cache-rtt-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    results = {}
+    async with CosmosStandIn(rtt_ms=args.rtt_ms) as standin, RedisStandIn(rtt_ms=args.cache_rtt_ms) as redis_standin:
+        results["no cache"] = await run(standin, None, args.sessions, args.turns)
+        results["in-process"] = await run(standin, ConversationCache(InProcessCacheBackend()), args.sessions, args.turns)
+        results["redis"] = await run(standin, ConversationCache(RedisCacheBackend(redis_standin.url)), args.sessions, args.turns)
+
+    print(f"{args.sessions} sessions x {args.turns} turns, cosmos rtt {args.rtt_ms} ms, cache rtt {args.cache_rtt_ms} ms")
+    print(f"{'cache':<11} {'cosmos reqs/turn':>17} {'RU/turn':>8} {'p50 ms/turn':>12}  cache stats")
+    for name, (requests, ru, p50, cache_stats) in results.items():
+        print(f"{name:<11} {requests:>17.2f} {ru:>8.2f} {p50 * 1000:>12.2f}  {cache_stats or ''}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
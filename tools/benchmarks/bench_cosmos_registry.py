@@ -0,0 +1,124 @@
+"""
+Per-request Cosmos client construction vs. the worker-lifetime CosmosClientRegistry.
+
+Replays the Cosmos traffic of one /conversation call (conversation lookup, privilege
+and usage reads spread over four client objects, as app.py does) against the local
+stand-in, first building and closing a CosmosClient for every client object and
+then borrowing shared proxies from a registry.
+
+    python tools/benchmarks/bench_cosmos_registry.py --requests 200 --rtt-ms 2 --handshake-ms 30
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from backend.history.cosmos_registry import CosmosClientRegistry
+from backend.history.cosmosdbservice import CosmosConversationClient, CosmosTokenClient
+from tools.benchmarks.cosmos_standin import CosmosStandIn
+
+USER_ID = "00000000-0000-0000-0000-000000000000"
+CONVERSATION_ID = "conversation-1"
+TODAY = "2024-07-28"
+
+
+def conversation_client(standin, client_registry):
+    return CosmosConversationClient(
+        cosmosdb_endpoint=standin.endpoint,
+        credential=standin.key,
+        database_name="db_conversation_history",
+        convos_container_name="conversations",
+        deleted_convos_container_name="deleted",
+        shared_convos_container_name="shared",
+        client_registry=client_registry,
+    )
+
+
+def token_client(standin, client_registry):
+    return CosmosTokenClient(
+        cosmosdb_endpoint=standin.endpoint,
+        credential=standin.key,
+        database_name="db_tokens",
+        token_container_name="token_usage",
+        user_privilege_container_name="user_privileges",
+        client_registry=client_registry,
+    )
+
+
+async def one_request(standin, client_registry):
+    conversations = conversation_client(standin, client_registry)
+    try:
+        await conversations.get_conversation(USER_ID, CONVERSATION_ID)
+    finally:
+        await conversations.close()
+
+    # check_user_token_limits, get_user_token_daily_limit, send_chat_request, stream_chat_request
+    for _ in range(3):
+        tokens = token_client(standin, client_registry)
+        try:
+            await tokens.get_user_privilege_type(USER_ID)
+            await tokens.get_token_usage(USER_ID, TODAY)
+        finally:
+            await tokens.close()
+
+
+async def run(standin, requests, concurrency, pooled):
+    client_registry = CosmosClientRegistry(standin.endpoint, standin.key) if pooled else None
+    standin.reset_counters()
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed():
+        async with semaphore:
+            start = time.perf_counter()
+            await one_request(standin, client_registry)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    wall = time.perf_counter()
+    await asyncio.gather(*(timed() for _ in range(requests)))
+    wall = time.perf_counter() - wall
+    if client_registry:
+        await client_registry.close()
+
+    latencies.sort()
+    stats = standin.stats()
+    return {
+        "mode": "registry" if pooled else "per-request",
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        "req_per_s": requests / wall,
+        "connections": stats["connections"],
+        "http_requests": stats["requests"],
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    parser.add_argument("--handshake-ms", type=float, default=30.0)
+    args = parser.parse_args()
+
+    async with CosmosStandIn(rtt_ms=args.rtt_ms, handshake_ms=args.handshake_ms) as standin:
+        standin.seed("db_conversation_history", "conversations", [{"id": CONVERSATION_ID, "type": "conversation", "userId": USER_ID}])
+        standin.seed("db_tokens", "user_privileges", [{"id": USER_ID, "userId": USER_ID, "userType": "regular"}])
+        standin.seed("db_tokens", "token_usage", [{"id": f"{USER_ID}_{TODAY}", "userId": USER_ID, "date": TODAY}])
+
+        results = [
+            await run(standin, args.requests, args.concurrency, pooled=False),
+            await run(standin, args.requests, args.concurrency, pooled=True),
+        ]
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, rtt {args.rtt_ms} ms, handshake {args.handshake_ms} ms")
+    print(f"{'mode':<12} {'p50 ms':>8} {'p95 ms':>8} {'req/s':>8} {'conns':>6} {'http':>6}")
+    for r in results:
+        print(f"{r['mode']:<12} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['req_per_s']:>8.1f} {r['connections']:>6} {r['http_requests']:>6}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+"""
+OFFSET/LIMIT vs. continuation-token paging for /history/list.
+
+Seeds one user with many conversations on the local Cosmos DB stand-in and walks
+their whole history 25 conversations at a time, the way the history panel's infinite
+scroll does. The offset mode calls get_conversations with a growing offset (what
+/history/list did); the cursor mode calls get_conversations_page with the
+continuation token returned by the previous page. Reports latency and simulated RU
+for a few page depths; with OFFSET the engine reads and discards every skipped
+conversation, so deeper pages cost more.
+
+    python tools/benchmarks/bench_history_list.py --conversations 2000 --rtt-ms 2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from backend.history.cosmos_registry import CosmosClientRegistry
+from backend.history.cosmosdbservice import CosmosConversationClient
+from tools.benchmarks.cosmos_standin import CosmosStandIn
+
+DATABASE = "db_conversation_history"
+CONTAINER = "conversations"
+USER_ID = "heavy-user"
+PAGE_SIZE = 25
+
+
+def seed_conversations(standin, conversations):
+    start = datetime(2024, 1, 1)
+    standin.seed(DATABASE, CONTAINER, [
+        {
+            "id": str(uuid.uuid4()),
+            "type": "conversation",
+            "userId": USER_ID,
+            "createdAt": (start + timedelta(minutes=i)).isoformat(),
+            "updatedAt": (start + timedelta(minutes=i)).isoformat(),
+            "title": f"Supplier audit follow-up {i}",
+        }
+        for i in range(conversations)
+    ])
+
+
+async def walk_offset(client, standin, pages):
+    for page in range(pages):
+        standin.reset_counters()
+        start = time.perf_counter()
+        conversations = await client.get_conversations(USER_ID, offset=page * PAGE_SIZE, limit=PAGE_SIZE)
+        yield page + 1, time.perf_counter() - start, standin.stats()["request_charge"], [c["id"] for c in conversations]
+
+
+async def walk_cursor(client, standin, pages):
+    continuation_token = None
+    for page in range(pages):
+        standin.reset_counters()
+        start = time.perf_counter()
+        conversations, continuation_token = await client.get_conversations_page(USER_ID, limit=PAGE_SIZE, continuation_token=continuation_token)
+        yield page + 1, time.perf_counter() - start, standin.stats()["request_charge"], [c["id"] for c in conversations]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=2000)
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    pages = args.conversations // PAGE_SIZE
+    report_pages = sorted({1, 2, 10, pages // 2, pages})
+    results = {}
+    orders = {}
+    async with CosmosStandIn(rtt_ms=args.rtt_ms) as standin:
+        seed_conversations(standin, args.conversations)
+        registry = CosmosClientRegistry(standin.endpoint, standin.key)
+        client = CosmosConversationClient(standin.endpoint, standin.key, DATABASE, CONTAINER, "deleted", "shared", client_registry=registry)
+        await client.get_conversations(USER_ID, offset=0, limit=1)
+
+        for mode, walk in (("offset", walk_offset), ("cursor", walk_cursor)):
+            total_ru = 0.0
+            orders[mode] = []
+            async for page, elapsed, ru, ids in walk(client, standin, pages):
+                total_ru += ru
+                orders[mode].extend(ids)
+                if page in report_pages:
+                    results[(mode, page)] = (elapsed, ru)
+            results[(mode, "all")] = total_ru
+        await registry.close()
+
+    assert orders["offset"] == orders["cursor"], "both modes should list the same conversations in the same order"
+    print(f"{args.conversations} conversations, {PAGE_SIZE} per page, rtt {args.rtt_ms} ms")
+    print(f"{'page':>5} {'offset ms':>10} {'offset RU':>10} {'cursor ms':>10} {'cursor RU':>10}")
+    for page in report_pages:
+        offset_ms, offset_ru = results[("offset", page)]
+        cursor_ms, cursor_ru = results[("cursor", page)]
+        print(f"{page:>5} {offset_ms * 1000:>10.2f} {offset_ru:>10.2f} {cursor_ms * 1000:>10.2f} {cursor_ru:>10.2f}")
+    print(f"whole history: offset {results[('offset', 'all')]:.1f} RU, cursor {results[('cursor', 'all')]:.1f} RU")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""
+SELECT * vs. projected conversation listing for /history/list.
+
+Seeds one user with conversations on the local Cosmos DB stand-in (with the system
+properties the real service stores on every document) and pages through them with
+get_conversations_page, once returning whole documents and once projecting
+CONVERSATION_LIST_FIELDS as /history/list now does. Reports simulated RU and the
+size of the JSON the endpoint sends back per page.
+
+The stand-in has no index, so it can't show the effect of the composite index or of
+excluding message content from indexing on writes; run
+scripts/migrate_conversations_indexing.py --measure against a real account for those.
+
+    python tools/benchmarks/bench_history_list_projection.py --conversations 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from backend.history.cosmos_registry import CosmosClientRegistry
+from backend.history.cosmosdbservice import CosmosConversationClient
+from backend.history.indexing_policy import CONVERSATION_LIST_FIELDS
+from tools.benchmarks.cosmos_standin import CosmosStandIn
+
+DATABASE = "db_conversation_history"
+CONTAINER = "conversations"
+USER_ID = "heavy-user"
+PAGE_SIZE = 25
+
+
+def seed_conversations(standin, conversations):
+    start = datetime(2024, 1, 1)
+    standin.seed(DATABASE, CONTAINER, [
+        {
+            "id": str(uuid.uuid4()),
+            "type": "conversation",
+            "userId": USER_ID,
+            "createdAt": (start + timedelta(minutes=i)).isoformat(),
+            "updatedAt": (start + timedelta(minutes=i)).isoformat(),
+            "title": f"Supplier audit follow-up {i}",
+            "_rid": "pZ8tAKl3Yb4BAAAAAAAAAA==",
+            "_self": "dbs/pZ8tAA==/colls/pZ8tAKl3Yb4=/docs/pZ8tAKl3Yb4BAAAAAAAAAA==/",
+            "_etag": "\"0b00c7f6-0000-0d00-0000-65f1a2b40000\"",
+            "_attachments": "attachments/",
+            "_ts": 1710334644 + i,
+        }
+        for i in range(conversations)
+    ])
+
+
+async def walk(client, standin, fields):
+    charges, sizes, latencies = [], [], []
+    continuation_token = None
+    while True:
+        standin.reset_counters()
+        start = time.perf_counter()
+        conversations, continuation_token = await client.get_conversations_page(
+            USER_ID, limit=PAGE_SIZE, continuation_token=continuation_token, fields=fields
+        )
+        latencies.append(time.perf_counter() - start)
+        charges.append(standin.stats()["request_charge"])
+        sizes.append(len(json.dumps(conversations)))
+        if not continuation_token:
+            return charges, sizes, latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=500)
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    results = {}
+    async with CosmosStandIn(rtt_ms=args.rtt_ms) as standin:
+        seed_conversations(standin, args.conversations)
+        registry = CosmosClientRegistry(standin.endpoint, standin.key)
+        client = CosmosConversationClient(standin.endpoint, standin.key, DATABASE, CONTAINER, "deleted", "shared", client_registry=registry)
+        await client.get_conversations_page(USER_ID, limit=1)
+
+        for mode, fields in (("SELECT *", None), ("projected", CONVERSATION_LIST_FIELDS)):
+            results[mode] = await walk(client, standin, fields)
+        await registry.close()
+
+    print(f"{args.conversations} conversations, {PAGE_SIZE} per page, rtt {args.rtt_ms} ms")
+    print(f"{'mode':<10} {'RU/page':>8} {'KB/page':>8} {'p50 ms':>8} {'total RU':>9}")
+    for mode, (charges, sizes, latencies) in results.items():
+        print(f"{mode:<10} {statistics.mean(charges):>8.2f} {statistics.mean(sizes) / 1024:>8.2f} "
+              f"{statistics.median(latencies) * 1000:>8.2f} {sum(charges):>9.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,128 @@
+"""
+Three sequential calls vs. one transactional batch for appending a chat message.
+
+Appends messages to seeded conversations on the local Cosmos DB stand-in. The
+sequential mode replays what CosmosConversationClient.create_message used to do:
+upsert the message, query the parent conversation back and upsert the whole
+conversation to bump updatedAt. The batch mode calls the current create_message,
+which upserts the message and patches updatedAt in one transactional batch on the
+userId partition. Reports per-append latency, Cosmos requests and simulated RU.
+
+    python tools/benchmarks/bench_message_append.py --appends 500 --rtt-ms 2
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from backend.history.cosmos_registry import CosmosClientRegistry
+from backend.history.cosmosdbservice import CosmosConversationClient
+from tools.benchmarks.cosmos_standin import CosmosStandIn
+
+DATABASE = "db_conversation_history"
+CONTAINER = "conversations"
+MESSAGE = {"role": "user", "content": "What is the lead time on the 5Fr catheter from the new supplier?"}
+
+
+def seed_conversations(standin, users):
+    now = datetime.utcnow().isoformat()
+    conversations = []
+    for i in range(users):
+        conversation = {
+            "id": str(uuid.uuid4()),
+            "type": "conversation",
+            "createdAt": now,
+            "updatedAt": now,
+            "userId": f"user-{i}",
+            "title": "Supplier lead times " * 4,
+        }
+        conversations.append(conversation)
+    standin.seed(DATABASE, CONTAINER, conversations)
+    return conversations
+
+
+async def append_sequential(client, conversation):
+    # The old create_message, minus the token fields (same cost in both modes)
+    message = {
+        "id": str(uuid.uuid4()),
+        "type": "message",
+        "userId": conversation["userId"],
+        "createdAt": datetime.utcnow().isoformat(),
+        "updatedAt": datetime.utcnow().isoformat(),
+        "conversationId": conversation["id"],
+        **MESSAGE,
+    }
+    resp = await client.convos_container_client.upsert_item(message)
+    parent = await client.get_conversation(conversation["userId"], conversation["id"])
+    parent["updatedAt"] = message["createdAt"]
+    await client.upsert_conversation(parent)
+    return resp
+
+
+async def append_batch(client, conversation):
+    return await client.create_message(str(uuid.uuid4()), conversation["id"], conversation["userId"], MESSAGE)
+
+
+async def run(standin, client, conversations, appends, concurrency, mode):
+    append = append_batch if mode == "batch" else append_sequential
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await append(client, conversations[i % len(conversations)])
+            latencies.append(time.perf_counter() - start)
+
+    # Warm up connections and the tokenizer before counting
+    await append(client, conversations[0])
+    standin.reset_counters()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(appends)))
+    elapsed = time.perf_counter() - start
+    stats = standin.stats()
+    latencies.sort()
+    return {
+        "mode": mode,
+        "total_ms": elapsed * 1000,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "requests": stats["requests"],
+        "ru": stats["request_charge"],
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--appends", type=int, default=500)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    results = []
+    for mode in ("sequential", "batch"):
+        async with CosmosStandIn(rtt_ms=args.rtt_ms) as standin:
+            conversations = seed_conversations(standin, args.users)
+            registry = CosmosClientRegistry(standin.endpoint, standin.key)
+            client = CosmosConversationClient(standin.endpoint, standin.key, DATABASE, CONTAINER, "deleted", "shared", client_registry=registry)
+            results.append(await run(standin, client, conversations, args.appends, args.concurrency, mode))
+            updated = sum(1 for c in conversations if standin.containers[(DATABASE, CONTAINER)][(c["userId"], c["id"])]["updatedAt"] != c["updatedAt"])
+            assert updated == len(conversations), f"{mode}: only {updated} conversations had updatedAt bumped"
+            await registry.close()
+
+    print(f"{args.appends} appends over {args.users} conversations, concurrency {args.concurrency}, rtt {args.rtt_ms} ms")
+    print(f"{'mode':<11} {'total ms':>9} {'p50 ms':>7} {'p95 ms':>7} {'requests':>9} {'RU':>8} {'RU/append':>10}")
+    for r in results:
+        print(f"{r['mode']:<11} {r['total_ms']:>9.1f} {r['p50_ms']:>7.2f} {r['p95_ms']:>7.2f} {r['requests']:>9} {r['ru']:>8.1f} {r['ru'] / args.appends:>10.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
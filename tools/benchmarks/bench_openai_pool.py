@@ -0,0 +1,91 @@
+"""
+Per-call AsyncAzureOpenAI construction vs. the worker-lifetime AzureOpenAIClientPool.
+
+Each simulated request makes the two calls a new /history/generate conversation makes
+(title generation, then the chat completion) against the local stand-in, first with
+a brand new client per call and then with clients borrowed from the pool.
+
+    python tools/benchmarks/bench_openai_pool.py --requests 200 --handshake-ms 30
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import httpx
+from openai import AsyncAzureOpenAI
+
+from backend.openai_client_pool import AzureOpenAIClientPool
+from tools.benchmarks.openai_standin import OpenAIStandIn
+
+API_VERSION = "2024-05-01-preview"
+MESSAGES = [{"role": "user", "content": "How do I reset my password?"}]
+
+
+async def one_request(standin, pool):
+    for max_tokens in (64, 1000):
+        if pool:
+            client = pool.get_client(standin.endpoint, "gpt-35-turbo", API_VERSION, api_key="standin")
+        else:
+            client = AsyncAzureOpenAI(api_version=API_VERSION, api_key="standin", azure_endpoint=standin.endpoint, http_client=httpx.AsyncClient())
+        try:
+            await client.chat.completions.create(model="gpt-35-turbo", messages=MESSAGES, max_tokens=max_tokens)
+        finally:
+            if not pool:
+                await client.close()
+
+
+async def run(standin, requests, concurrency, pooled):
+    pool = AzureOpenAIClientPool() if pooled else None
+    standin.reset_counters()
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed():
+        async with semaphore:
+            start = time.perf_counter()
+            await one_request(standin, pool)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(timed() for _ in range(requests)))
+    pool_stats = pool.stats() if pool else {}
+    if pool:
+        await pool.close()
+
+    latencies.sort()
+    return {
+        "mode": "pool" if pooled else "per-call",
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        "connections": standin.stats()["connections"],
+        "clients_created": pool_stats.get("clients_created", requests * 2),
+        "client_reuses": pool_stats.get("client_reuses", 0),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    parser.add_argument("--handshake-ms", type=float, default=30.0)
+    args = parser.parse_args()
+
+    async with OpenAIStandIn(chunks=20, rtt_ms=args.rtt_ms, handshake_ms=args.handshake_ms) as standin:
+        results = [
+            await run(standin, args.requests, args.concurrency, pooled=False),
+            await run(standin, args.requests, args.concurrency, pooled=True),
+        ]
+
+    print(f"{args.requests} requests x 2 completions, concurrency {args.concurrency}, rtt {args.rtt_ms} ms, handshake {args.handshake_ms} ms")
+    print(f"{'mode':<9} {'p50 ms':>8} {'p95 ms':>8} {'conns':>6} {'created':>8} {'reused':>7}")
+    for r in results:
+        print(f"{r['mode']:<9} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['connections']:>6} {r['clients_created']:>8} {r['client_reuses']:>7}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
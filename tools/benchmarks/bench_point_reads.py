@@ -0,0 +1,133 @@
+"""
+Queries vs. point reads for conversation and shared-conversation lookups.
+
+Seeds users, conversations and shared conversations on the local Cosmos DB stand-in
+(shared container partitioned on /id, a few physical partitions so cross-partition
+queries fan out) and times each lookup the old way, with the SQL query the client
+used to run, and the new way:
+
+  get_conversation         query on id/type/userId      -> read_item(id, userId)
+  get_shared_conversation  cross-partition query on id  -> read_item(id, id)
+  re-share lookup          cross-partition query on     -> sharedConversationId stored
+                           originalConversationId          on the conversation
+
+    python tools/benchmarks/bench_point_reads.py --rtt-ms 2 --physical-partitions 4
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from backend.history.cosmos_registry import CosmosClientRegistry
+from backend.history.cosmosdbservice import CosmosConversationClient
+from tools.benchmarks.cosmos_standin import CosmosStandIn
+
+DATABASE = "db_conversation_history"
+CONTAINER = "conversations"
+SHARED = "shared"
+
+
+def seed(standin, users, conversations_per_user):
+    conversations, shared = [], []
+    for u in range(users):
+        for c in range(conversations_per_user):
+            conversation_id, shared_id = str(uuid.uuid4()), str(uuid.uuid4())
+            conversation = {
+                "id": conversation_id,
+                "type": "conversation",
+                "userId": f"user-{u}",
+                "createdAt": datetime.utcnow().isoformat(),
+                "updatedAt": datetime.utcnow().isoformat(),
+                "title": f"Quarterly forecast review {c}",
+                "sharedConversationId": shared_id,
+            }
+            conversations.append(conversation)
+            shared.append({
+                "id": shared_id,
+                "originalConversationId": conversation_id,
+                "userId": f"user-{u}",
+                "sharedAt": datetime.utcnow().isoformat(),
+                "conversation": conversation,
+                "messages": [{"role": "user", "content": "How did Q3 land against plan?"}],
+            })
+    standin.seed(DATABASE, CONTAINER, conversations)
+    standin.seed(DATABASE, SHARED, shared)
+    return conversations
+
+
+async def legacy_get_conversation(client, conversation):
+    parameters = [{"name": "@conversationId", "value": conversation["id"]}, {"name": "@userId", "value": conversation["userId"]}]
+    query = "SELECT * FROM c where c.id = @conversationId and c.type='conversation' and c.userId = @userId"
+    return [item async for item in client.convos_container_client.query_items(query=query, parameters=parameters)]
+
+
+async def legacy_get_shared_conversation(client, conversation):
+    parameters = [{"name": "@sharedConversationId", "value": conversation["sharedConversationId"]}]
+    query = "SELECT * FROM c WHERE c.id = @sharedConversationId"
+    return [item async for item in client.shared_convos_container_client.query_items(query=query, parameters=parameters)]
+
+
+async def legacy_share_lookup(client, conversation):
+    parameters = [{"name": "@conversationId", "value": conversation["id"]}]
+    query = "SELECT * FROM c WHERE c.originalConversationId = @conversationId"
+    return [item async for item in client.shared_convos_container_client.query_items(query=query, parameters=parameters)]
+
+
+async def share_lookup(client, conversation):
+    return (await client.get_conversation(conversation["userId"], conversation["id"]))["sharedConversationId"]
+
+
+async def measure(standin, lookup, conversations):
+    latencies, charges, requests = [], [], []
+    for conversation in conversations:
+        standin.reset_counters()
+        start = time.perf_counter()
+        assert await lookup(conversation)
+        latencies.append(time.perf_counter() - start)
+        stats = standin.stats()
+        charges.append(stats["request_charge"])
+        requests.append(stats["requests"])
+    return statistics.median(latencies), statistics.mean(charges), statistics.mean(requests)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--conversations", type=int, default=20, help="conversations per user")
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    parser.add_argument("--physical-partitions", type=int, default=4)
+    args = parser.parse_args()
+
+    rows = []
+    async with CosmosStandIn(rtt_ms=args.rtt_ms, partition_key_paths={SHARED: "/id"}, physical_partitions=args.physical_partitions) as standin:
+        conversations = seed(standin, args.users, args.conversations)[:args.lookups]
+        registry = CosmosClientRegistry(standin.endpoint, standin.key)
+        client = CosmosConversationClient(standin.endpoint, standin.key, DATABASE, CONTAINER, "deleted", SHARED, client_registry=registry)
+        # Warm up the container property and partition key range caches
+        await legacy_get_shared_conversation(client, conversations[0])
+        await client.get_shared_conversation(conversations[0]["sharedConversationId"])
+
+        cases = (
+            ("get_conversation", lambda c: legacy_get_conversation(client, c), lambda c: client.get_conversation(c["userId"], c["id"])),
+            ("get_shared_conversation", lambda c: legacy_get_shared_conversation(client, c), lambda c: client.get_shared_conversation(c["sharedConversationId"])),
+            ("re-share lookup", lambda c: legacy_share_lookup(client, c), lambda c: share_lookup(client, c)),
+        )
+        for name, before, after in cases:
+            rows.append((name, await measure(standin, before, conversations), await measure(standin, after, conversations)))
+        await registry.close()
+
+    print(f"{args.users * args.conversations} conversations, {args.physical_partitions} physical partitions, rtt {args.rtt_ms} ms")
+    print(f"{'lookup':<24} {'query ms':>9} {'query RU':>9} {'reqs':>5} {'point ms':>9} {'point RU':>9} {'reqs':>5}")
+    for name, (before_ms, before_ru, before_reqs), (after_ms, after_ru, after_reqs) in rows:
+        print(f"{name:<24} {before_ms * 1000:>9.2f} {before_ru:>9.2f} {before_reqs:>5.1f} {after_ms * 1000:>9.2f} {after_ru:>9.2f} {after_reqs:>5.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+"""
+Per-request datasource payload construction vs. the precompiled payload template.
+
+Times prepare_model_args for an Azure AI Search chat request. The baseline replays what
+it used to do on every request: model_dump the search settings into a fresh payload,
+overlay role_information, deepcopy the whole model_args and redact the secrets in the
+copy (which was then thrown away). The template mode calls the whole current
+prepare_model_args (model selection included), which overlays the per-request fields
+on the payload compiled at startup and only redacts when debug logging is enabled; it
+is timed with logging at INFO and at DEBUG (handler discarding output) to show the
+cost of the debug path.
+
+    python tools/benchmarks/bench_prepare_model_args.py --iterations 20000
+"""
+import argparse
+import asyncio
+import copy
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+# app.py builds its settings on import; point the datasource at a search index that is never called
+for suffix, model in (("V3", "gpt-35-turbo"), ("V4", "gpt-4o")):
+    os.environ.setdefault(f"AZURE_OPENAI_MODEL_{suffix}", model)
+    os.environ.setdefault(f"AZURE_OPENAI_MODEL_NAME_{suffix}", model)
+    os.environ.setdefault(f"AZURE_OPENAI_ENDPOINT_{suffix}", "http://127.0.0.1/")
+os.environ.setdefault("QUART_SECRET_KEY", "bench")
+os.environ.setdefault("MS_DEFENDER_ENABLED", "false")
+os.environ.setdefault("DATASOURCE_TYPE", "AzureCognitiveSearch")
+os.environ.setdefault("AZURE_SEARCH_SERVICE", "bench-search")
+os.environ.setdefault("AZURE_SEARCH_INDEX", "bench-index")
+os.environ.setdefault("AZURE_SEARCH_KEY", "bench-key")
+os.environ.setdefault("AZURE_SEARCH_QUERY_TYPE", "vector_semantic_hybrid")
+os.environ.setdefault("AZURE_SEARCH_SEMANTIC_SEARCH_CONFIG", "default")
+os.environ.setdefault("AZURE_OPENAI_EMBEDDING_NAME", "text-embedding-ada-002")
+os.environ.setdefault("AZURE_SEARCH_CONTENT_COLUMNS", "content|chunk")
+os.environ.setdefault("AZURE_SEARCH_VECTOR_COLUMNS", "contentVector")
+os.environ.pop("AZURE_SEARCH_PERMITTED_GROUPS_COLUMN", None)
+
+import app as appmod
+
+REQUEST_BODY = {"messages": [{"role": "user", "content": "Which catheter sizes are on the approved supplier list?"}]}
+SECRET_PARAMS = ["key", "connection_string", "embedding_key", "encoded_api_key", "api_key"]
+
+
+def baseline_datasource_args(model_args, user_system_message):
+    datasource = appmod.app_settings.datasource
+    model_args["extra_body"] = {"data_sources": [datasource.construct_payload_configuration()]}
+    model_args["extra_body"]["data_sources"][0]["parameters"]["role_information"] = user_system_message
+
+    model_args_clean = copy.deepcopy(model_args)
+    parameters = model_args_clean["extra_body"]["data_sources"][0]["parameters"]
+    for secret_param in SECRET_PARAMS:
+        if parameters.get(secret_param):
+            parameters[secret_param] = "*****"
+    for field in parameters.get("authentication", {}):
+        if field in SECRET_PARAMS:
+            parameters["authentication"][field] = "*****"
+    embedding_authentication = parameters.get("embedding_dependency", {}).get("authentication", {})
+    for field in embedding_authentication:
+        if field in SECRET_PARAMS:
+            embedding_authentication[field] = "*****"
+    return model_args
+
+
+async def time_baseline(iterations):
+    user_system_message = appmod.app_settings.azure_openai.system_message
+    start = time.perf_counter()
+    for _ in range(iterations):
+        model_args = {"messages": list(REQUEST_BODY["messages"]), "stream": True}
+        baseline_datasource_args(model_args, user_system_message)
+    return time.perf_counter() - start
+
+
+async def time_template(iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await appmod.prepare_model_args(REQUEST_BODY, {})
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    root = logging.getLogger()
+    root.handlers = [logging.NullHandler()]
+    root.setLevel(logging.INFO)
+
+    results = []
+    async with appmod.app.test_app():
+        async with appmod.app.test_request_context("/conversation", method="POST"):
+            # Warm up both paths (template compile, tokenizer, settings caches)
+            await time_baseline(100)
+            await time_template(100)
+
+            results.append(("baseline", await time_baseline(args.iterations)))
+            results.append(("template", await time_template(args.iterations)))
+            root.setLevel(logging.DEBUG)
+            results.append(("template+debug", await time_template(args.iterations)))
+            root.setLevel(logging.INFO)
+
+    baseline = results[0][1]
+    print(f"{args.iterations} Azure AI Search requests")
+    print(f"{'mode':<15} {'total ms':>9} {'us/request':>11} {'speedup':>8}")
+    for mode, elapsed in results:
+        print(f"{mode:<15} {elapsed * 1000:>9.1f} {elapsed / args.iterations * 1e6:>11.1f} {baseline / elapsed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+"""
+Single-document vs. paged shared-conversation snapshots.
+
+Seeds conversations of growing length on the local Cosmos DB stand-in and shares
+each one three times through CosmosConversationClient: the first share, a re-share
+with nothing changed and a re-share after one more message. The single-document
+mode upserts the conversation plus every message as one shared document (what
+share_conversation used to do); the paged mode is the current header + content-hashed
+pages layout. Reports latency, simulated RU and the largest document written; the
+single document fails once it passes Cosmos's 2 MB item limit.
+
+    python tools/benchmarks/bench_share_snapshots.py --message-kb 20 --rtt-ms 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from azure.cosmos import exceptions
+
+from backend.history.cosmos_registry import CosmosClientRegistry
+from backend.history.cosmosdbservice import CosmosConversationClient
+from tools.benchmarks.cosmos_standin import CosmosStandIn
+
+DATABASE = "db_conversation_history"
+CONTAINER = "conversations"
+SHARED = "shared"
+USER_ID = "sharing-user"
+
+
+def seed_conversation(standin, messages, message_kb):
+    conversation_id = str(uuid.uuid4())
+    start = datetime(2024, 1, 1)
+    standin.seed(DATABASE, CONTAINER, [{
+        "id": conversation_id,
+        "type": "conversation",
+        "userId": USER_ID,
+        "createdAt": start.isoformat(),
+        "updatedAt": start.isoformat(),
+        "title": "Design review notes",
+    }] + [{
+        "id": str(uuid.uuid4()),
+        "type": "message",
+        "userId": USER_ID,
+        "conversationId": conversation_id,
+        "role": "assistant" if i % 2 else "user",
+        "content": f"{i} " + "x" * (message_kb * 1024),
+        "createdAt": (start + timedelta(seconds=i)).isoformat(),
+    } for i in range(messages)])
+    return conversation_id
+
+
+async def add_message(client, conversation_id):
+    await client.create_message(str(uuid.uuid4()), conversation_id, USER_ID, {"role": "user", "content": "One more question"})
+
+
+async def share_single_document(client, conversation_id):
+    conversation = await client.get_conversation(USER_ID, conversation_id)
+    messages = await client.get_messages(USER_ID, conversation_id)
+    shared_id = conversation.get("sharedConversationId") or str(uuid.uuid4())
+    await client.shared_convos_container_client.upsert_item({
+        "id": shared_id,
+        "originalConversationId": conversation_id,
+        "sharedAt": datetime.utcnow().isoformat(),
+        "userId": USER_ID,
+        "conversation": conversation,
+        "messages": messages,
+    })
+    if not conversation.get("sharedConversationId"):
+        conversation["sharedConversationId"] = shared_id
+        await client.upsert_conversation(conversation)
+
+
+async def timed(standin, action):
+    standin.reset_counters()
+    start = time.perf_counter()
+    try:
+        await action()
+    except exceptions.CosmosHttpResponseError as e:
+        return f"failed ({e.status_code})"
+    return f"{(time.perf_counter() - start) * 1000:7.1f} ms {standin.stats()['request_charge']:7.1f} RU"
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lengths", default="10,50,200", help="messages per conversation")
+    parser.add_argument("--message-kb", type=int, default=20)
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    rows = []
+    async with CosmosStandIn(rtt_ms=args.rtt_ms, partition_key_paths={SHARED: "/id"}) as standin:
+        registry = CosmosClientRegistry(standin.endpoint, standin.key)
+        client = CosmosConversationClient(standin.endpoint, standin.key, DATABASE, CONTAINER, "deleted", SHARED, client_registry=registry)
+        await client.get_shared_header("warmup")
+
+        for length in (int(n) for n in args.lengths.split(",")):
+            for mode, share in (("single doc", share_single_document), ("paged", client.share_conversation)):
+                conversation_id = seed_conversation(standin, length, args.message_kb)
+                before = set(standin.containers[(DATABASE, SHARED)])
+                first = await timed(standin, lambda: share(client, conversation_id) if mode == "single doc" else share(USER_ID, conversation_id))
+                unchanged = await timed(standin, lambda: share(client, conversation_id) if mode == "single doc" else share(USER_ID, conversation_id))
+                await add_message(client, conversation_id)
+                appended = await timed(standin, lambda: share(client, conversation_id) if mode == "single doc" else share(USER_ID, conversation_id))
+                written = [doc for key, doc in standin.containers[(DATABASE, SHARED)].items() if key not in before]
+                largest = max((len(json.dumps(doc)) for doc in written), default=0) / 1024
+                rows.append((length, mode, first, unchanged, appended, largest))
+        await registry.close()
+
+    print(f"{args.message_kb} KB messages, rtt {args.rtt_ms} ms")
+    print(f"{'msgs':>5} {'mode':<11} {'first share':>22} {'re-share unchanged':>22} {'re-share +1 message':>22} {'largest KB':>11}")
+    for length, mode, first, unchanged, appended, largest in rows:
+        print(f"{length:>5} {mode:<11} {first:>22} {unchanged:>22} {appended:>22} {largest:>11.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
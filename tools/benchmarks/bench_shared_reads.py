@@ -0,0 +1,113 @@
+"""
+Shared-conversation reads with and without the serialized snapshot cache.
+
+Shares conversations of a few lengths on the local Cosmos DB stand-in, then serves
+each shared link repeatedly the way /api/get_shared_conversation does: uncached
+(read the header and pages from Cosmos and serialize the JSON on every request)
+and through SharedSnapshotCache (one load, then the cached bytes). Reports latency,
+simulated RU per request and the bytes sent uncompressed and gzipped (a
+revalidation that ends in a 304 sends no body at all).
+
+    python tools/benchmarks/bench_shared_reads.py --requests 200 --rtt-ms 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from backend.history.cosmos_registry import CosmosClientRegistry
+from backend.history.cosmosdbservice import CosmosConversationClient
+from backend.history.shared_snapshots import snapshot_summary, snapshot_validators
+from backend.history.snapshot_cache import SharedSnapshotCache, encode_snapshot
+from tools.benchmarks.cosmos_standin import CosmosStandIn
+
+DATABASE = "db_conversation_history"
+CONTAINER = "conversations"
+SHARED = "shared"
+USER_ID = "sharing-user"
+WORDS = ("rollout", "sign-off", "latency", "region", "budget", "migration", "schema", "owner", "review", "risk",
+         "the", "a", "of", "to", "and", "needs", "before", "after", "team", "release", "index", "partition")
+
+
+def seed_conversation(standin, messages, message_kb):
+    conversation_id = str(uuid.uuid4())
+    start = datetime(2024, 1, 1)
+    standin.seed(DATABASE, CONTAINER, [{
+        "id": conversation_id,
+        "type": "conversation",
+        "userId": USER_ID,
+        "createdAt": start.isoformat(),
+        "updatedAt": start.isoformat(),
+        "title": "Design review notes",
+    }] + [{
+        "id": str(uuid.uuid4()),
+        "type": "message",
+        "userId": USER_ID,
+        "conversationId": conversation_id,
+        "role": "assistant" if i % 2 else "user",
+        # Word salad rather than one repeated string, so gzip doesn't look better than it is
+        "content": " ".join(random.Random(i).choices(WORDS, k=message_kb * 150)) + f" {uuid.uuid4()}",
+        "createdAt": (start + timedelta(seconds=i)).isoformat(),
+    } for i in range(messages)])
+    return conversation_id
+
+
+async def load_snapshot(client, shared_id):
+    header = await client.get_shared_header(shared_id)
+    messages = [message async for message in client.iter_shared_messages(header)]
+    etag, last_modified = snapshot_validators(header)
+    return encode_snapshot(etag, last_modified, json.dumps({**snapshot_summary(header), "messages": messages}).encode())
+
+
+async def serve(standin, client, shared_id, cache, requests):
+    latencies = []
+    standin.reset_counters()
+    for _ in range(requests):
+        start = time.perf_counter()
+        if cache:
+            snapshot = await cache.get_or_load(shared_id, lambda: load_snapshot(client, shared_id))
+        else:
+            snapshot = await load_snapshot(client, shared_id)
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies), standin.stats()["request_charge"] / requests, snapshot
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lengths", default="10,50,200", help="messages per conversation")
+    parser.add_argument("--message-kb", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=200, help="reads of each shared link")
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    rows = []
+    async with CosmosStandIn(rtt_ms=args.rtt_ms, partition_key_paths={SHARED: "/id"}) as standin:
+        registry = CosmosClientRegistry(standin.endpoint, standin.key)
+        client = CosmosConversationClient(standin.endpoint, standin.key, DATABASE, CONTAINER, "deleted", SHARED, client_registry=registry)
+        await client.get_shared_header("warmup")
+
+        for length in (int(n) for n in args.lengths.split(",")):
+            conversation_id = seed_conversation(standin, length, args.message_kb)
+            shared_id = await client.share_conversation(USER_ID, conversation_id)
+            for mode, cache in (("uncached", None), ("cached", SharedSnapshotCache())):
+                p50, ru, snapshot = await serve(standin, client, shared_id, cache, args.requests)
+                rows.append((length, mode, p50, ru, snapshot))
+        await registry.close()
+
+    print(f"{args.requests} reads per link, {args.message_kb} KB messages, rtt {args.rtt_ms} ms")
+    print(f"{'msgs':>5} {'mode':<9} {'p50 ms':>8} {'RU/read':>8} {'identity KB':>12} {'gzip KB':>8}")
+    for length, mode, p50, ru, snapshot in rows:
+        gzip_kb = len(snapshot.gzip_body or snapshot.body) / 1024
+        print(f"{length:>5} {mode:<9} {p50 * 1000:>8.2f} {ru:>8.2f} {len(snapshot.body) / 1024:>12.1f} {gzip_kb:>8.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
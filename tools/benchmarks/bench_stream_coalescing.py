@@ -0,0 +1,100 @@
+"""
+Streaming throughput with and without delta coalescing.
+
+Runs many concurrent chat streams over HTTP on one event loop: an aiohttp server
+streams a fake upstream (small assistant deltas a few milliseconds apart, the way
+Azure OpenAI sends them) through format_stream_response-shaped events, optionally
+coalesce_stream_deltas, and format_as_ndjson, writing each line as its own chunk the
+way Quart does; aiohttp clients read the streams. Reports wall time, HTTP chunks
+written per stream, process CPU per delta and the delivered deltas per second.
+
+    python tools/benchmarks/bench_stream_coalescing.py --streams 200 --deltas 300 --interval-ms 3
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import aiohttp
+from aiohttp import web
+
+from backend.stream_coalescing import coalesce_stream_deltas
+from backend.utils import format_as_ndjson
+from tools.benchmarks.openai_standin import WORDS
+
+HISTORY_METADATA = {"conversation_id": "6f0c2b8e-3c1f-4d8a-9a57-2f3f1f9b7d21", "title": "Rollout plan", "date": "2024-05-01T10:00:00"}
+
+
+async def fake_upstream(deltas, interval):
+    rng = random.Random()
+    yield {"id": "chatcmpl-bench", "model": "gpt-4o", "created": 1714557600, "object": "chat.completion.chunk",
+           "choices": [{"messages": [{"role": "tool", "content": '{"citations": []}'}]}], "history_metadata": HISTORY_METADATA, "apim-request-id": "bench"}
+    for _ in range(deltas):
+        # Deltas often arrive in bursts; a pause only every few of them
+        if rng.random() < 0.5:
+            await asyncio.sleep(rng.uniform(0, 2 * interval))
+        yield {"id": "chatcmpl-bench", "model": "gpt-4o", "created": 1714557600, "object": "chat.completion.chunk",
+               "choices": [{"messages": [{"role": "assistant", "content": rng.choice(WORDS)[:rng.randint(1, 3)]}]}],
+               "history_metadata": HISTORY_METADATA, "apim-request-id": "bench"}
+
+
+async def run(args, window_ms):
+    chunks_written = 0
+
+    async def stream(request):
+        nonlocal chunks_written
+        response = web.StreamResponse(headers={"Content-Type": "application/json-lines"})
+        await response.prepare(request)
+        events = fake_upstream(args.deltas, args.interval_ms / 1000)
+        if window_ms > 0:
+            events = coalesce_stream_deltas(events, window_seconds=window_ms / 1000, max_bytes=args.max_bytes)
+        async for line in format_as_ndjson(events):
+            await response.write(line.encode())
+            chunks_written += 1
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/stream", stream)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    async def client(session):
+        async with session.get(f"http://127.0.0.1:{port}/stream") as response:
+            async for _ in response.content.iter_any():
+                pass
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        await asyncio.gather(*(client(session) for _ in range(args.streams)))
+    cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+    await runner.cleanup()
+    return wall, chunks_written / args.streams, cpu
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--deltas", type=int, default=300)
+    parser.add_argument("--interval-ms", type=float, default=3.0, help="mean pause between delta bursts")
+    parser.add_argument("--windows-ms", default="0,15,30,60", help="coalescing windows to compare; 0 is off")
+    parser.add_argument("--max-bytes", type=int, default=1024)
+    args = parser.parse_args()
+
+    total = args.streams * args.deltas
+    print(f"{args.streams} concurrent streams x {args.deltas} deltas, ~{args.interval_ms} ms between bursts")
+    print(f"{'window ms':>9} {'wall s':>7} {'chunks/stream':>14} {'CPU us/delta':>13} {'deltas/s':>10}")
+    for window_ms in (float(w) for w in args.windows_ms.split(",")):
+        wall, chunks, cpu = await run(args, window_ms)
+        print(f"{window_ms:>9.0f} {wall:>7.2f} {chunks:>14.1f} {cpu / total * 1e6:>13.2f} {total / wall:>10.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+"""
+Bytes on the wire and CPU per token for the default and compact stream formats.
+
+Builds a chat completion stream of small deltas (openai ChatCompletionChunk objects,
+one to three words each, like Azure OpenAI sends), runs it through
+format_stream_response and then either format_as_ndjson (the default format) or
+format_as_compact_ndjson, with orjson and with the stdlib json fallback. Reports
+bytes per delta and process CPU time per delta.
+
+    python tools/benchmarks/bench_stream_format.py --deltas 2000 --streams 50
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from openai.types.chat import ChatCompletionChunk
+
+from backend import utils
+from backend.utils import format_as_compact_ndjson, format_as_ndjson, format_stream_response
+from tools.benchmarks.openai_standin import WORDS
+
+HISTORY_METADATA = {
+    "conversation_id": "6f0c2b8e-3c1f-4d8a-9a57-2f3f1f9b7d21",
+    "title": "Rollout plan for the new region",
+    "date": "2024-05-01T10:00:00.000000",
+}
+
+
+def make_chunks(deltas, seed=0):
+    rng = random.Random(seed)
+    return [ChatCompletionChunk.model_validate({
+        "id": "chatcmpl-9Qm3XyZbench0000000000000000",
+        "model": "gpt-4o-2024-05-13",
+        "created": 1714557600,
+        "object": "chat.completion.chunk",
+        "choices": [{"index": 0, "delta": {"role": "assistant", "content": " ".join(rng.choices(WORDS, k=rng.randint(1, 3))) + " "}, "finish_reason": None}],
+    }) for _ in range(deltas)]
+
+
+async def events(chunks):
+    for chunk in chunks:
+        yield format_stream_response(chunk, HISTORY_METADATA, "4a1a7d8e-1b2c-4d3e-8f90-123456789abc")
+
+
+async def run(formatter, chunks, streams):
+    sent = 0
+    start = time.process_time()
+    for _ in range(streams):
+        async for line in formatter(events(chunks)):
+            sent += len(line.encode() if isinstance(line, str) else line)
+    return sent, time.process_time() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--deltas", type=int, default=2000, help="deltas per stream")
+    parser.add_argument("--streams", type=int, default=50)
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.deltas)
+    fast_backend = utils.orjson
+    results = {}
+    results["default"] = await run(format_as_ndjson, chunks, args.streams)
+    utils.orjson = None
+    results["compact, json"] = await run(format_as_compact_ndjson, chunks, args.streams)
+    utils.orjson = fast_backend
+    if fast_backend:
+        results["compact, orjson"] = await run(format_as_compact_ndjson, chunks, args.streams)
+
+    total = args.deltas * args.streams
+    print(f"{args.streams} streams x {args.deltas} deltas")
+    print(f"{'format':<16} {'bytes/delta':>12} {'CPU us/delta':>13}")
+    for name, (sent, cpu) in results.items():
+        print(f"{name:<16} {sent / total:>12.1f} {cpu / total * 1e6:>13.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,133 @@
+"""
+Per-delta token accounting vs. settling streamed usage once at the end of the stream.
+
+Consumes streamed completions from the local Azure OpenAI stand-in the way
+stream_chat_request's generate() does and measures the gap between consecutive
+chunks reaching the consumer (the time-between-tokens a user sees). The per-delta
+mode re-tokenises every delta and reads and upserts the usage record in Cosmos before
+passing the chunk on; the settle mode only buffers the delta and records the usage
+chunk requested through stream_options.include_usage once the stream is done.
+
+    python tools/benchmarks/bench_stream_usage.py --streams 20 --chunks 300 --rtt-ms 2
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+# backend.settings validates the model settings on import; the values are never used here
+for suffix, model in (("V3", "gpt-35-turbo"), ("V4", "gpt-4o")):
+    os.environ.setdefault(f"AZURE_OPENAI_MODEL_{suffix}", model)
+    os.environ.setdefault(f"AZURE_OPENAI_MODEL_NAME_{suffix}", model)
+    os.environ.setdefault(f"AZURE_OPENAI_ENDPOINT_{suffix}", "http://127.0.0.1/")
+
+from backend.history.cosmos_registry import CosmosClientRegistry
+from backend.history.cosmosdbservice import CosmosTokenClient
+from backend.openai_client_pool import AzureOpenAIClientPool
+from backend.tokens.stream_usage import StreamUsage
+from backend.tokens.token_limits import TokenLimits
+from backend.tokens.usage_ledger import TokenUsageLedger
+from tools.benchmarks.cosmos_standin import CosmosStandIn
+from tools.benchmarks.openai_standin import OpenAIStandIn
+
+API_VERSION = "2024-05-01-preview"
+MODEL = "gpt-35-turbo"
+MESSAGES = [{"role": "user", "content": "Explain how the token quota works."}]
+REQUEST_HEADERS = {}
+
+
+async def one_stream(client, token_limits, settle_once):
+    model_args = {"model": MODEL, "messages": MESSAGES, "stream": True}
+    if settle_once:
+        model_args["stream_options"] = {"include_usage": True}
+    stream_usage = StreamUsage(token_limits, REQUEST_HEADERS, MODEL)
+
+    gaps = []
+    response = await client.chat.completions.create(**model_args)
+    last = None
+    try:
+        async for chunk in response:
+            content = chunk.choices[0].delta.content if chunk.choices else None
+            if settle_once:
+                stream_usage.observe_chunk(chunk)
+                if content:
+                    stream_usage.add_completion_text(content)
+            elif content:
+                await token_limits.update_usage_from_message(REQUEST_HEADERS, content, MODEL, "output")
+            now = time.perf_counter()
+            if last is not None:
+                gaps.append((now - last) * 1000)
+            last = now
+    finally:
+        if settle_once:
+            await stream_usage.settle()
+    return gaps
+
+
+async def run(openai_standin, cosmos_standin, streams, concurrency, settle_once):
+    client_registry = CosmosClientRegistry(cosmos_standin.endpoint, cosmos_standin.key)
+    token_client = CosmosTokenClient(
+        cosmosdb_endpoint=cosmos_standin.endpoint,
+        credential=cosmos_standin.key,
+        database_name="db_tokens",
+        token_container_name="token_usage",
+        user_privilege_container_name="user_privileges",
+        client_registry=client_registry,
+    )
+    ledger = TokenUsageLedger(token_client) if settle_once else None
+    token_limits = TokenLimits(token_client, usage_ledger=ledger)
+    pool = AzureOpenAIClientPool()
+    client = pool.get_client(openai_standin.endpoint, MODEL, API_VERSION, api_key="standin")
+
+    cosmos_standin.reset_counters()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with semaphore:
+            return await one_stream(client, token_limits, settle_once)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(limited() for _ in range(streams)))
+    elapsed = time.perf_counter() - start
+    await pool.close()
+    await client_registry.close()
+
+    gaps = sorted(gap for result in results for gap in result)
+    return {
+        "mode": "settle-once" if settle_once else "per-delta",
+        "gap_p50_ms": statistics.median(gaps),
+        "gap_p95_ms": gaps[int(len(gaps) * 0.95) - 1],
+        "gap_max_ms": gaps[-1],
+        "stream_s": elapsed / streams * concurrency,
+        "cosmos_requests": cosmos_standin.stats()["requests"],
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--chunks", type=int, default=300)
+    parser.add_argument("--chunk-delay-ms", type=float, default=1.0)
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    async with OpenAIStandIn(chunks=args.chunks, chunk_delay_ms=args.chunk_delay_ms) as openai_standin, \
+            CosmosStandIn(rtt_ms=args.rtt_ms) as cosmos_standin:
+        results = [
+            await run(openai_standin, cosmos_standin, args.streams, args.concurrency, settle_once=False),
+            await run(openai_standin, cosmos_standin, args.streams, args.concurrency, settle_once=True),
+        ]
+
+    print(f"{args.streams} streams x {args.chunks} chunks, concurrency {args.concurrency}, chunk delay {args.chunk_delay_ms} ms, cosmos rtt {args.rtt_ms} ms")
+    print(f"{'mode':<12} {'gap p50':>8} {'gap p95':>8} {'gap max':>8} {'stream s':>9} {'cosmos reqs':>12}")
+    for r in results:
+        print(f"{r['mode']:<12} {r['gap_p50_ms']:>8.2f} {r['gap_p95_ms']:>8.2f} {r['gap_max_ms']:>8.2f} {r['stream_s']:>9.2f} {r['cosmos_requests']:>12}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
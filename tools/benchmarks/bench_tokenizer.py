@@ -0,0 +1,124 @@
+"""
+Per-call tiktoken encoding vs. the shared TokenizerService.
+
+Replays the prompt counting of long synthetic conversations turn by turn: every turn
+re-sends the whole history, which send_chat_request counts for the prompt-cost check
+and then once more when recording input usage. The baseline encodes each message on
+the event loop every time, the way TokenLimits.calculate_tokens used to; the service
+mode counts the history through count_many, so only new messages are encoded and big
+batches go to the thread pool. A 1 ms ticker runs alongside and reports the longest
+time the event loop was held.
+
+    python tools/benchmarks/bench_tokenizer.py --conversations 8 --turns 40
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import tiktoken
+
+from backend.tokens.tokenizer import TokenizerService
+
+VOCABULARY = (
+    "the cook medical device catheter sterile packaging regulatory submission quarterly "
+    "report supplier audit shipment inventory forecast variance summary please explain "
+    "why how when which table column value 2024 10mm 5Fr guidance standard procedure"
+).split()
+
+
+def synthetic_message(rng, words):
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words))
+
+
+def synthetic_conversation(rng, turns):
+    messages = [{"role": "system", "content": synthetic_message(rng, 150)}]
+    for _ in range(turns):
+        messages.append({"role": "user", "content": synthetic_message(rng, rng.randint(20, 120))})
+        messages.append({"role": "assistant", "content": synthetic_message(rng, rng.randint(150, 600))})
+    return messages
+
+
+async def replay_baseline(conversation):
+    encoded = 0
+    for turn in range(2, len(conversation) + 1, 2):
+        history = conversation[:turn]
+        encoding = tiktoken.get_encoding("cl100k_base")
+        for _ in range(2):
+            for message in history:
+                len(encoding.encode(message["content"]))
+                encoded += 1
+        await asyncio.sleep(0)
+    return encoded
+
+
+async def replay_service(conversation, tokenizer):
+    for turn in range(2, len(conversation) + 1, 2):
+        contents = [message["content"] for message in conversation[:turn]]
+        await tokenizer.count_many(contents)
+        for content in contents:
+            tokenizer.count(content)
+        await asyncio.sleep(0)
+
+
+async def run(conversations, mode):
+    tokenizer = TokenizerService() if mode == "service" else None
+    longest_stall = 0.0
+    done = asyncio.Event()
+
+    async def ticker():
+        nonlocal longest_stall
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            longest_stall = max(longest_stall, time.perf_counter() - start - 0.001)
+
+    ticker_task = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    if tokenizer:
+        await asyncio.gather(*(replay_service(conversation, tokenizer) for conversation in conversations))
+        encoded = tokenizer.stats()["misses"]
+    else:
+        encoded = sum(await asyncio.gather(*(replay_baseline(conversation) for conversation in conversations)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await ticker_task
+
+    stats = tokenizer.stats() if tokenizer else {}
+    if tokenizer:
+        tokenizer.close()
+    return {
+        "mode": mode,
+        "total_ms": elapsed * 1000,
+        "max_stall_ms": longest_stall * 1000,
+        "encoded": encoded,
+        "cache_hits": stats.get("hits", 0),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    conversations = [synthetic_conversation(rng, args.turns) for _ in range(args.conversations)]
+    tiktoken.get_encoding("cl100k_base")
+
+    results = [await run(conversations, "baseline"), await run(conversations, "service")]
+
+    chars = sum(len(m["content"]) for c in conversations for m in c)
+    print(f"{args.conversations} conversations x {args.turns} turns ({chars / args.conversations / 1000:.0f}k chars each at the last turn)")
+    print(f"{'mode':<9} {'total ms':>9} {'max stall ms':>13} {'encoded':>8} {'cache hits':>11}")
+    for r in results:
+        print(f"{r['mode']:<9} {r['total_ms']:>9.1f} {r['max_stall_ms']:>13.1f} {r['encoded']:>8} {r['cache_hits']:>11}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
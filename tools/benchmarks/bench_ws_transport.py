@@ -0,0 +1,206 @@
+"""
+Chat turns over HTTPS NDJSON POSTs vs. one multiplexed /ws connection.
+
+Serves app.py with hypercorn over TLS (self-signed certificate) in front of the local
+Azure OpenAI and Cosmos DB stand-ins, then has a number of users each run a number of
+chat turns (the /conversation operation) three ways: a new HTTPS connection per turn
+(a POST after the previous connection was dropped), POSTs over a keep-alive
+connection, and turns over one /ws connection per user. Reports the TCP+TLS
+connections opened, the time they took to set up, and the time to first event and
+per-turn latency.
+
+    python tools/benchmarks/bench_ws_transport.py --users 20 --turns 10 --chunks 50
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import socket
+import ssl
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import aiohttp
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+
+from tools.benchmarks.cosmos_standin import CosmosStandIn
+from tools.benchmarks.openai_standin import OpenAIStandIn
+
+REQUEST_BODY = {"messages": [{"role": "user", "content": "Which catheter sizes are on the approved supplier list?"}]}
+
+
+def configure_environment(openai_endpoint, cosmos_endpoint):
+    # app.py builds its settings on import; everything points at the stand-ins
+    for suffix, model in (("V3", "gpt-35-turbo"), ("V4", "gpt-4o")):
+        os.environ.setdefault(f"AZURE_OPENAI_MODEL_{suffix}", model)
+        os.environ.setdefault(f"AZURE_OPENAI_MODEL_NAME_{suffix}", model)
+        os.environ.setdefault(f"AZURE_OPENAI_ENDPOINT_{suffix}", openai_endpoint)
+        os.environ.setdefault(f"AZURE_OPENAI_KEY_{suffix}", "bench")
+    for name, value in {
+        "DOTENV_PATH": os.devnull,
+        "QUART_SECRET_KEY": "bench",
+        "MS_DEFENDER_ENABLED": "false",
+        "IS_LOCAL": "true",
+        "AZURE_COSMOSDB_ACCOUNT": "bench",
+        "AZURE_COSMOSDB_LOCAL_ENDPOINT": cosmos_endpoint,
+        "AZURE_COSMOSDB_LOCAL_KEY": "YmVuY2hiZW5jaA==",
+        "AZURE_COSMOSDB_DATABASE": "db",
+        "AZURE_COSMOSDB_DATABASE_TOKENS": "tokens",
+        "AZURE_COSMOSDB_DATABASE_PRIVACY_NOTICE": "privacy",
+        "AZURE_COSMOSDB_DATABASE_SETTINGS": "settings",
+        "AZURE_COSMOSDB_CONVERSATIONS_CONTAINER": "conversations",
+        "AZURE_COSMOSDB_CONTAINER_DELETED_CONVOS": "deleted",
+        "AZURE_COSMOSDB_CONTAINER_SHARED_CONVOS": "shared",
+        "AZURE_COSMOSDB_CONTAINER_TOKEN_USAGE": "usage",
+        "AZURE_COSMOSDB_CONTAINER_TOKEN_USER_PRIVILEGES": "privileges",
+        "AZURE_COSMOSDB_CONTAINER_RESPONSES": "responses",
+        "AZURE_COSMOSDB_CONTAINER_SETTINGS": "settings",
+    }.items():
+        os.environ.setdefault(name, value)
+
+
+def self_signed_certificate(directory):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number()).not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    certfile, keyfile = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    with open(certfile, "wb") as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    return certfile, keyfile
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ConnectionTrace:
+    def __init__(self):
+        self.setup_times = []
+        self.config = aiohttp.TraceConfig()
+        self.config.on_connection_create_start.append(self._start)
+        self.config.on_connection_create_end.append(self._end)
+
+    async def _start(self, session, context, params):
+        context.started = time.perf_counter()
+
+    async def _end(self, session, context, params):
+        self.setup_times.append(time.perf_counter() - context.started)
+
+
+async def ndjson_turn(session, base_url):
+    start = time.perf_counter()
+    first = None
+    async with session.post(f"{base_url}/conversation", json=REQUEST_BODY) as response:
+        async for _ in response.content:
+            if first is None:
+                first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+async def run_ndjson(base_url, ssl_context, users, turns, keep_alive):
+    trace = ConnectionTrace()
+    results = []
+
+    async def user():
+        connector = aiohttp.TCPConnector(ssl=ssl_context, force_close=not keep_alive)
+        async with aiohttp.ClientSession(connector=connector, trace_configs=[trace.config]) as session:
+            for _ in range(turns):
+                results.append(await ndjson_turn(session, base_url))
+
+    await asyncio.gather(*(user() for _ in range(users)))
+    return trace.setup_times, results
+
+
+async def run_websocket(base_url, ssl_context, users, turns):
+    trace = ConnectionTrace()
+    results = []
+
+    async def user():
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=ssl_context), trace_configs=[trace.config]) as session:
+            async with session.ws_connect(f"{base_url.replace('https', 'wss')}/ws") as ws:
+                for turn in range(turns):
+                    start = time.perf_counter()
+                    first = None
+                    await ws.send_str(json.dumps({"id": str(turn), "type": "conversation", "body": REQUEST_BODY}))
+                    async for message in ws:
+                        frame = json.loads(message.data)
+                        if first is None:
+                            first = time.perf_counter() - start
+                        if frame["type"] in ("end", "error", "result"):
+                            break
+                    results.append((first, time.perf_counter() - start))
+
+    await asyncio.gather(*(user() for _ in range(users)))
+    return trace.setup_times, results
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--chunks", type=int, default=50, help="deltas per answer")
+    parser.add_argument("--chunk-delay-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    async with OpenAIStandIn(chunks=args.chunks, chunk_delay_ms=args.chunk_delay_ms) as openai_standin, CosmosStandIn() as cosmos_standin:
+        configure_environment(openai_standin.endpoint, cosmos_standin.endpoint)
+        import app as appmod
+
+        with tempfile.TemporaryDirectory() as directory:
+            config = Config()
+            config.certfile, config.keyfile = self_signed_certificate(directory)
+            port = free_port()
+            config.bind = [f"127.0.0.1:{port}"]
+            config.accesslog = None
+            shutdown = asyncio.Event()
+            server = asyncio.ensure_future(serve(appmod.app, config, shutdown_trigger=shutdown.wait))
+            base_url = f"https://127.0.0.1:{port}"
+            ssl_context = ssl.create_default_context(cafile=config.certfile)
+            ssl_context.check_hostname = False
+
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=ssl_context)) as warmup:
+                for _ in range(50):
+                    try:
+                        await ndjson_turn(warmup, base_url)
+                        break
+                    except aiohttp.ClientConnectorError:
+                        await asyncio.sleep(0.1)
+
+            results = {
+                "ndjson, new connection": await run_ndjson(base_url, ssl_context, args.users, args.turns, keep_alive=False),
+                "ndjson, keep-alive": await run_ndjson(base_url, ssl_context, args.users, args.turns, keep_alive=True),
+                "websocket": await run_websocket(base_url, ssl_context, args.users, args.turns),
+            }
+            shutdown.set()
+            await server
+
+    print(f"{args.users} users x {args.turns} turns, {args.chunks} deltas per answer, TLS on loopback")
+    print(f"{'transport':<24} {'connections':>12} {'setup ms total':>15} {'first event p50 ms':>19} {'turn p50 ms':>12} {'turn p95 ms':>12}")
+    for name, (setup_times, turns) in results.items():
+        first = statistics.median(f for f, _ in turns) * 1000
+        totals = sorted(t for _, t in turns)
+        p95 = totals[int(len(totals) * 0.95) - 1] * 1000
+        print(f"{name:<24} {len(setup_times):>12} {sum(setup_times) * 1000:>15.1f} {first:>19.2f} {statistics.median(totals) * 1000:>12.2f} {p95:>12.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
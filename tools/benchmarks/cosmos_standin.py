@@ -0,0 +1,387 @@
+"""
+Local HTTP stand-in for the Cosmos DB SQL API, used by the benchmarks in this folder.
+
+It speaks just enough of the REST protocol for azure.cosmos.aio to run point reads,
+writes, patches, deletes, transactional batches and simple SQL queries against
+in-memory containers (rejecting items over Cosmos's 2 MB limit), and it records what the app did to it: TCP connections
+accepted, requests per operation and a simulated request-unit (RU) charge. The RU model is a rough approximation of the
+real service's pricing (point read ~1 RU, writes scale with size, queries scale with
+the documents they touch) so numbers are only meaningful relative to each other.
+
+Optional latency injection emulates a remote account: `rtt_ms` is added to every
+request and `handshake_ms` to the first request on each new connection (TLS setup).
+Containers are partitioned on `partition_key_path` unless `partition_key_paths` maps
+their name to another path; `physical_partitions` sets how many partitions a
+cross-partition query fans out to (each is billed the base query charge).
+"""
+import asyncio
+import base64
+import json
+import re
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+COSMOS_KEY = base64.b64encode(b"standin-master-key").decode()
+
+_CONDITION = re.compile(
+    r"^\s*c\.(?P<field>\w+)\s*(?P<op>=|!=|<>|<=|>=|<|>)\s*(?P<value>@\w+|'[^']*'|\"[^\"]*\"|-?\d+(?:\.\d+)?|true|false)\s*$",
+    re.IGNORECASE,
+)
+_ARRAY_CONTAINS = re.compile(r"^\s*ARRAY_CONTAINS\(\s*(?P<value>@\w+)\s*,\s*c\.(?P<field>\w+)\s*\)\s*$", re.IGNORECASE)
+_BETWEEN = re.compile(r"c\.(\w+)\s+BETWEEN\s+(@\w+)\s+AND\s+(@\w+)", re.IGNORECASE)
+_QUERY = re.compile(
+    r"^\s*SELECT\s+(?P<projection>.+?)\s+FROM\s+c"
+    r"(?:\s+WHERE\s+(?P<where>.+?))?"
+    r"(?:\s+ORDER\s+BY\s+c\.(?P<order_field>\w+)(?:\s+(?P<order_dir>ASC|DESC))?)?"
+    r"(?:\s+OFFSET\s+(?P<offset>\d+)\s+LIMIT\s+(?P<limit>\d+))?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+MAX_ITEM_BYTES = 2 * 1024 * 1024
+
+
+def _doc_size_kb(doc):
+    return len(json.dumps(doc)) / 1024
+
+
+class CosmosStandIn:
+    def __init__(self, host="127.0.0.1", port=0, rtt_ms=0.0, handshake_ms=0.0, partition_key_path="/userId", partition_key_paths=None, physical_partitions=1):
+        self.host = host
+        self.port = port
+        self.rtt_ms = rtt_ms
+        self.handshake_ms = handshake_ms
+        self.partition_key_path = partition_key_path
+        self.partition_key_paths = partition_key_paths or {}
+        self.physical_partitions = physical_partitions
+        self.containers = defaultdict(dict)
+        self.connections = set()
+        self.operations = Counter()
+        self.request_charge = 0.0
+        self._runner = None
+
+    @property
+    def endpoint(self):
+        return f"http://{self.host}:{self.port}/"
+
+    @property
+    def key(self):
+        return COSMOS_KEY
+
+    def reset_counters(self):
+        self.connections.clear()
+        self.operations.clear()
+        self.request_charge = 0.0
+
+    def seed(self, database, container, docs):
+        store = self.containers[(database, container)]
+        for doc in docs:
+            store[(self._pk_of(container, doc), doc["id"])] = dict(doc)
+
+    def stats(self):
+        return {
+            "connections": len(self.connections),
+            "requests": sum(self.operations.values()),
+            "operations": dict(self.operations),
+            "request_charge": round(self.request_charge, 2),
+        }
+
+    async def __aenter__(self):
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_route("*", "/{tail:.*}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._runner.cleanup()
+
+    def _pk_path(self, container):
+        return self.partition_key_paths.get(container, self.partition_key_path)
+
+    def _pk_of(self, container, doc):
+        return doc.get(self._pk_path(container).strip("/"))
+
+    def _charge(self, operation, ru):
+        self.operations[operation] += 1
+        self.request_charge += ru
+        return {"x-ms-request-charge": f"{ru:.2f}", "x-ms-session-token": "0:1#1"}
+
+    @staticmethod
+    def _not_found(headers):
+        return web.json_response({"code": "NotFound", "message": "Entity with the specified id does not exist in the system."}, status=404, headers=headers)
+
+    async def _handle(self, request):
+        peer = request.transport.get_extra_info("peername") if request.transport else None
+        first_on_connection = peer not in self.connections
+        self.connections.add(peer)
+        delay = self.rtt_ms + (self.handshake_ms if first_on_connection else 0)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+
+        body = await request.read()
+        parts = [p for p in request.path.split("/") if p]
+        if not parts:
+            self.operations["account"] += 1
+            return web.json_response({
+                "id": "standin",
+                "writableLocations": [{"name": "local", "databaseAccountEndpoint": self.endpoint}],
+                "readableLocations": [{"name": "local", "databaseAccountEndpoint": self.endpoint}],
+                "enableMultipleWriteLocations": False,
+                "userConsistencyPolicy": {"defaultConsistencyLevel": "Session"},
+                "userReplicationPolicy": {},
+                "systemReplicationPolicy": {},
+                "readPolicy": {},
+                "queryEngineConfiguration": "{}",
+            })
+
+        database, container = parts[1], parts[3] if len(parts) > 3 else None
+        if len(parts) == 4:
+            headers = self._charge("read_container", 1.0)
+            return web.json_response({
+                "id": container,
+                "_rid": f"{database}.{container}",
+                "_self": request.path,
+                "partitionKey": {"paths": [self._pk_path(container)], "kind": "Hash"},
+            }, headers=headers)
+
+        if parts[4] == "pkranges":
+            headers = self._charge("pkranges", 1.0)
+            return web.json_response({"_rid": container, "PartitionKeyRanges": [{"id": "0", "minInclusive": "", "maxExclusive": "FF"}], "_count": 1}, headers=headers)
+
+        store = self.containers[(database, container)]
+        pk_header = request.headers.get("x-ms-documentdb-partitionkey")
+        partition_key = json.loads(pk_header)[0] if pk_header else None
+
+        if len(parts) == 6:
+            return self._handle_item(request, store, partition_key, parts[5], body)
+
+        if request.headers.get("x-ms-documentdb-isquery", "").lower() == "true":
+            return self._handle_query(request, store, partition_key, json.loads(body))
+
+        if request.headers.get("x-ms-cosmos-is-batch-request", "").lower() == "true":
+            return self._handle_batch(store, partition_key, json.loads(body))
+
+        if len(body) > MAX_ITEM_BYTES:
+            return web.json_response({"code": "RequestEntityTooLarge", "message": "Request size is too large"}, status=413)
+        doc = json.loads(body)
+        key = (self._pk_of(container, doc), doc["id"])
+        is_upsert = request.headers.get("x-ms-documentdb-is-upsert", "").lower() == "true"
+        if key in store and not is_upsert:
+            return web.json_response({"code": "Conflict", "message": "Resource with specified id already exists."}, status=409)
+        doc.update({"_ts": int(time.time()), "_etag": f"\"{time.monotonic_ns()}\""})
+        store[key] = doc
+        headers = self._charge("upsert" if is_upsert else "create", 5.0 + 2.0 * _doc_size_kb(doc))
+        return web.json_response(doc, status=201, headers=headers)
+
+    def _handle_item(self, request, store, partition_key, item_id, body):
+        key = (partition_key, item_id)
+        if request.method == "GET":
+            headers = self._charge("read", 1.0)
+            if key not in store:
+                return self._not_found(headers)
+            return web.json_response(store[key], headers=headers)
+
+        if request.method == "DELETE":
+            headers = self._charge("delete", 5.0)
+            if store.pop(key, None) is None:
+                return self._not_found(headers)
+            return web.Response(status=204, headers=headers)
+
+        if request.method == "PUT":
+            doc = json.loads(body)
+            headers = self._charge("replace", 5.0 + 2.0 * _doc_size_kb(doc))
+            if key not in store:
+                return self._not_found(headers)
+            store[key] = doc
+            return web.json_response(doc, headers=headers)
+
+        if request.method == "PATCH":
+            patch = json.loads(body)
+            operations = patch["operations"]
+            headers = self._charge("patch", 5.0 + 0.5 * len(operations))
+            if key not in store:
+                return self._not_found(headers)
+            if patch.get("condition") and not self._matches_condition(store[key], patch["condition"]):
+                return web.json_response({"code": "PreconditionFailed", "message": "Precondition not met."}, status=412, headers=headers)
+            doc = store[key]
+            self._apply_patch(doc, operations)
+            return web.json_response(doc, headers=headers)
+
+        return web.json_response({"code": "BadRequest", "message": f"Unsupported method {request.method}"}, status=400)
+
+    @staticmethod
+    def _apply_patch(doc, operations):
+        for operation in operations:
+            field = operation["path"].lstrip("/")
+            if operation["op"] == "incr":
+                doc[field] = doc.get(field, 0) + operation["value"]
+            elif operation["op"] in ("set", "add", "replace"):
+                doc[field] = operation["value"]
+            elif operation["op"] == "remove":
+                doc.pop(field, None)
+        doc["_etag"] = f"\"{time.monotonic_ns()}\""
+
+    def _matches_condition(self, doc, condition):
+        # Patch filter predicates, e.g. "from c where c.type = 'conversation'"
+        where = re.split(r"\s+WHERE\s+", condition, maxsplit=1, flags=re.IGNORECASE)[-1]
+        for clause in re.split(r"\s+AND\s+", where, flags=re.IGNORECASE):
+            cond = _CONDITION.match(clause.strip().strip("()"))
+            if not cond or not self._compare(doc.get(cond.group("field")), cond.group("op"), self._literal(cond.group("value"), {})):
+                return False
+        return True
+
+    def _handle_batch(self, store, partition_key, operations):
+        # Transactional batch: every operation runs against a scratch copy of the partition
+        # and nothing is kept unless they all succeed (the service answers 207 on failure)
+        staged = {}
+        results = []
+        failed = False
+        for operation in operations:
+            if failed:
+                results.append({"statusCode": 424, "requestCharge": 0})
+                continue
+
+            kind = operation["operationType"]
+            if kind in ("Create", "Upsert"):
+                doc = dict(operation["resourceBody"])
+                key = (partition_key, doc["id"])
+                exists = staged.get(key, store.get(key)) is not None
+                if kind == "Create" and exists:
+                    status = 409
+                else:
+                    doc.update({"_ts": int(time.time()), "_etag": f"\"{time.monotonic_ns()}\""})
+                    staged[key] = doc
+                    status = 200 if exists else 201
+                ru = 5.0 + 2.0 * _doc_size_kb(doc)
+            else:
+                key = (partition_key, operation["id"])
+                current = staged.get(key, store.get(key))
+                ru = 1.0 if kind == "Read" else 5.0
+                if current is None:
+                    status, doc = 404, None
+                elif kind == "Read":
+                    status, doc = 200, current
+                elif kind == "Delete":
+                    status, doc = 204, None
+                    staged[key] = None
+                elif kind == "Replace":
+                    status, doc = 200, dict(operation["resourceBody"])
+                    staged[key] = doc
+                elif kind == "Patch":
+                    condition = operation["resourceBody"].get("condition")
+                    if condition and not self._matches_condition(current, condition):
+                        status, doc = 412, None
+                    else:
+                        doc = dict(current)
+                        self._apply_patch(doc, operation["resourceBody"]["operations"])
+                        staged[key] = doc
+                        status = 200
+                        ru += 0.5 * len(operation["resourceBody"]["operations"])
+                else:
+                    status, doc = 400, None
+
+            failed = status >= 400
+            result = {"statusCode": status, "requestCharge": ru}
+            if doc is not None and not failed:
+                result["resourceBody"] = doc
+                result["eTag"] = doc.get("_etag")
+            results.append(result)
+
+        if failed:
+            for result in results:
+                if result["statusCode"] < 400:
+                    result["statusCode"] = 424
+                    result.pop("resourceBody", None)
+        else:
+            for key, doc in staged.items():
+                if doc is None:
+                    store.pop(key, None)
+                else:
+                    store[key] = doc
+
+        headers = self._charge("batch", sum(result["requestCharge"] for result in results))
+        return web.json_response(results, status=207 if failed else 200, headers=headers)
+
+    def _handle_query(self, request, store, partition_key, query_spec):
+        query = query_spec["query"]
+        parameters = {p["name"]: p["value"] for p in query_spec.get("parameters", [])}
+        match = _QUERY.match(query)
+        if not match:
+            return web.json_response({"code": "BadRequest", "message": f"Unsupported query: {query}"}, status=400)
+
+        conditions = []
+        where = match.group("where")
+        if where:
+            where = _BETWEEN.sub(lambda m: f"c.{m.group(1)} >= {m.group(2)} AND c.{m.group(1)} <= {m.group(3)}", where)
+            for clause in re.split(r"\s+AND\s+", where, flags=re.IGNORECASE):
+                contains = _ARRAY_CONTAINS.match(clause)
+                if contains:
+                    conditions.append((contains.group("field"), "in", self._literal(contains.group("value"), parameters)))
+                    continue
+                cond = _CONDITION.match(clause.strip().strip("()"))
+                if not cond:
+                    return web.json_response({"code": "BadRequest", "message": f"Unsupported condition: {clause}"}, status=400)
+                conditions.append((cond.group("field"), cond.group("op"), self._literal(cond.group("value"), parameters)))
+
+        scope = [doc for (pk, _), doc in store.items() if partition_key is None or pk == partition_key]
+        results = [doc for doc in scope if all(self._compare(doc.get(f), op, v) for f, op, v in conditions)]
+        if match.group("order_field"):
+            field = match.group("order_field")
+            results.sort(key=lambda d: (d.get(field) is None, d.get(field)), reverse=(match.group("order_dir") or "ASC").upper() == "DESC")
+
+        skipped = 0
+        if match.group("offset") is not None:
+            skipped = min(int(match.group("offset")), len(results))
+            results = results[skipped:skipped + int(match.group("limit"))]
+
+        projection = match.group("projection").strip()
+        if projection != "*":
+            fields = [f.strip()[2:] for f in projection.split(",")]
+            results = [{f: doc[f] for f in fields if f in doc} for doc in results]
+
+        start = 0
+        continuation = request.headers.get("x-ms-continuation")
+        if continuation:
+            start = json.loads(base64.b64decode(continuation))["position"]
+        page_size = int(request.headers.get("x-ms-max-item-count", "-1"))
+        end = len(results) if page_size <= 0 else start + page_size
+        page = results[start:end]
+
+        # Every document the engine had to load is billed; skipped OFFSET rows still get read,
+        # while a continuation token resumes where the previous page stopped
+        loaded = len(scope) if not conditions else skipped + len(page)
+        ru = 2.3 + 0.05 * loaded + 0.4 * sum(_doc_size_kb(d) for d in page)
+        if partition_key is None:
+            ru += 1.0 + 2.3 * (self.physical_partitions - 1)
+        headers = self._charge("query", ru)
+        if end < len(results):
+            headers["x-ms-continuation"] = base64.b64encode(json.dumps({"position": end}).encode()).decode()
+        return web.json_response({"_rid": "standin", "Documents": page, "_count": len(page)}, headers=headers)
+
+    @staticmethod
+    def _literal(token, parameters):
+        if token.startswith("@"):
+            return parameters.get(token)
+        if token[0] in "'\"":
+            return token[1:-1]
+        if token.lower() in ("true", "false"):
+            return token.lower() == "true"
+        return float(token) if "." in token else int(token)
+
+    @staticmethod
+    def _compare(actual, op, expected):
+        if op == "=":
+            return actual == expected
+        if op == "in":
+            return actual in (expected or ())
+        if op in ("!=", "<>"):
+            return actual != expected
+        if actual is None or expected is None:
+            return False
+        return {"<": actual < expected, ">": actual > expected, "<=": actual <= expected, ">=": actual >= expected}[op]
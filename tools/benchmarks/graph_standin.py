@@ -0,0 +1,69 @@
+"""
+Local HTTP stand-in for the Microsoft Graph /me/transitiveMemberOf API, used by the
+group resolver tests and benchmarks.
+
+Each bearer token maps to a list of group ids that is served in pages of `page_size`
+with @odata.nextLink continuation links, the way Graph pages large memberships.
+`delay_ms` slows every page down to emulate a struggling Graph; tokens that are not
+registered get a 401.
+"""
+import asyncio
+from collections import Counter
+
+from aiohttp import web
+
+
+class GraphStandIn:
+    def __init__(self, host="127.0.0.1", port=0, page_size=100, delay_ms=0.0):
+        self.host = host
+        self.port = port
+        self.page_size = page_size
+        self.delay_ms = delay_ms
+        self.memberships = {}
+        self.connections = set()
+        self.counters = Counter()
+        self._runner = None
+
+    @property
+    def endpoint(self):
+        return f"http://{self.host}:{self.port}/v1.0"
+
+    def add_user(self, token, group_ids):
+        self.memberships[token] = list(group_ids)
+
+    def stats(self):
+        return {"connections": len(self.connections), **self.counters}
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/v1.0/me/transitiveMemberOf", self._transitive_member_of)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._runner.cleanup()
+
+    async def _transitive_member_of(self, request):
+        self.connections.add(request.transport.get_extra_info("peername") if request.transport else None)
+        self.counters["requests"] += 1
+        if self.delay_ms:
+            await asyncio.sleep(self.delay_ms / 1000)
+
+        token = request.headers.get("Authorization", "").split(" ", 1)[-1]
+        if token not in self.memberships:
+            return web.json_response({"error": {"code": "InvalidAuthenticationToken"}}, status=401)
+
+        page_size = min(self.page_size, int(request.query.get("$top", self.page_size)))
+        skip = int(request.query.get("$skiptoken", 0))
+        groups = self.memberships[token]
+        page = {
+            "@odata.context": "https://graph.microsoft.com/v1.0/$metadata#directoryObjects(id)",
+            "value": [{"@odata.type": "#microsoft.graph.group", "id": group_id} for group_id in groups[skip:skip + page_size]],
+        }
+        if skip + page_size < len(groups):
+            page["@odata.nextLink"] = f"{self.endpoint}/me/transitiveMemberOf?$select=id&$top={page_size}&$skiptoken={skip + page_size}"
+        return web.json_response(page)
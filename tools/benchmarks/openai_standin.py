@@ -0,0 +1,104 @@
+"""
+Local HTTP stand-in for the Azure OpenAI chat completions API, used by the benchmarks
+in this folder.
+
+Serves .../openai/deployments/<deployment>/chat/completions either as one JSON body or
+as a server-sent event stream of small deltas (the way the real service streams, with
+one- or two-word chunks), optionally followed by the usage chunk requested through
+stream_options.include_usage. It counts the TCP connections and requests it sees and
+how many streams were abandoned by the client before the last chunk was written.
+"""
+import asyncio
+import json
+import time
+from collections import Counter
+
+from aiohttp import web
+
+WORDS = "the quick brown fox jumps over the lazy dog while the model keeps talking".split()
+
+
+class OpenAIStandIn:
+    def __init__(self, host="127.0.0.1", port=0, chunks=200, chunk_delay_ms=0.0, rtt_ms=0.0, handshake_ms=0.0):
+        self.host = host
+        self.port = port
+        self.chunks = chunks
+        self.chunk_delay_ms = chunk_delay_ms
+        self.rtt_ms = rtt_ms
+        self.handshake_ms = handshake_ms
+        self.connections = set()
+        self.counters = Counter()
+        self._runner = None
+
+    @property
+    def endpoint(self):
+        return f"http://{self.host}:{self.port}/"
+
+    def reset_counters(self):
+        self.connections.clear()
+        self.counters.clear()
+
+    def stats(self):
+        return {"connections": len(self.connections), **self.counters}
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post("/{tail:.*}/chat/completions", self._chat_completions)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._runner.cleanup()
+
+    def _envelope(self, model, obj="chat.completion.chunk"):
+        return {"id": "chatcmpl-standin", "object": obj, "created": int(time.time()), "model": model}
+
+    async def _chat_completions(self, request):
+        peer = request.transport.get_extra_info("peername") if request.transport else None
+        first_on_connection = peer not in self.connections
+        self.connections.add(peer)
+        self.counters["requests"] += 1
+        delay = self.rtt_ms + (self.handshake_ms if first_on_connection else 0)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+
+        body = await request.json()
+        model = body.get("model", "gpt-35-turbo")
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+        words = [WORDS[i % len(WORDS)] + " " for i in range(self.chunks)]
+
+        if not body.get("stream"):
+            self.counters["completions"] += 1
+            return web.json_response({
+                **self._envelope(model, "chat.completion"),
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "".join(words)}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "apim-request-id": "standin"})
+        await response.prepare(request)
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+        try:
+            first = {**self._envelope(model), "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(first)}\n\n".encode())
+            for word in words:
+                if self.chunk_delay_ms:
+                    await asyncio.sleep(self.chunk_delay_ms / 1000)
+                chunk = {**self._envelope(model), "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.counters["chunks_sent"] += 1
+            last = {**self._envelope(model), "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            await response.write(f"data: {json.dumps(last)}\n\n".encode())
+            if include_usage:
+                usage = {**self._envelope(model), "choices": [], "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)}}
+                await response.write(f"data: {json.dumps(usage)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            self.counters["streams_completed"] += 1
+        except (ConnectionResetError, asyncio.CancelledError):
+            self.counters["streams_abandoned"] += 1
+            raise
+        return response
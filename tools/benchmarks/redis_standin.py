@@ -0,0 +1,156 @@
+"""
+Local Redis-protocol (RESP2) stand-in, used by the conversation cache tests and
+benchmarks in place of a real Redis.
+
+It understands the handful of commands redis-py sends for GET/MGET/SET/DEL/INCR/PEXPIRE
+and WATCH/MULTI/EXEC transactions (plus the connection handshake), keeps values in
+memory with PX/EX expiry, and counts commands and connections. `rtt_ms` is added to
+every command to emulate a remote cache.
+"""
+import asyncio
+import time
+from collections import Counter
+
+
+class RedisStandIn:
+    def __init__(self, host="127.0.0.1", port=0, rtt_ms=0.0):
+        self.host = host
+        self.port = port
+        self.rtt_ms = rtt_ms
+        self.data = {}
+        self.connections = 0
+        self.commands = Counter()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"redis://{self.host}:{self.port}/0"
+
+    def stats(self):
+        return {"connections": self.connections, "keys": len(self.data), "commands": dict(self.commands)}
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        # Per connection: the watched keys with their values when watched, and the
+        # commands queued since MULTI
+        session = {"watched": {}, "queued": None}
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                if self.rtt_ms:
+                    await asyncio.sleep(self.rtt_ms / 1000)
+                writer.write(self._execute_in_session(session, command))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_command(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.strip().split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def _get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def _execute_in_session(self, session, args):
+        name = args[0].decode().upper()
+        if name == "WATCH":
+            self.commands[name] += 1
+            session["watched"].update({key: self._get(key) for key in args[1:]})
+            return b"+OK\r\n"
+        if name == "UNWATCH":
+            self.commands[name] += 1
+            session["watched"] = {}
+            return b"+OK\r\n"
+        if name == "MULTI":
+            self.commands[name] += 1
+            session["queued"] = []
+            return b"+OK\r\n"
+        if name == "DISCARD":
+            self.commands[name] += 1
+            session["queued"], session["watched"] = None, {}
+            return b"+OK\r\n"
+        if name == "EXEC":
+            self.commands[name] += 1
+            queued, watched = session["queued"] or [], session["watched"]
+            session["queued"], session["watched"] = None, {}
+            if any(self._get(key) != value for key, value in watched.items()):
+                return b"*-1\r\n"
+            return b"*%d\r\n" % len(queued) + b"".join(self._execute(command) for command in queued)
+        if session["queued"] is not None:
+            session["queued"].append(args)
+            return b"+QUEUED\r\n"
+        return self._execute(args)
+
+    @staticmethod
+    def _bulk(value):
+        return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def _execute(self, args):
+        name = args[0].decode().upper()
+        self.commands[name] += 1
+        if name == "PING":
+            return b"+PONG\r\n"
+        if name in ("CLIENT", "SELECT", "AUTH"):
+            return b"+OK\r\n"
+        if name == "GET":
+            return self._bulk(self._get(args[1]))
+        if name == "MGET":
+            return b"*%d\r\n" % len(args[1:]) + b"".join(self._bulk(self._get(key)) for key in args[1:])
+        if name == "SET":
+            expires_at = None
+            options = [a.decode().upper() for a in args[3:]]
+            for option, amount in zip(options, args[4:]):
+                if option == "PX":
+                    expires_at = time.monotonic() + int(amount) / 1000
+                elif option == "EX":
+                    expires_at = time.monotonic() + int(amount)
+            self.data[args[1]] = (args[2], expires_at)
+            return b"+OK\r\n"
+        if name in ("INCR", "INCRBY"):
+            value = self._get(args[1])
+            expires_at = self.data[args[1]][1] if value is not None else None
+            count = int(value or 0) + (int(args[2]) if name == "INCRBY" else 1)
+            self.data[args[1]] = (b"%d" % count, expires_at)
+            return b":%d\r\n" % count
+        if name == "PEXPIRE":
+            value = self._get(args[1])
+            if value is None:
+                return b":0\r\n"
+            self.data[args[1]] = (value, time.monotonic() + int(args[2]) / 1000)
+            return b":1\r\n"
+        if name in ("DEL", "UNLINK"):
+            removed = sum(1 for key in args[1:] if self._get(key) is not None and self.data.pop(key))
+            return b":%d\r\n" % removed
+        if name == "FLUSHDB":
+            self.data.clear()
+            return b"+OK\r\n"
+        return b"-ERR unknown command '%s'\r\n" % name.encode()